@@ -0,0 +1,370 @@
+"""
+Runs the lambda handlers (ingest, then the trakt writer over what it
+published) end to end against local stand-ins for the Guardian, Trakt and
+AWS (see stand_ins.py), and reports wall time, request counts and peak
+memory for each scenario.
+
+    python benchmarks/e2e.py
+    python benchmarks/e2e.py --scenario daily --save results.json
+    python benchmarks/e2e.py --compare results.json
+
+Each run gets a lambda context with the function's timeout. When the
+handler stops early to beat it, it's invoked again (as CONTINUE_IMMEDIATELY
+does when deployed) until it gets through every page.
+
+With --compare the run fails if a scenario got slower, used more memory or
+made more requests than in the saved results (beyond --tolerance), or if
+more invocations overran their timeout.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import ExitStack
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from unittest import mock
+
+from stand_ins import (
+    GuardianServer,
+    LambdaStub,
+    SQSStub,
+    SSMStub,
+    SecretsManagerStub,
+    TraktServer,
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+# app reads these at import.
+os.environ.setdefault("MANUAL_PROCESSING_QUEUE_URL", "https://sqs.benchmark/queue")
+os.environ.setdefault("RESOLVED_IDS_QUEUE_URL", "https://sqs.benchmark/resolved")
+# Without this the handler asks for a date on the command line.
+os.environ.setdefault("AWS_LAMBDA_FUNCTION_NAME", "benchmark")
+
+import app  # noqa: E402
+import aws_utils  # noqa: E402
+import guardian_api  # noqa: E402
+import rate_limit  # noqa: E402
+import trakt_api  # noqa: E402
+import trakt_writer  # noqa: E402
+
+DEFAULT_OUTPUT = os.path.join(ROOT, "benchmarks", "results", "e2e.json")
+# As the writer's event source is configured in template.yaml.
+WRITER_BATCH_SIZE = 100
+# The ingest function's timeout in template.yaml.
+LAMBDA_TIMEOUT = 30
+# Give up on a scenario that still isn't done after this many invocations.
+MAX_INVOCATIONS = 50
+
+
+class Context:
+    """
+    Enough of a lambda context for the handler, counting down from timeout.
+    """
+
+    invoked_function_arn = "arn:aws:lambda:eu-west-2:000000000000:function:benchmark"
+
+    def __init__(self, timeout: float):
+        self.deadline = time.monotonic() + timeout
+
+    def get_remaining_time_in_millis(self) -> int:
+        return int(max(self.deadline - time.monotonic(), 0) * 1000)
+
+
+@dataclass
+class Scenario:
+    name: str
+    description: str
+    reviews: int = 20
+    untagged_every: int = 10
+    list_size: int = 100
+    max_list_size: int = 5000
+    latency: float = 0.01
+    throttle_every: int = 0
+    # Rotate the access token after this many trakt requests.
+    rotate_after: int = 0
+    timeout: float = LAMBDA_TIMEOUT
+    # Trakt only allows one write a second, and 1000 reads every five
+    # minutes. That makes big scenarios very slow, so unless real_rate_limits
+    # is set requests are allowed this often (per second).
+    write_rate: float = 20
+    read_rate: float = 1000
+
+
+SCENARIOS = {
+    scenario.name: scenario
+    for scenario in [
+        Scenario("daily", "A day's reviews, a small list."),
+        Scenario(
+            "backfill",
+            "50 full pages of reviews, a list at its limit.",
+            reviews=50 * guardian_api.MAX_PAGE_SIZE,
+            list_size=5000,
+        ),
+        Scenario(
+            "rate_limited",
+            "Trakt answers every 10th request with a 429.",
+            reviews=1000,
+            throttle_every=10,
+        ),
+        Scenario(
+            "token_rotation",
+            "The trakt token is rotated part way through.",
+            reviews=1000,
+            rotate_after=20,
+        ),
+    ]
+}
+
+
+@dataclass
+class Result:
+    scenario: str
+    wall_time: float = 0.0
+    peak_memory: int = 0
+    guardian_requests: dict = field(default_factory=dict)
+    trakt_requests: dict = field(default_factory=dict)
+    aws_calls: dict = field(default_factory=dict)
+    messages_queued: int = 0
+    list_size: int = 0
+    invocations: int = 0
+    # Invocations that ran past the timeout, and would have been killed.
+    overruns: int = 0
+
+    @property
+    def requests(self) -> int:
+        return sum(self.guardian_requests.values()) + sum(self.trakt_requests.values())
+
+
+def secrets(scenario: Scenario, access_token: str) -> dict:
+    return {
+        "GuardianAPI": {"API_KEY": "benchmark"},
+        "TraktAPI": {
+            "ACCESS_TOKEN": access_token,
+            "CLIENT_ID": "benchmark",
+            "USER_ID": "benchmark",
+            "LIST_ID": "benchmark",
+            "MAX_LIST_SIZE": str(scenario.max_list_size),
+        },
+    }
+
+
+def run(scenario: Scenario, real_rate_limits: bool = False) -> Result:
+    result = Result(scenario.name)
+    with ExitStack() as stack:
+        guardian = stack.enter_context(
+            GuardianServer(
+                reviews=scenario.reviews,
+                untagged_every=scenario.untagged_every,
+                latency=scenario.latency,
+            )
+        )
+        trakt = stack.enter_context(
+            TraktServer(
+                list_size=scenario.list_size,
+                throttle_every=scenario.throttle_every,
+                latency=scenario.latency,
+            )
+        )
+        tmp_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        clients = {
+            "ssm": SSMStub({app.LAST_SUCCESS_PARAMETER: "2024-01-01"}),
+            "secretsmanager": SecretsManagerStub(secrets(scenario, trakt.access_token)),
+            "sqs": SQSStub(),
+            "lambda": LambdaStub(),
+        }
+
+        def get_client(service_name, region_name=None):
+            return clients[service_name]
+
+        if scenario.rotate_after:
+            # Plays the part of the token rotator.
+            respond = trakt.respond
+
+            def respond_and_rotate(*args):
+                if sum(trakt.requests.values()) == scenario.rotate_after:
+                    token = trakt.rotate_token()
+                    clients["secretsmanager"].update_secret(
+                        "TraktAPI", json.dumps(secrets(scenario, token)["TraktAPI"])
+                    )
+                return respond(*args)
+
+            trakt.respond = respond_and_rotate
+
+        patches = [
+            mock.patch("aws_utils.get_client", get_client),
+            mock.patch("app.get_client", get_client),
+            mock.patch("guardian_api.SEARCH_URL", guardian.url + "/search"),
+            mock.patch("trakt_api.BASE_URL", trakt.url),
+            mock.patch.dict(
+                "os.environ",
+                {
+                    "GOODFILMS_LIST_SNAPSHOT": os.path.join(tmp_dir, "snapshot.json"),
+                    "GOODFILMS_PAGE_CACHE": os.path.join(tmp_dir, "pages"),
+                },
+            ),
+        ]
+        os.environ.pop("GOODFILMS_SEARCH_CACHE", None)
+        os.environ.pop("CONTINUE_IMMEDIATELY", None)
+        if not real_rate_limits:
+            read_bucket = rate_limit.TokenBucket(scenario.read_rate, 1)
+            write_bucket = rate_limit.TokenBucket(scenario.write_rate, 1)
+            patches.append(mock.patch("trakt_api.GET_BUCKET", read_bucket))
+            patches.append(mock.patch("trakt_api.POST_BUCKET", write_bucket))
+        for patch in patches:
+            stack.enter_context(patch)
+        # Nothing left over from the last scenario.
+        trakt_api._get_api.cache_clear()
+        aws_utils._secrets.clear()
+        aws_utils._parameters.clear()
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            while True:
+                context = Context(scenario.timeout)
+                app.lambda_handler({}, context)
+                result.invocations += 1
+                if context.get_remaining_time_in_millis() == 0:
+                    result.overruns += 1
+                cursor = clients["ssm"].parameters.get(app.CURSOR_PARAMETER)
+                if not app.parse_cursor(cursor):
+                    break
+                if result.invocations >= MAX_INVOCATIONS:
+                    raise RuntimeError(
+                        f"Not done after {MAX_INVOCATIONS} invocations"
+                    )
+            resolved = clients["sqs"].messages[app.RESOLVED_IDS_QUEUE_URL]
+            for i in range(0, len(resolved), WRITER_BATCH_SIZE):
+                records = [
+                    {"messageId": str(n), "body": body}
+                    for n, body in enumerate(resolved[i:i + WRITER_BATCH_SIZE])
+                ]
+                trakt_writer.lambda_handler({"Records": records}, None)
+        finally:
+            result.wall_time = time.perf_counter() - start
+            result.peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        result.guardian_requests = dict(guardian.requests)
+        result.trakt_requests = dict(trakt.requests)
+        result.aws_calls = {
+            f"{service}.{operation}": count
+            for service, client in clients.items()
+            for operation, count in client.calls.items()
+        }
+        result.messages_queued = len(
+            clients["sqs"].messages[app.MANUAL_PROCESSING_QUEUE_URL]
+        )
+        result.list_size = len(trakt.items)
+    return result
+
+
+def report(result: Result):
+    print(
+        f"{result.scenario}: {result.wall_time:.2f}s, "
+        f"{result.requests} requests, "
+        f"peak memory {result.peak_memory / 1024 / 1024:.1f}MiB"
+    )
+    print(f"  guardian: {result.guardian_requests}")
+    print(f"  trakt:    {result.trakt_requests}")
+    print(f"  aws:      {result.aws_calls}")
+    print(f"  queued {result.messages_queued}, list size {result.list_size}")
+    print(f"  {result.invocations} invocations, {result.overruns} overran")
+
+
+def compare(results: list, baseline_path: str, tolerance: float) -> list:
+    """
+    Returns a description of each regression against the saved results.
+    """
+    with open(baseline_path) as f:
+        baseline = {entry["scenario"]: entry for entry in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        before = baseline.get(result.scenario)
+        if not before:
+            continue
+        measures = {
+            "wall_time": (before["wall_time"], result.wall_time),
+            "peak_memory": (before["peak_memory"], result.peak_memory),
+            "requests": (
+                sum(before["guardian_requests"].values())
+                + sum(before["trakt_requests"].values()),
+                result.requests,
+            ),
+        }
+        if result.overruns > before.get("overruns", 0):
+            regressions.append(
+                f"{result.scenario} overruns: {before.get('overruns', 0)} -> "
+                f"{result.overruns}"
+            )
+        for measure, (old, new) in measures.items():
+            if old and new > old * (1 + tolerance):
+                regressions.append(
+                    f"{result.scenario} {measure}: {old:.6g} -> {new:.6g} "
+                    f"(+{(new / old - 1) * 100:.0f}%)"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--scenario", choices=sorted(SCENARIOS), action="append", dest="scenarios"
+    )
+    parser.add_argument(
+        "--real-rate-limits",
+        action="store_true",
+        help="Use trakt's real write limit (one a second). Slow.",
+    )
+    parser.add_argument(
+        "--save", nargs="?", const=DEFAULT_OUTPUT, help="Write results to a file."
+    )
+    parser.add_argument("--compare", help="Results from an earlier run.")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(stream=sys.stdout)
+    if not args.verbose:
+        logging.disable(logging.WARNING)
+
+    results = []
+    for name in args.scenarios or SCENARIOS:
+        result = run(SCENARIOS[name], real_rate_limits=args.real_rate_limits)
+        report(result)
+        results.append(result)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump(
+                {
+                    "measured_at": datetime.now(timezone.utc).isoformat(),
+                    "python": sys.version.split()[0],
+                    "real_rate_limits": args.real_rate_limits,
+                    "results": [
+                        {**asdict(result), "requests": result.requests}
+                        for result in results
+                    ],
+                },
+                f,
+                indent=2,
+            )
+        print(f"Saved results to {args.save}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
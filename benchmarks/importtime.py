@@ -0,0 +1,107 @@
+"""
+Measures how long the lambda handler module takes to import, which is most
+of a cold start, using python -X importtime in a fresh interpreter.
+
+    python benchmarks/importtime.py --runs 5 --output importtime.json
+    python benchmarks/importtime.py --budget-ms 250
+
+Exits non-zero if the median import time is over the budget.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, "src")
+
+# eg "import time:       419 |     131362 | app"
+LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+# Modules that should never be imported by the handler.
+FORBIDDEN = ("boto3", "botocore", "inquirer")
+
+
+def measure(module: str) -> dict:
+    """
+    Imports module in a new interpreter and returns {name: (self, cumulative)}
+    in microseconds for every module it pulled in.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = SRC
+    # app reads this at import.
+    env.setdefault("MANUAL_PROCESSING_QUEUE_URL", "https://benchmark")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    timings = {}
+    for line in result.stderr.splitlines():
+        match = LINE_RE.match(line)
+        if match:
+            self_us, cumulative_us, _, name = match.groups()
+            timings[name] = (int(self_us), int(cumulative_us))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float)
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    runs = [measure(args.module) for _ in range(args.runs)]
+    totals = [run[args.module][1] for run in runs]
+    median_ms = statistics.median(totals) / 1000
+
+    # Slowest imports (by cumulative time) in the median run.
+    median_run = runs[totals.index(sorted(totals)[len(totals) // 2])]
+    slowest = sorted(median_run.items(), key=lambda item: item[1][1], reverse=True)
+    forbidden = sorted(
+        name for name in median_run if name.split(".")[0] in FORBIDDEN
+    )
+
+    results = {
+        "module": args.module,
+        "python": sys.version.split()[0],
+        "measured_at": datetime.now(timezone.utc).isoformat(),
+        "runs_ms": [total / 1000 for total in totals],
+        "median_ms": median_ms,
+        "budget_ms": args.budget_ms,
+        "modules": len(median_run),
+        "slowest": [
+            {"module": name, "self_ms": s / 1000, "cumulative_ms": c / 1000}
+            for name, (s, c) in slowest[:args.top]
+        ],
+        "forbidden": forbidden,
+    }
+
+    print(f"import {args.module}: median {median_ms:.1f}ms over {args.runs} runs")
+    for entry in results["slowest"]:
+        print(f"  {entry['cumulative_ms']:8.1f}ms  {entry['module']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    failed = False
+    if forbidden:
+        print(f"Imported at start up: {', '.join(forbidden)}")
+        failed = True
+    if args.budget_ms is not None and median_ms > args.budget_ms:
+        print(f"Over budget ({median_ms:.1f}ms > {args.budget_ms}ms)")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Micro-benchmark for parsing Guardian search results into Articles.
+
+    python benchmarks/parse.py --pages 50
+"""
+import argparse
+import os
+import sys
+import timeit
+import tracemalloc
+
+from stand_ins import guardian_results
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+import guardian_api  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    page_size = guardian_api.MAX_PAGE_SIZE
+    pages = [
+        {
+            "pages": args.pages,
+            "results": guardian_results(n * page_size, (n + 1) * page_size),
+        }
+        for n in range(args.pages)
+    ]
+    articles = args.pages * page_size
+
+    def parse():
+        return [guardian_api.parse_page(n, page) for n, page in enumerate(pages)]
+
+    best = min(timeit.repeat(parse, number=1, repeat=args.repeat))
+    print(f"Parsed {articles} articles in {best * 1000:.1f}ms (best of {args.repeat})")
+    print(f"{articles / best:,.0f} articles/s")
+
+    tracemalloc.start()
+    parsed = parse()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{size / articles:.0f} bytes per article")
+    del parsed
+
+
+if __name__ == "__main__":
+    main()
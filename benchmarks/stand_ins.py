@@ -0,0 +1,403 @@
+"""
+Local stand-ins for the services the lambda talks to, for benchmarking
+without network access or API quota.
+
+GuardianServer and TraktServer are real HTTP servers (on 127.0.0.1) so the
+whole client stack (sessions, adapters, rate limiting) is exercised. The AWS
+services are replaced by in memory stubs with the same method names as the
+boto3 clients we use.
+"""
+import gzip
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class StandIn:
+    """
+    Runs a request handler on a background thread, counting requests by
+    route and waiting `latency` seconds before each response.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                stand_in._handle(self, "GET")
+
+            def do_POST(self):
+                stand_in._handle(self, "POST")
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, route: str):
+        with self._lock:
+            self.requests[route] += 1
+
+    def _handle(self, handler: BaseHTTPRequestHandler, method: str):
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = handler.rfile.read(length) if length else b""
+        url = urlparse(handler.path)
+        if self.latency:
+            time.sleep(self.latency)
+        status, data, headers = self.respond(
+            method, url.path, parse_qs(url.query), handler.headers, body
+        )
+        content = b"" if data is None else json.dumps(data).encode()
+        if content and "gzip" in handler.headers.get("Accept-Encoding", ""):
+            content = gzip.compress(content)
+            headers = {**headers, "Content-Encoding": "gzip"}
+        handler.send_response(status)
+        for name, value in {"Content-Type": "application/json", **headers}.items():
+            handler.send_header(name, value)
+        handler.send_header("Content-Length", str(len(content)))
+        handler.end_headers()
+        handler.wfile.write(content)
+
+    def respond(self, method, path, query, headers, body) -> tuple:
+        raise NotImplementedError
+
+
+def film_title(n: int) -> str:
+    return f"Benchmark Film {n}"
+
+
+def guardian_results(
+    start: int, stop: int, untagged_every: int = 10, query: dict | None = None
+) -> list:
+    """
+    Search results for reviews start to stop, as the content API has them.
+    Every `untagged_every`th review has no imdb reference. Fields, tags and
+    references are only included if the query asks for them (all are if
+    there's no query).
+    """
+    query = query if query is not None else {
+        "show-fields": ["all"],
+        "show-tags": ["all"],
+        "show-references": ["all"],
+    }
+    results = []
+    for n in range(start, stop):
+        result = {
+            "id": f"film/benchmark/{n}",
+            "type": "article",
+            "sectionId": "film",
+            "webTitle": f"{film_title(n)} review – a benchmark",
+            "webUrl": f"https://www.theguardian.com/film/benchmark/{n}",
+            "webPublicationDate": "2024-01-01T00:00:00Z",
+        }
+        if "show-fields" in query:
+            result["fields"] = {"byline": "A Critic", "starRating": "4"}
+        if "show-tags" in query:
+            result["tags"] = [{"id": "profile/a-critic", "type": "contributor"}]
+        if "show-references" in query:
+            result["references"] = []
+            if not untagged_every or n % untagged_every:
+                result["references"] = [{"type": "imdb", "id": f"imdb/tt{n:07d}"}]
+        results.append(result)
+    return results
+
+
+class GuardianServer(StandIn):
+    """
+    The content API's /search, with `reviews` film reviews to page through.
+    Every `untagged_every`th review has no imdb reference.
+    """
+
+    def __init__(self, reviews: int = 10, untagged_every: int = 10, **kwargs):
+        super().__init__(**kwargs)
+        self.reviews = reviews
+        self.untagged_every = untagged_every
+
+    def respond(self, method, path, query, headers, body):
+        self.count("search")
+        page = int(query.get("page", ["1"])[0])
+        page_size = int(query.get("page-size", ["10"])[0])
+        pages = max(-(-self.reviews // page_size), 1)
+        if page > pages:
+            return 400, {"response": {"status": "error"}}, {}
+        results = guardian_results(
+            (page - 1) * page_size,
+            min(page * page_size, self.reviews),
+            self.untagged_every,
+            query,
+        )
+        data = {
+            "status": "ok",
+            "total": self.reviews,
+            "currentPage": page,
+            "pages": pages,
+            "results": results,
+        }
+        return 200, {"response": data}, {}
+
+
+class TraktServer(StandIn):
+    """
+    Enough of trakt for a run: a list (summary, items, add and remove),
+    movie search and aliases, and /oauth/token.
+
+    Every `throttle_every`th request is answered with a 429. Only requests
+    with the current access token are allowed, rotate_token() changes it.
+    """
+
+    def __init__(
+        self,
+        list_size: int = 0,
+        throttle_every: int = 0,
+        retry_after: float = 1,
+        access_token: str = "benchmark-token",
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.access_token = access_token
+        start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        self.items = {}
+        for n in range(list_size):
+            self._list_item(f"tt9{n:06d}", start + timedelta(minutes=n))
+        self.updated_at = self._now()
+        self._handled = 0
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+    def _list_item(self, imdb_id: str, listed_at: datetime | None = None):
+        listed_at = listed_at or datetime.now(timezone.utc)
+        self.items[imdb_id] = {
+            "rank": len(self.items) + 1,
+            "listed_at": listed_at.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            "type": "movie",
+            "movie": {
+                "title": imdb_id,
+                "year": 2024,
+                "ids": {"trakt": len(self.items), "slug": imdb_id, "imdb": imdb_id},
+            },
+        }
+
+    def rotate_token(self) -> str:
+        with self._lock:
+            self.access_token = uuid.uuid4().hex
+            return self.access_token
+
+    def _etag(self) -> str:
+        return '"%s"' % hashlib.md5(self.updated_at.encode()).hexdigest()
+
+    def respond(self, method, path, query, headers, body):
+        parts = path.strip("/").split("/")
+        route = self._route(method, parts)
+        self.count(route)
+        with self._lock:
+            self._handled += 1
+            throttled = self.throttle_every and not self._handled % self.throttle_every
+            token = self.access_token
+        authorized = headers.get("Authorization") == f"Bearer {token}"
+        if throttled:
+            return 429, {}, {"Retry-After": str(self.retry_after)}
+        if route == "oauth":
+            token = self.rotate_token()
+            return 200, {"access_token": token, "refresh_token": uuid.uuid4().hex}, {}
+        if not authorized:
+            return 401, {}, {}
+        if route == "list":
+            return 200, self._summary(), {}
+        if route == "items":
+            with self._lock:
+                etag = self._etag()
+                if headers.get("If-None-Match") == etag:
+                    return 304, None, {"ETag": etag}
+                items = sorted(
+                    self.items.values(),
+                    key=lambda item: item["listed_at"],
+                    reverse=True,
+                )
+            return 200, items, {"ETag": etag}
+        if route in ("add", "remove"):
+            return 201 if route == "add" else 200, self._post(route, body), {}
+        if route == "search":
+            return 200, self._search(query.get("query", [""])[0].strip('"')), {}
+        if route == "aliases":
+            return 200, [], {}
+        return 404, {}, {}
+
+    @staticmethod
+    def _route(method, parts) -> str:
+        if parts[:2] == ["oauth", "token"]:
+            return "oauth"
+        if parts[0] == "search":
+            return "search"
+        if parts[0] == "movies":
+            return "aliases"
+        if parts[0] == "users" and len(parts) == 4:
+            return "list"
+        if parts[0] == "users" and method == "POST":
+            return "remove" if parts[-1] == "remove" else "add"
+        if parts[0] == "users":
+            return "items"
+        return "unknown"
+
+    def _summary(self) -> dict:
+        with self._lock:
+            return {
+                "name": "benchmark",
+                "item_count": len(self.items),
+                "updated_at": self.updated_at,
+            }
+
+    def _post(self, route: str, body: bytes) -> dict:
+        imdb_ids = [movie["ids"]["imdb"] for movie in json.loads(body)["movies"]]
+        with self._lock:
+            changed = 0
+            for imdb_id in imdb_ids:
+                if route == "add" and imdb_id not in self.items:
+                    self._list_item(imdb_id)
+                    changed += 1
+                elif route == "remove" and self.items.pop(imdb_id, None):
+                    changed += 1
+            self.updated_at = self._now()
+            item_count = len(self.items)
+        key = "added" if route == "add" else "deleted"
+        return {
+            key: {"movies": changed, "shows": 0},
+            "existing": {"movies": len(imdb_ids) - changed if key == "added" else 0},
+            "not_found": {"movies": []},
+            "list": {"updated_at": self.updated_at, "item_count": item_count},
+        }
+
+    @staticmethod
+    def _search(query: str) -> list:
+        # The benchmark reviews are titled "Benchmark Film <n>". About half
+        # have an exact match, the rest only a pair of lookalikes.
+        try:
+            n = int(query.rsplit(" ", 1)[-1])
+        except ValueError:
+            return []
+        if hashlib.md5(query.encode()).digest()[0] % 2:
+            titles = [(query, f"tt8{n:06d}")]
+        else:
+            titles = [(f"{query} A", f"tt7{n:06d}"), (f"{query} B", f"tt6{n:06d}")]
+        return [
+            {
+                "type": "movie",
+                "score": 100,
+                "movie": {
+                    "title": title,
+                    "year": 2024,
+                    "ids": {"trakt": n, "slug": imdb_id, "imdb": imdb_id},
+                },
+            }
+            for title, imdb_id in titles
+        ]
+
+
+class StubClient:
+    """
+    Counts calls like a boto3 client would make them.
+    """
+
+    def __init__(self):
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, operation: str):
+        with self._lock:
+            self.calls[operation] += 1
+
+
+class SSMStub(StubClient):
+    class exceptions:
+        class ParameterNotFound(Exception):
+            pass
+
+    def __init__(self, parameters: dict | None = None):
+        super().__init__()
+        self.parameters = dict(parameters or {})
+
+    def get_parameter(self, Name):
+        self._count("get_parameter")
+        if Name not in self.parameters:
+            raise self.exceptions.ParameterNotFound(Name)
+        return {"Parameter": {"Name": Name, "Value": self.parameters[Name]}}
+
+    def get_parameters(self, Names):
+        self._count("get_parameters")
+        return {
+            "Parameters": [
+                {"Name": name, "Value": self.parameters[name]}
+                for name in Names
+                if name in self.parameters
+            ],
+            "InvalidParameters": [
+                name for name in Names if name not in self.parameters
+            ],
+        }
+
+    def put_parameter(self, Name, Value, **kwargs):
+        self._count("put_parameter")
+        self.parameters[Name] = Value
+        return {"Version": 1}
+
+
+class SecretsManagerStub(StubClient):
+    def __init__(self, secrets: dict):
+        super().__init__()
+        self.secrets = {
+            key: (value, uuid.uuid4().hex) for key, value in secrets.items()
+        }
+
+    def get_secret_value(self, SecretId, **kwargs):
+        self._count("get_secret_value")
+        value, version = self.secrets[SecretId]
+        return {"SecretString": json.dumps(value), "VersionId": version}
+
+    def update_secret(self, SecretId, SecretString):
+        self._count("update_secret")
+        self.secrets[SecretId] = (json.loads(SecretString), uuid.uuid4().hex)
+        return {"VersionId": self.secrets[SecretId][1]}
+
+
+class SQSStub(StubClient):
+    def __init__(self):
+        super().__init__()
+        # Message bodies by queue url.
+        self.messages = defaultdict(list)
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self._count("send_message_batch")
+        with self._lock:
+            self.messages[QueueUrl].extend(entry["MessageBody"] for entry in Entries)
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries]}
+
+
+class LambdaStub(StubClient):
+    def invoke(self, **kwargs):
+        self._count("invoke")
+        return {"StatusCode": 202}
@@ -1,162 +1,215 @@
-import argparse
 import json
 import logging
 import os
-import sys
-from dataclasses import dataclass
 from datetime import datetime
-
-import boto3
-import inquirer
+from typing import Callable, List
 
 import guardian_api
 from guardian_api import Article
-import trakt_api
-from aws_utils import get_parameter, get_secret, put_parameter
+from metrics import METRICS
+from page_cache import PageCache
+from pipeline import Pipeline
+import processed_index
+from processed_index import ProcessedIndex
+from resolver import Resolver
+from sqs_utils import BatchProducer
+from aws_utils import get_client, get_parameters, put_parameter
+
+# The lambda entry point for the ingest stage: reads the guardian, works out
+# the imdb ids and publishes them to the resolved ids queue, for the trakt
+# writer (trakt_writer.py) to add to the list. Anything only the CLI needs
+# lives in cli.py, and AWS clients are made when first used, to keep cold
+# starts short.
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-sqs = boto3.client("sqs")
-
 MANUAL_PROCESSING_QUEUE_URL = os.environ["MANUAL_PROCESSING_QUEUE_URL"]
+# Not needed when the ids are written some other way (see local.py).
+RESOLVED_IDS_QUEUE_URL = os.environ.get("RESOLVED_IDS_QUEUE_URL")
+
+# Where we got to if the last run had to stop before reading every page.
+CURSOR_PARAMETER = "GoodFilms_Cursor"
+# The date of the last run that read every page.
+LAST_SUCCESS_PARAMETER = "GoodFilms_LastSuccess"
+# Stop reading guardian pages when there's less than this much time left,
+# leaving enough to write what we've got to trakt.
+DEADLINE_MARGIN_MS = 10_000
+
+
+def parse_cursor(value: str | None) -> dict | None:
+    if not value:
+        return None
+    cursor = json.loads(value)
+    # An empty cursor means the last run got to the end.
+    return cursor or None
+
 
+def save_cursor(cursor: dict):
+    # SSM won't store an empty string, so an empty object clears the cursor.
+    put_parameter(CURSOR_PARAMETER, json.dumps(cursor))
 
 
+def save_processed(processed: ProcessedIndex):
+    if processed.changed:
+        put_parameter(processed_index.PARAMETER, processed.dumps())
+
+
+def continue_invocation(context):
+    """
+    Invokes this function again (asynchronously) to pick up from the cursor.
+    """
+    client = get_client("lambda")
+    client.invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType="Event",
+        Payload=json.dumps({"resume": True}),
+    )
+
 
 def lambda_handler(event, context):
-    # The date the last time the script ran is stored in a parameter.
-    # So days are not lost if the script fails for any reason.
-    last_success = get_parameter("GoodFilms_LastSuccess")
-    if not os.environ.get("AWS_LAMBDA_FUNCTION_NAME"):
-        last_success = input(f"From Date ({last_success}): ")
-    from_date = datetime.strptime(last_success, "%Y-%m-%d")
-
-    articles:list[Article] = []
-    for article in guardian_api.get_articles(from_date):
-        logger.info(f'"{article.title}" ({article.url})')
-        articles.append(article)
-
-    imdb_ids = [a.imdb_id for a in articles if a.imdb_id]
-
-    articles_no_id = [a for a in articles if not a.imdb_id]
-    for article in articles_no_id:
-        logger.warning(f'No imdb id found for "{article.title}')
-        sqs.send_message(
-            QueueUrl=MANUAL_PROCESSING_QUEUE_URL, MessageBody=json.dumps(article.to_dict())
+    try:
+        return run(event, context)
+    finally:
+        # Written to the log in Embedded Metric Format, which CloudWatch
+        # turns into metrics for us.
+        METRICS.flush()
+
+
+def run(event, context, write_ids: Callable[[List[str]], object] | None = None):
+    """
+    Processes the reviews since the last run. The imdb ids found are
+    published to the resolved ids queue, or passed to write_ids if given.
+    """
+
+    def out_of_time() -> bool:
+        if context is None:
+            return False
+        return context.get_remaining_time_in_millis() < DEADLINE_MARGIN_MS
+
+    parameters = get_parameters(
+        [CURSOR_PARAMETER, LAST_SUCCESS_PARAMETER, processed_index.PARAMETER]
+    )
+    # Articles earlier runs (or earlier invocations of this one) dealt with.
+    processed = ProcessedIndex.loads(parameters.get(processed_index.PARAMETER))
+    # If the previous run ran out of time it left a cursor saying where to
+    # pick up from.
+    cursor = parse_cursor(parameters.get(CURSOR_PARAMETER))
+    if cursor:
+        logger.info(f"Resuming from {cursor}")
+        from_date = datetime.strptime(cursor["date"], "%Y-%m-%d")
+        page_size = cursor["page_size"]
+        start_page = cursor["page"]
+    else:
+        # The date the last time the script ran is stored in a parameter.
+        # So days are not lost if the script fails for any reason.
+        last_success = parameters.get(LAST_SUCCESS_PARAMETER)
+        if not os.environ.get("AWS_LAMBDA_FUNCTION_NAME"):
+            last_success = input(f"From Date ({last_success}): ")
+        from_date = datetime.strptime(last_success, "%Y-%m-%d")
+        page_size = guardian_api.MAX_PAGE_SIZE
+        start_page = 1
+
+    next_cursor = None
+    skipped = 0
+    # Cached pages mean a retry after a failure doesn't use up API quota.
+    pages = guardian_api.get_pages(
+        from_date,
+        page_size=page_size,
+        cache=PageCache(),
+        start_page=start_page,
+        should_stop=out_of_time,
+    )
+
+    def read_articles():
+        nonlocal next_cursor, skipped
+        page = None
+        for page in pages:
+            page_articles = page.articles
+            if cursor and page.number == start_page:
+                # Newer reviews push older ones down the results, so the last
+                # article we saw may have moved onto this page.
+                ids = [article.id for article in page_articles]
+                if cursor.get("last_id") in ids:
+                    page_articles = page_articles[ids.index(cursor["last_id"]) + 1:]
+            for article in page_articles:
+                key = article.id or article.url
+                if key in processed:
+                    skipped += 1
+                    continue
+                processed.add(key)
+                logger.info(f'"{article.title}" ({article.url})')
+                yield article
+            if page.number < page.pages and out_of_time():
+                break
+        # Pages can also stop early because get_pages stopped asking for
+        # them, so go by the last page read rather than the clock, which may
+        # not have said stop when we last looked.
+        if page and page.number < page.pages:
+            next_cursor = {
+                "date": from_date.strftime("%Y-%m-%d"),
+                "page_size": page_size,
+                "page": page.number + 1,
+                "last_id": page.articles[-1].id if page.articles else None,
+            }
+            logger.warning(f"Running out of time, stopping at {next_cursor}")
+
+    # Articles stream through to the resolved ids queue (or write_ids) and
+    # the manual processing queue while later pages are still being fetched.
+    sqs = get_client("sqs")
+    resolved = None if write_ids else BatchProducer(sqs, RESOLVED_IDS_QUEUE_URL)
+    with BatchProducer(sqs, MANUAL_PROCESSING_QUEUE_URL) as producer:
+
+        def send_to_queue(article: Article):
+            logger.warning(f'No imdb id found for "{article.title}')
+            producer.send(json.dumps(article.to_dict()))
+
+        def publish_ids(imdb_ids: List[str]):
+            for imdb_id in imdb_ids:
+                resolved.send(json.dumps({"imdb_id": imdb_id}))
+            resolved.flush()
+
+        pipeline = Pipeline(
+            write_ids=write_ids or publish_ids,
+            enqueue=send_to_queue,
+            resolve=Resolver().resolve,
+            # Resolving is slow, near the deadline leave it to a human.
+            should_stop=out_of_time,
+        )
+        stats = pipeline.run(read_articles())
+    logger.info(
+        "Processed %d articles, %d with imdb ids (%d resolved automatically) "
+        "and %d for manual processing. Skipped %d processed before."
+        % (
+            stats.articles,
+            stats.imdb_ids,
+            stats.resolved,
+            stats.unresolved,
+            skipped,
+        )
+    )
+    # Don't move on (or mark anything processed) if something didn't get
+    # where it was going, so the next run picks these reviews up again.
+    if producer.failed:
+        raise RuntimeError(
+            "%d articles could not be sent for manual processing."
+            % len(producer.failed)
+        )
+    if resolved and resolved.failed:
+        raise RuntimeError(
+            "%d imdb ids could not be sent to the trakt writer."
+            % len(resolved.failed)
         )
-    # Bundle the ids so that they can be sent en masse
-    trakt_api.update_list(imdb_ids)
+    save_processed(processed)
 
-    # Update the "LastSuccess" parameter ready for the next run.
-    # TODO: Split guardian and trakt into two lambdas
-    now = datetime.now()
-    put_parameter("GoodFilms_LastSuccess", now.strftime("%Y-%m-%d"))
-
-
-def get_articles_from_sqs():
-    # To be run by a human to review entries on an SQS queue.
-    while True:
-        response = sqs.receive_message(QueueUrl=MANUAL_PROCESSING_QUEUE_URL)
-        if not response.get("Messages"):
-            logger.info("No more films to process.")
-            break
-        for msg in response["Messages"]:
-            data = json.loads(msg["Body"])
-            try:
-                yield Article(**data)
-            except TypeError:
-                logger.warning(f"Couldn't extract article from {data}")
-
-            sqs.delete_message(
-                QueueUrl=MANUAL_PROCESSING_QUEUE_URL, ReceiptHandle=msg["ReceiptHandle"]
-            )
-
-
-def prompt_best_match(title: str = "", imdb_id: str = "") -> str | None:
-    # Interactive function that takes a film title or imdb_id, searches trakt and
-    # prompts the user for best match.
-    secrets = get_secret("TraktAPI")
-    trakt = trakt_api.TraktAPI(secrets["CLIENT_ID"], secrets["ACCESS_TOKEN"])
-    if title:
-        results = trakt.search.by_text(title)
-    elif imdb_id:
-        results = trakt.search.by_id(imdb_id)
-    else:
-        results = []
-    choices_hints = {}
-    for result in results:
-        try:
-            imdb_id = result["movie"]["ids"]["imdb"]
-        except KeyError:
-            # If there's no imdb then it's probably a low quality entry.
-            continue
-        year = result["movie"].get("year", "Unknown Year")
-        title = result["movie"]["title"]
-        score = int(result["score"])
-        choice = (f"{title} ({year}) [score: {score}]", imdb_id)
-        hint = f"https://www.imdb.com/title/{imdb_id}/"
-        choices_hints[choice] = hint
-
-    if not choices_hints:
-        print(f'No matches for "{title or imdb_id}"')
+    if next_cursor:
+        save_cursor(next_cursor)
+        if os.environ.get("CONTINUE_IMMEDIATELY") and context is not None:
+            continue_invocation(context)
         return
 
-    print(f"\nSelect best match for '{title or imdb_id}'")
-
-    choices_hints[("[ Skip ]", None)] = None
-    questions = [
-        inquirer.List(
-            "imdb_id",
-            message="Select matching film:",
-            choices=choices_hints.keys(),
-            hints=choices_hints,
-        ),
-    ]
-    answer = inquirer.prompt(questions)
-    if answer:
-        return answer["imdb_id"]
-
-
-if __name__ == "__main__":
-    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
-
-    # Move this boilerplate somewhere? Global?
-    secrets = get_secret("TraktAPI")
-    trakt = trakt_api.TraktAPI(secrets["CLIENT_ID"], secrets["ACCESS_TOKEN"])
-
-    user_id = secrets["USER_ID"]
-    list_id = secrets["LIST_ID"]
-    api_list = trakt.list(user_id, list_id)
-
-    parser = argparse.ArgumentParser()
-    subparsers = parser.add_subparsers(dest="command")
-    process_parser = subparsers.add_parser(
-        "process", help="Manually review the films in an AWS queue."
-    )
-    process_parser.add_argument("--aws_queue", default=MANUAL_PROCESSING_QUEUE_URL)
-    add_parser = subparsers.add_parser("add")
-    group = add_parser.add_mutually_exclusive_group(required=True)
-    group.add_argument("--title")
-    group.add_argument("--imdb_id")
-
-    args = parser.parse_args()
-
-    # There's a tidier way to do all this. We want to figure out a list
-    # of films to add. That list either comes from SQS (after review) or
-    # from the command line (a list of one) So build that list (of imdb
-    # ids) and then add them all at the end.
-    if args.command == "process":
-        for article in get_articles_from_sqs():
-            imdb_id = prompt_best_match(title=article.title)
-            if imdb_id:
-                api_list.add([imdb_id])
-
-    elif args.command == "add":
-        if args.imdb_id:
-            results = trakt.search.by_id(args.imdb_id)
-            imdb_id = prompt_best_match(imdb_id=args.imdb_id)
-        else:
-            imdb_id = prompt_best_match(title=args.title)
-        if imdb_id:
-            api_list.add([imdb_id])
+    # Update the "LastSuccess" parameter ready for the next run.
+    now = datetime.now()
+    put_parameter(LAST_SUCCESS_PARAMETER, now.strftime("%Y-%m-%d"))
+    if cursor:
+        save_cursor({})
@@ -0,0 +1,145 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Iterable, List
+
+import trakt_api
+from transport import POOL_MAXSIZE
+
+# An asyncio counterpart of TraktAPI, for making lots of lookups at once (eg
+# searching for a backlog of titles) without a thread per lookup in the
+# caller.
+#
+# There's no async HTTP client among our dependencies, so each call runs the
+# synchronous TraktAPI on a worker thread (from a pool of its own, rather
+# than the event loop's default one, which may well be smaller). That means
+# the session (and its connection pool), rate limiting, search cache and
+# token refresh are all shared with the synchronous API, which works
+# exactly as before.
+
+# Calls in flight at once. No more than the session's connection pool, or
+# connections get thrown away and re-established.
+CONCURRENCY = POOL_MAXSIZE
+
+
+class AsyncRoute:
+    """
+    Wraps one of TraktAPI's routes (eg SearchRoute) so that its methods
+    return coroutines.
+    """
+
+    def __init__(self, api: "AsyncTraktAPI", route):
+        self._api = api
+        self._route = route
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._route, name)
+        if not callable(attribute):
+            return attribute
+
+        async def call(*args, **kwargs):
+            return await self._api.run(attribute, *args, **kwargs)
+
+        return call
+
+
+class AsyncTraktAPI:
+    """
+    Has the same list, search and movie routes as TraktAPI, with methods
+    that return coroutines. Use one per event loop, and close it (or use it
+    as an async context manager) when done to stop its threads.
+    """
+
+    def __init__(
+        self,
+        api: trakt_api.TraktAPI | None = None,
+        concurrency: int = CONCURRENCY,
+    ):
+        self._api = api
+        self.concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="trakt"
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    @property
+    def api(self) -> trakt_api.TraktAPI:
+        # Credentials are only looked up once something is asked for.
+        if self._api is None:
+            self._api = trakt_api.get_api()
+        return self._api
+
+    async def run(self, function: Callable, *args, **kwargs):
+        """
+        Runs a blocking call on a worker thread, waiting for a slot if
+        `concurrency` are already running.
+        """
+        # Calls wait here rather than in the executor's queue, so a call
+        # that's cancelled before its turn never starts.
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, partial(function, *args, **kwargs)
+            )
+
+    def list(self, user_id: str, list_id: str) -> AsyncRoute:
+        return AsyncRoute(self, self.api.list(user_id, list_id))
+
+    @property
+    def search(self) -> AsyncRoute:
+        return AsyncRoute(self, self.api.search)
+
+    def movie(self, movie_id: str) -> AsyncRoute:
+        return AsyncRoute(self, self.api.movie(movie_id))
+
+    async def search_many(
+        self,
+        titles: Iterable[str],
+        fields: str = "title",
+        return_exceptions: bool = False,
+    ) -> List:
+        """
+        Searches for each title at once, returning the results in the same
+        order as the titles. With return_exceptions a failed search gives its
+        exception instead of stopping the rest.
+        """
+        search = self.search
+        return await asyncio.gather(
+            *(search.by_text(title, fields) for title in titles),
+            return_exceptions=return_exceptions,
+        )
+
+    async def search_many_ids(
+        self,
+        ids: Iterable[str],
+        id_type: str = "imdb",
+        return_exceptions: bool = False,
+    ) -> List:
+        """
+        Like search_many, but looking up each id.
+        """
+        search = self.search
+        return await asyncio.gather(
+            *(search.by_id(id, id_type) for id in ids),
+            return_exceptions=return_exceptions,
+        )
+
+    async def aliases_many(
+        self, movie_ids: Iterable[str], return_exceptions: bool = False
+    ) -> List:
+        """
+        The aliases of each movie, in the same order as the ids.
+        """
+        return await asyncio.gather(
+            *(self.movie(movie_id).aliases() for movie_id in movie_ids),
+            return_exceptions=return_exceptions,
+        )
@@ -1,38 +1,227 @@
 import json
+import logging
+import threading
+import time
+from dataclasses import dataclass
 from functools import cache
+from typing import Callable, Dict, List
 
-import boto3
+from metrics import METRICS
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Everything we use lives here.
+REGION = "eu-west-2"
+
+# Secrets are rotated (eg the trakt access token) so are only trusted for so
+# long. A 401 from trakt also gets the secret re-read straight away.
+SECRET_TTL = 15 * 60
+# Parameters hold state that other invocations change (eg the cursor), so
+# by default they aren't cached at all.
+PARAMETER_TTL = 0
+# SSM won't return more than this many parameters from one call.
+MAX_PARAMETERS = 10
+
+
+@dataclass
+class CacheEntry:
+    value: object
+    expires: float
+    # eg the VersionId of a secret.
+    version: str | None = None
+
+
+class TTLCache:
+    """
+    A thread safe dict whose entries expire, each after its own TTL.
+
+    Expired (and invalidated) entries are kept around so that their version
+    can still be compared with whatever replaces them.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self._entries: Dict[str, CacheEntry] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> CacheEntry | None:
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry.expires <= self.clock():
+            return None
+        return entry
+
+    def previous(self, key: str) -> CacheEntry | None:
+        """
+        The entry for key, even if it's expired.
+        """
+        with self._lock:
+            return self._entries.get(key)
+
+    def set(self, key: str, value, ttl: float, version: str | None = None):
+        with self._lock:
+            self._entries[key] = CacheEntry(value, self.clock() + ttl, version)
+
+    def invalidate(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._entries[key].expires = 0
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_secrets = TTLCache()
+_parameters = TTLCache()
+
+_client_lock = threading.Lock()
+
+
+def get_client(service_name: str, region_name: str = REGION):
+    """
+    A client for the given AWS service, made on first use and then shared.
+    Clients are thread safe (sessions aren't), so one per service will do.
+    """
+    # Making clients isn't thread safe either.
+    with _client_lock:
+        return _get_client(service_name, region_name)
 
 
 @cache
-def get_secret(secret_id):
+def _get_client(service_name: str, region_name: str):
+    # boto3 is slow to import, and isn't needed until we talk to AWS.
+    import boto3
+
+    client = boto3.Session().client(service_name=service_name, region_name=region_name)
+    events = client.meta.events
+    events.register("before-parameter-build", _before_call)
+    events.register("after-call", _after_call)
+    events.register("after-call-error", _after_call_error)
+    return client
+
+
+# botocore event handlers that record metrics for every AWS call.
+
+
+def _before_call(context, **kwargs):
+    context["metrics_start"] = time.perf_counter()
+
+
+def _record_call(model, context, status, size=0, retries=0):
+    start = context.get("metrics_start")
+    if start is None:
+        return
+    service = model.service_model.endpoint_prefix
+    METRICS.record_request(
+        service, model.name, status, time.perf_counter() - start, size
+    )
+    if retries:
+        METRICS.record_retry(service, model.name, retries)
+
+
+def _after_call(http_response, parsed, model, context, **kwargs):
+    metadata = parsed.get("ResponseMetadata", {})
+    try:
+        size = int(http_response.headers.get("content-length") or 0)
+    except ValueError:
+        size = 0
+    _record_call(
+        model,
+        context,
+        http_response.status_code,
+        size,
+        metadata.get("RetryAttempts", 0),
+    )
+
+
+def _after_call_error(model, context, **kwargs):
+    _record_call(model, context, None)
+
+
+def get_secret(secret_id: str, ttl: float = SECRET_TTL) -> dict:
     """
     Helper function to get the contents of a given secret.
     """
-    session = boto3.Session()
-    client = session.client(service_name="secretsmanager", region_name="eu-west-2")
+    entry = _secrets.get(secret_id)
+    if entry:
+        return entry.value
+    client = get_client("secretsmanager")
     response = client.get_secret_value(SecretId=secret_id)
-    return json.loads(response["SecretString"])
+    previous = _secrets.previous(secret_id)
+    if previous and previous.version != response["VersionId"]:
+        logger.info(f"Secret {secret_id} has been rotated.")
+    value = json.loads(response["SecretString"])
+    _secrets.set(secret_id, value, ttl, version=response["VersionId"])
+    return value
+
+
+def invalidate_secret(secret_id: str):
+    """
+    Makes the next get_secret go back to secrets manager, eg because the
+    value we have has stopped working.
+    """
+    _secrets.invalidate(secret_id)
 
 
 def put_secret(secret_id, secret_values):
-    session = boto3.Session()
-    client = session.client(service_name="secretsmanager", region_name="eu-west-2")
-    return client.update_secret(
+    client = get_client("secretsmanager")
+    response = client.update_secret(
         SecretId=secret_id,
         SecretString=json.dumps(secret_values),
     )
+    _secrets.invalidate(secret_id)
+    return response
+
+
+def get_parameter(name, default=None, ttl: float = PARAMETER_TTL):
+    """
+    Gets the value of an SSM parameter, or default if it doesn't exist.
+    """
+    entry = _parameters.get(name)
+    if entry:
+        return entry.value
+    client = get_client("ssm")
+    try:
+        value = client.get_parameter(Name=name)["Parameter"]["Value"]
+    except client.exceptions.ParameterNotFound:
+        return default
+    if ttl:
+        _parameters.set(name, value, ttl)
+    return value
 
 
-def get_parameter(name):
-    # TODO: we don't really need the session effort here, we can just do
-    # boto3.client("ssm").
-    session = boto3.Session()
-    client = session.client(service_name="ssm", region_name="eu-west-2")
-    return client.get_parameter(Name=name)["Parameter"]["Value"]
+def get_parameters(names: List[str], ttl: float = PARAMETER_TTL) -> Dict[str, str]:
+    """
+    Gets several SSM parameters with as few calls as possible. Parameters
+    that don't exist are missing from the result.
+    """
+    values = {}
+    missing = []
+    for name in dict.fromkeys(names):
+        entry = _parameters.get(name)
+        if entry:
+            values[name] = entry.value
+        else:
+            missing.append(name)
+    if not missing:
+        return values
+    client = get_client("ssm")
+    for i in range(0, len(missing), MAX_PARAMETERS):
+        response = client.get_parameters(Names=missing[i:i + MAX_PARAMETERS])
+        for parameter in response["Parameters"]:
+            values[parameter["Name"]] = parameter["Value"]
+            if ttl:
+                _parameters.set(parameter["Name"], parameter["Value"], ttl)
+    return values
 
 
 def put_parameter(name, value):
-    session = boto3.Session()
-    client = session.client(service_name="ssm", region_name="eu-west-2")
-    return client.put_parameter(Name=name, Value=value, Type="String", Overwrite=True)
+    client = get_client("ssm")
+    response = client.put_parameter(
+        Name=name, Value=value, Type="String", Overwrite=True
+    )
+    # Anything cached is now out of date.
+    _parameters.invalidate(name)
+    return response
@@ -0,0 +1,319 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Callable, List
+
+import guardian_api
+from guardian_api import Article
+from metrics import METRICS
+from page_cache import PageCache
+from pipeline import Pipeline
+from resolver import Resolver
+from sqs_utils import BatchConsumer, BatchProducer
+import trakt_api
+from aws_utils import get_client, get_secret
+
+# Rebuilds the list from a range of dates, eg years of reviews.
+#
+# The range is split into shards of a few weeks each. Shards are processed
+# at the same time, either on a local thread pool or by the backfill lambda
+# (shard_handler), which gets them from a shard queue and sends back what it
+# found on a result queue. Each shard's imdb ids are saved as it finishes,
+# so an interrupted backfill picks up where it left off. Once every shard
+# is done the ids are merged and written to trakt in one go.
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+DEFAULT_PATH = "/tmp/good-films/backfill"
+# Days of reviews in each shard. About a page of results.
+SHARD_DAYS = 30
+# Number of shards processed at once (locally). Each also fetches pages
+# and resolves titles on its own threads.
+MAX_WORKERS = 4
+# Give up waiting for the lambdas after this many seconds without a result.
+RESULT_TIMEOUT = 15 * 60
+# Results for another backfill running at the same time are put back on the
+# (shared) result queue, hidden from us for this many seconds so we aren't
+# just handed them straight back.
+RELEASE_DELAY = 10
+
+
+def progress_path() -> str:
+    return os.environ.get("GOODFILMS_BACKFILL_PROGRESS", DEFAULT_PATH)
+
+
+@dataclass
+class Shard:
+    # Both inclusive, as YYYY-MM-DD.
+    from_date: str
+    to_date: str
+
+    @property
+    def key(self) -> str:
+        return f"{self.from_date}_{self.to_date}"
+
+
+@dataclass
+class ShardResult:
+    from_date: str
+    to_date: str
+    imdb_ids: List[str] = field(default_factory=list)
+    articles: int = 0
+    unresolved: int = 0
+
+    @property
+    def key(self) -> str:
+        return f"{self.from_date}_{self.to_date}"
+
+
+def shard_range(
+    from_date: date, to_date: date, days: int = SHARD_DAYS
+) -> List[Shard]:
+    """
+    Splits from_date to to_date (inclusive) into shards of `days` days,
+    newest first.
+    """
+    if days < 1:
+        raise ValueError("days must be at least 1")
+    if to_date < from_date:
+        raise ValueError("to_date is before from_date")
+    shards = []
+    start = from_date
+    while start <= to_date:
+        end = min(start + timedelta(days=days - 1), to_date)
+        shards.append(Shard(start.isoformat(), end.isoformat()))
+        start = end + timedelta(days=1)
+    return shards[::-1]
+
+
+class Progress:
+    """
+    The results of the shards finished so far, a JSON file each, in a
+    directory for the backfill's date range.
+    """
+
+    def __init__(self, from_date: date, to_date: date, path: str | None = None):
+        self.path = os.path.join(
+            path or progress_path(), f"{from_date.isoformat()}_{to_date.isoformat()}"
+        )
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.json")
+
+    def get(self, shard: Shard) -> ShardResult | None:
+        try:
+            with open(self._file(shard.key)) as f:
+                return ShardResult(**json.load(f))
+        except FileNotFoundError:
+            return None
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable progress for {shard.key}: {e}")
+            return None
+
+    def save(self, result: ShardResult):
+        os.makedirs(self.path, exist_ok=True)
+        # Written to the side and moved into place, so an interrupted write
+        # doesn't leave a half finished file.
+        tmp_file = self._file(result.key) + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(asdict(result), f)
+        os.replace(tmp_file, self._file(result.key))
+
+    def clear(self):
+        if not os.path.isdir(self.path):
+            return
+        for name in os.listdir(self.path):
+            os.remove(os.path.join(self.path, name))
+        os.rmdir(self.path)
+
+
+def process_shard(
+    shard: Shard,
+    enqueue: Callable[[Article], object],
+    resolve: Callable[[Article], str | None] | None = None,
+) -> ShardResult:
+    """
+    Finds the imdb ids for a shard's reviews. Articles that can't be
+    resolved are passed to enqueue.
+    """
+    imdb_ids: List[str] = []
+    articles = guardian_api.get_articles(
+        datetime.strptime(shard.from_date, "%Y-%m-%d"),
+        to_date=datetime.strptime(shard.to_date, "%Y-%m-%d"),
+        cache=PageCache(),
+    )
+    # Nothing goes to trakt until every shard is done, so the pipeline just
+    # collects the ids.
+    pipeline = Pipeline(write_ids=imdb_ids.extend, enqueue=enqueue, resolve=resolve)
+    stats = pipeline.run(articles)
+    logger.info(
+        f"Shard {shard.key}: {stats.articles} articles, {stats.imdb_ids} imdb ids "
+        f"and {stats.unresolved} for manual processing."
+    )
+    return ShardResult(
+        shard.from_date,
+        shard.to_date,
+        list(dict.fromkeys(imdb_ids)),
+        stats.articles,
+        stats.unresolved,
+    )
+
+
+def pending(shards: List[Shard], progress: Progress) -> List[Shard]:
+    """
+    The shards that haven't been finished yet.
+    """
+    todo = [shard for shard in shards if progress.get(shard) is None]
+    if len(todo) < len(shards):
+        logger.info(f"{len(shards) - len(todo)} shards already done, skipping them.")
+    return todo
+
+
+def run_local(
+    shards: List[Shard],
+    progress: Progress,
+    enqueue: Callable[[Article], object],
+    resolve: Callable[[Article], str | None] | None = None,
+    max_workers: int = MAX_WORKERS,
+):
+    """
+    Processes the shards not yet done on a thread pool, saving each result
+    as it finishes.
+    """
+    errors = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(process_shard, shard, enqueue, resolve): shard
+            for shard in pending(shards, progress)
+        }
+        for future in as_completed(futures):
+            try:
+                progress.save(future.result())
+            except Exception as e:
+                # Keep going, the other shards' results are still worth
+                # saving. This one is picked up again next time.
+                logger.error(f"Shard {futures[future].key} failed: {e}")
+                errors.append(e)
+    if errors:
+        raise errors[0]
+
+
+def fan_out(shards: List[Shard], progress: Progress, queue_url: str) -> List[Shard]:
+    """
+    Sends the shards not yet done to the shard queue, for the backfill
+    lambda. Returns the shards sent.
+    """
+    todo = pending(shards, progress)
+    with BatchProducer(get_client("sqs"), queue_url) as producer:
+        for shard in todo:
+            producer.send(json.dumps(asdict(shard)))
+    return todo
+
+
+def collect(
+    shards: List[Shard],
+    progress: Progress,
+    queue_url: str,
+    timeout: float = RESULT_TIMEOUT,
+):
+    """
+    Saves results from the result queue until every shard has one, or
+    nothing has turned up for `timeout` seconds.
+    """
+    keys = {shard.key for shard in shards}
+    waiting = set(keys)
+    last_result = time.monotonic()
+    with BatchConsumer(get_client("sqs"), queue_url) as consumer:
+        while waiting and time.monotonic() - last_result < timeout:
+            for message in consumer.messages():
+                result = ShardResult(**json.loads(message["Body"]))
+                if result.key not in keys:
+                    # Another backfill's, leave it for that one to collect.
+                    consumer.release(message, delay=RELEASE_DELAY)
+                    continue
+                # Repeats of results we already have are just dropped.
+                if result.key in waiting:
+                    progress.save(result)
+                    waiting.discard(result.key)
+                    last_result = time.monotonic()
+                    logger.info(f"Shard {result.key} done, {len(waiting)} to go.")
+                consumer.ack(message)
+                if not waiting:
+                    break
+    if waiting:
+        raise TimeoutError(f"No results for shards {', '.join(sorted(waiting))}")
+
+
+def merge(results: List[ShardResult]) -> List[str]:
+    """
+    Every shard's imdb ids, without duplicates, in the order of the shards.
+    """
+    return list(
+        dict.fromkeys(imdb_id for result in results for imdb_id in result.imdb_ids)
+    )
+
+
+def write(shards: List[Shard], progress: Progress) -> List[str]:
+    """
+    Writes the merged ids from every (finished) shard to trakt, and clears
+    the progress. Returns the ids written.
+    """
+    results = [progress.get(shard) for shard in shards]
+    missing = [shard.key for shard, result in zip(shards, results) if result is None]
+    if missing:
+        raise ValueError(f"Shards not finished: {', '.join(missing)}")
+    imdb_ids = merge(results)
+    # Shards are newest first, so if there are more films than the list can
+    # take it's the oldest that miss out.
+    max_list_size = int(get_secret("TraktAPI")["MAX_LIST_SIZE"])
+    if len(imdb_ids) > max_list_size:
+        logger.warning(
+            f"Found {len(imdb_ids)} films, only the newest {max_list_size} fit "
+            "on the list."
+        )
+        imdb_ids = imdb_ids[:max_list_size]
+    trakt_api.update_list(imdb_ids)
+    progress.clear()
+    return imdb_ids
+
+
+def shard_handler(event, context):
+    """
+    The backfill lambda. Processes shards from the shard queue and sends
+    the results to the result queue.
+    """
+    results = None
+    try:
+        sqs = get_client("sqs")
+        with BatchProducer(
+            sqs, os.environ["MANUAL_PROCESSING_QUEUE_URL"]
+        ) as manual, BatchProducer(
+            sqs, os.environ["BACKFILL_RESULT_QUEUE_URL"]
+        ) as results:
+            for record in event["Records"]:
+                shard = Shard(**json.loads(record["body"]))
+                result = process_shard(
+                    shard,
+                    lambda article: manual.send(json.dumps(article.to_dict())),
+                    Resolver().resolve,
+                )
+                # Only report the shard done once its unresolved articles
+                # are on the manual queue, otherwise it goes back on the
+                # shard queue to be tried again.
+                manual.flush()
+                if manual.failed:
+                    raise RuntimeError(
+                        "%d articles could not be sent for manual processing."
+                        % len(manual.failed)
+                    )
+                results.send(json.dumps(asdict(result)))
+    finally:
+        METRICS.flush()
+    if results.failed:
+        # So the shard goes back on the queue to be tried again.
+        raise RuntimeError("Failed to send shard results")
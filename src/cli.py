@@ -0,0 +1,304 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import date
+from queue import Full, Queue
+from typing import Callable, Iterable
+
+import inquirer
+
+import backfill
+from guardian_api import Article
+from resolver import Resolver
+from sqs_utils import BatchConsumer, BatchProducer
+import trakt_api
+from aws_utils import get_client, get_secret
+
+# The command line tools, for reviewing the films the lambda couldn't
+# identify, adding films by hand and backfilling the list.
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Number of films searched for ahead of the one being reviewed.
+PREFETCH_DEPTH = 3
+
+
+def get_articles_from_sqs(consumer: BatchConsumer):
+    # To be run by a human to review entries on an SQS queue.
+    # Yields each article with its message, which should be acked (deleted
+    # from the queue) once it's been dealt with.
+    for msg in consumer.messages():
+        data = json.loads(msg["Body"])
+        try:
+            yield Article(**data), msg
+        except TypeError:
+            logger.warning(f"Couldn't extract article from {data}")
+            consumer.ack(msg)
+    logger.info("No more films to process.")
+
+
+def prefetch(items: Iterable, fetch: Callable, depth: int = PREFETCH_DEPTH):
+    """
+    Yields (item, future) pairs, where the future is fetch(item) running in
+    the background.
+
+    Items are read ahead on a background thread, up to `depth` of them
+    beyond the one the caller is dealing with, so that neither reading
+    them nor fetching for them keeps the caller waiting. Closing the
+    generator (eg the user quits) stops the read ahead.
+    """
+    ready = Queue(maxsize=max(depth, 1))
+    stop = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=max(depth, 1))
+
+    def put(entry) -> bool:
+        while not stop.is_set():
+            try:
+                ready.put(entry, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def read_ahead():
+        try:
+            for item in items:
+                if stop.is_set() or not put((item, executor.submit(fetch, item))):
+                    return
+        except BaseException as e:
+            if not stop.is_set():
+                put(e)
+        finally:
+            put(None)
+
+    threading.Thread(target=read_ahead, daemon=True).start()
+    try:
+        while True:
+            entry = ready.get()
+            if entry is None:
+                return
+            if isinstance(entry, BaseException):
+                raise entry
+            yield entry
+    finally:
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def prompt_best_match(
+    title: str = "", imdb_id: str = "", results: list | None = None
+) -> str | None:
+    # Interactive function that takes a film title or imdb_id, searches trakt and
+    # prompts the user for best match. The search can be skipped by passing
+    # in results that have already been fetched.
+    if results is None:
+        trakt = trakt_api.get_api()
+        if title:
+            results = trakt.search.by_text(title)
+        elif imdb_id:
+            results = trakt.search.by_id(imdb_id)
+        else:
+            results = []
+    choices_hints = {}
+    for result in results:
+        try:
+            imdb_id = result["movie"]["ids"]["imdb"]
+        except KeyError:
+            # If there's no imdb then it's probably a low quality entry.
+            continue
+        year = result["movie"].get("year", "Unknown Year")
+        title = result["movie"]["title"]
+        score = int(result["score"])
+        choice = (f"{title} ({year}) [score: {score}]", imdb_id)
+        hint = f"https://www.imdb.com/title/{imdb_id}/"
+        choices_hints[choice] = hint
+
+    if not choices_hints:
+        print(f'No matches for "{title or imdb_id}"')
+        return
+
+    print(f"\nSelect best match for '{title or imdb_id}'")
+
+    choices_hints[("[ Skip ]", None)] = None
+    questions = [
+        inquirer.List(
+            "imdb_id",
+            message="Select matching film:",
+            choices=choices_hints.keys(),
+            hints=choices_hints,
+        ),
+    ]
+    # Ctrl+C raises so that the caller can stop cleanly.
+    answer = inquirer.prompt(questions, raise_keyboard_interrupt=True)
+    if answer:
+        return answer["imdb_id"]
+
+
+def review_messages(
+    consumer: BatchConsumer,
+    buffer: trakt_api.ListBuffer,
+    search: Callable[[str], list],
+    depth: int = PREFETCH_DEPTH,
+):
+    """
+    Prompts for the film each article on the queue reviews, adding those
+    picked to the buffer. Messages are acked once they've been dealt with.
+    """
+    # Search for the next few films while the current one is reviewed. The
+    # read ahead is stopped as soon as we are (Ctrl+C included), otherwise
+    # it carries on receiving messages nobody will see.
+    reviews = prefetch(
+        get_articles_from_sqs(consumer),
+        lambda review: search(review[0].title),
+        depth=depth,
+    )
+    with closing(reviews):
+        for (article, msg), search_results in reviews:
+            imdb_id = prompt_best_match(
+                title=article.title, results=search_results.result()
+            )
+            if imdb_id:
+                # Only ack once the film is on the list.
+                buffer.add(imdb_id, lambda msg=msg: consumer.ack(msg))
+            else:
+                consumer.ack(msg)
+
+
+def print_summary(result: dict):
+    added = result.get("added", {}).get("movies", 0)
+    existing = result.get("existing", {}).get("movies", 0)
+    print(f"Added {added} films to the list ({existing} were already on it).")
+    not_found = result.get("not_found", {}).get("movies", [])
+    if not_found:
+        imdb_ids = [movie.get("ids", {}).get("imdb") for movie in not_found]
+        print(f"Trakt couldn't find: {', '.join(map(str, imdb_ids))}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+
+    # Move this boilerplate somewhere? Global?
+    secrets = get_secret("TraktAPI")
+    trakt = trakt_api.get_api()
+
+    user_id = secrets["USER_ID"]
+    list_id = secrets["LIST_ID"]
+    api_list = trakt.list(user_id, list_id)
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command")
+    process_parser = subparsers.add_parser(
+        "process", help="Manually review the films in an AWS queue."
+    )
+    process_parser.add_argument(
+        "--aws_queue", default=os.environ.get("MANUAL_PROCESSING_QUEUE_URL")
+    )
+    process_parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=PREFETCH_DEPTH,
+        help="Number of films to search for ahead of the one being reviewed.",
+    )
+    process_parser.add_argument(
+        "--flush_every",
+        type=int,
+        default=trakt_api.FLUSH_EVERY,
+        help="Number of films to pick before writing them to the list.",
+    )
+    add_parser = subparsers.add_parser("add")
+    group = add_parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--title")
+    group.add_argument("--imdb_id")
+    backfill_parser = subparsers.add_parser(
+        "backfill", help="Add the films reviewed between two dates."
+    )
+    backfill_parser.add_argument(
+        "--from", dest="from_date", type=date.fromisoformat, required=True
+    )
+    backfill_parser.add_argument(
+        "--to", dest="to_date", type=date.fromisoformat, default=date.today()
+    )
+    backfill_parser.add_argument(
+        "--shard_days",
+        type=int,
+        default=backfill.SHARD_DAYS,
+        help="Number of days of reviews in each shard.",
+    )
+    backfill_parser.add_argument(
+        "--workers",
+        type=int,
+        default=backfill.MAX_WORKERS,
+        help="Number of shards processed at once (locally).",
+    )
+    backfill_parser.add_argument(
+        "--lambda",
+        dest="use_lambda",
+        action="store_true",
+        help="Process the shards with the backfill lambda rather than locally.",
+    )
+    backfill_parser.add_argument(
+        "--aws_queue", default=os.environ.get("MANUAL_PROCESSING_QUEUE_URL")
+    )
+    backfill_parser.add_argument(
+        "--shard_queue", default=os.environ.get("BACKFILL_SHARD_QUEUE_URL")
+    )
+    backfill_parser.add_argument(
+        "--result_queue", default=os.environ.get("BACKFILL_RESULT_QUEUE_URL")
+    )
+
+    args = parser.parse_args()
+
+    # There's a tidier way to do all this. We want to figure out a list
+    # of films to add. That list either comes from SQS (after review) or
+    # from the command line (a list of one) So build that list (of imdb
+    # ids) and then add them all at the end.
+    buffer = trakt_api.ListBuffer(
+        api_list, flush_every=getattr(args, "flush_every", trakt_api.FLUSH_EVERY)
+    )
+    try:
+        if args.command == "process":
+            # The buffer exits (and writes what's left) before the consumer
+            # does, so messages for the last films are still acknowledged.
+            with BatchConsumer(get_client("sqs"), args.aws_queue) as consumer, buffer:
+                review_messages(
+                    consumer, buffer, trakt.search.by_text, depth=args.prefetch
+                )
+
+        elif args.command == "add":
+            with buffer:
+                if args.imdb_id:
+                    results = trakt.search.by_id(args.imdb_id)
+                    imdb_id = prompt_best_match(imdb_id=args.imdb_id, results=results)
+                else:
+                    imdb_id = prompt_best_match(title=args.title)
+                if imdb_id:
+                    buffer.add(imdb_id)
+
+        elif args.command == "backfill":
+            shards = backfill.shard_range(args.from_date, args.to_date, args.shard_days)
+            progress = backfill.Progress(args.from_date, args.to_date)
+            if args.use_lambda:
+                sent = backfill.fan_out(shards, progress, args.shard_queue)
+                backfill.collect(sent, progress, args.result_queue)
+            else:
+                with BatchProducer(get_client("sqs"), args.aws_queue) as producer:
+                    backfill.run_local(
+                        shards,
+                        progress,
+                        lambda article: producer.send(json.dumps(article.to_dict())),
+                        Resolver(trakt).resolve,
+                        max_workers=args.workers,
+                    )
+            imdb_ids = backfill.write(shards, progress)
+            print(f"Wrote {len(imdb_ids)} films from {len(shards)} shards to the list.")
+    except KeyboardInterrupt:
+        print("\nStopped, films picked so far have been saved.")
+    finally:
+        if buffer.results:
+            print_summary(buffer.result)
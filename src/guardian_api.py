@@ -1,87 +1,204 @@
 from __future__ import annotations
+import json
 import logging
 import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime
-
-import requests
+from typing import Callable, Iterator
 
 from aws_utils import get_secret
+from metrics import METRICS, endpoint
+from page_cache import PageCache
+from transport import get_session
 
 BASE_URL = "https://content.guardianapis.com"
 SEARCH_URL = BASE_URL + "/search"
 
+# The API will not return more than this many results per page.
+MAX_PAGE_SIZE = 200
+# Number of page requests allowed in flight at once. Keep this low, the
+# developer key has a per second quota.
+MAX_WORKERS = 4
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# The only optional part of a search result (the show-* params) that's
+# read, for Article's imdb id. No fields or tags are asked for, so pages
+# don't carry data we'd throw away.
+REFERENCES = "imdb"
+
 # Code that interacts with Guardian API.
 # Documentation is found here: https://open-platform.theguardian.com/documentation/
 
 
-def get_imdb_id(article: dict) -> str | None:
+# Titles are taken from the headline, eg "Dune: Part Two review – ...".
+TITLE_RE = re.compile(r"^([\w\s\-:,’]+)\sreview")
+
+
+@dataclass(slots=True)
+class Article:
+    # Slotted, since a backfill can hold a lot of these at once. Still
+    # round trips through to_dict() and Article(**data) for SQS.
+    title: str
+    url: str
+    imdb_id: str | None = None
+    # The guardian's id for the article, eg "film/2024/feb/29/a-film-review"
+    id: str | None = None
+    # When the review was published, eg "2024-02-29T12:00:00Z"
+    date: str | None = None
+
+    @classmethod
+    def from_dict(cls, article: dict) -> Article:
+        """
+        Builds an Article from a search result in one pass over it.
+        """
+        web_title = article["webTitle"]
+        match = TITLE_RE.match(web_title)
+        if not match:
+            raise ValueError(f'No title found in "{web_title}"')
+        imdb_id = None
+        for ref in article.get("references", ()):
+            if ref["type"] == "imdb":
+                imdb_id = ref["id"].rpartition("/")[2]
+                break
+        return cls(
+            match.group(1),
+            article["webUrl"],
+            imdb_id,
+            article.get("id"),
+            article.get("webPublicationDate"),
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "title": self.title,
+            "url": self.url,
+            "imdb_id": self.imdb_id,
+            "id": self.id,
+            "date": self.date,
+        }
+
+
+def get_page(params: dict, page: int, cache: PageCache | None = None) -> dict:
     """
-    Extracts the imdb ids from a list of films provided by the Guardian API.
+    Fetches a single page of search results, from the cache if one is given
+    and it has the page.
     """
-    for ref in article.get("references", []):
-        if ref["type"] == "imdb":
-            id = ref["id"].split("/")[-1]
-            return id
+    params = {**params, "page": page}
+    if cache:
+        data = cache.get(params)
+        if data is not None:
+            return data
+    session = get_session("guardian")
+    with METRICS.timer("fetch"), endpoint("search"):
+        response = session.get(SEARCH_URL, params=params)
+        # Errors (eg a bad key, or over quota) come back as JSON too, make
+        # sure they're raised rather than parsed, or cached.
+        response.raise_for_status()
+        # Straight from the (already decompressed) bytes, json works out the
+        # encoding itself so there's no need to decode to a str first.
+        data = json.loads(response.content)["response"]
+    if cache:
+        cache.put(params, data)
+    return data
 
 
-def get_title(article: dict) -> str:
-    webTitle = article["webTitle"]
-    title_regex = re.compile(r"^([\w\s\-:,’]+)\sreview")
-    match = title_regex.match(webTitle)
-    if match:
-        return str(match.groups(1)[0])
-    else:
-        raise ValueError(f'No title found in "${webTitle}"')
+def parse_results(results: list[dict]) -> list[Article]:
+    articles = []
+    # Looked up once rather than for every result.
+    append = articles.append
+    from_dict = Article.from_dict
+    for data in results:
+        try:
+            append(from_dict(data))
+        except Exception as e:
+            # Some sort of parse error occurred.
+            logger.error(e)
+    return articles
 
-def get_url(article: dict) -> str:
-    return article["webUrl"]
 
-class Article:
-    def __init__(self, title: str, url: str, imdb_id: str | None = None):
-        self.title = title
-        self.url = url
-        self.imdb_id = imdb_id
+@dataclass
+class Page:
+    number: int
+    # Total number of pages in the search.
+    pages: int
+    articles: list[Article]
 
-    @classmethod
-    def from_dict(cls, article) -> Article:
-        title = get_title(article)
-        url = get_url(article)
-        imdb_id = get_imdb_id(article)
-
-        return cls(title, url, imdb_id)
-
-    def to_dict(self):
-        return dict(title=self.title, url=self.url, imdb_id=self.imdb_id)
-
-def get_articles(from_date: datetime):
-    current_page = 1
-    pages = 1
-    from_date_string = from_date.strftime("%Y-%m-%d")
-    while current_page <= pages:
-        params = {
-            "api-key": get_secret("GuardianAPI")["API_KEY"],
-            "star-rating": "4|5",
-            "section": "film",
-            "show-fields": ["byline", "starRating"],
-            "show-references": "imdb",
-            "show-tags": "contributor",
-            "from-date": from_date_string,
-            "page": current_page,
-        }
-        # gets film reviews from guardian.
-        response = requests.get(SEARCH_URL, params=params)
-        json_data = response.json()
-        pages = json_data["response"]["pages"]
-        results = json_data["response"]["results"]
-        for data in results:
-            try:
-                article = Article.from_dict(data)
-            except Exception as e:
-                # Some sort of parse error occurred.
-                logger.error(e)
-                continue
-            yield article
-        current_page += 1
+
+def parse_page(number: int, data: dict) -> Page:
+    """
+    Parses a whole page of search results (the "response" part).
+    """
+    return Page(number, data["pages"], parse_results(data["results"]))
+
+
+def get_pages(
+    from_date: datetime,
+    page_size: int = MAX_PAGE_SIZE,
+    max_workers: int = MAX_WORKERS,
+    cache: PageCache | None = None,
+    start_page: int = 1,
+    should_stop: Callable[[], bool] | None = None,
+    to_date: datetime | None = None,
+) -> Iterator[Page]:
+    """
+    Yields pages of film review articles published since from_date (up to
+    and including to_date, if given).
+
+    The first page tells us how many pages there are, the remainder are
+    then fetched concurrently, with at most max_workers requests in flight.
+    Pages are yielded in order regardless. Once should_stop returns True no
+    more pages are requested, though those already in flight are yielded.
+    """
+    if not 1 <= page_size <= MAX_PAGE_SIZE:
+        raise ValueError(f"page_size must be between 1 and {MAX_PAGE_SIZE}")
+    params = {
+        "api-key": get_secret("GuardianAPI")["API_KEY"],
+        "star-rating": "4|5",
+        "section": "film",
+        "show-references": REFERENCES,
+        "from-date": from_date.strftime("%Y-%m-%d"),
+        "page-size": page_size,
+    }
+    if to_date:
+        params["to-date"] = to_date.strftime("%Y-%m-%d")
+    # gets film reviews from guardian.
+    first_page = get_page(params, start_page, cache)
+    pages = first_page["pages"]
+    yield parse_page(start_page, first_page)
+
+    next_page = start_page + 1
+    if next_page > pages:
+        return
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            while True:
+                while (
+                    next_page <= pages
+                    and len(in_flight) < max_workers
+                    and not (should_stop and should_stop())
+                ):
+                    future = executor.submit(get_page, params, next_page, cache)
+                    in_flight.append((next_page, future))
+                    next_page += 1
+                if not in_flight:
+                    return
+                page, future = in_flight.popleft()
+                yield parse_page(page, future.result())
+        finally:
+            # If we're stopped early don't wait for pages nobody wants.
+            for _, future in in_flight:
+                future.cancel()
+
+
+def get_articles(*args, **kwargs) -> Iterator[Article]:
+    """
+    Yields film review articles published since from_date. Takes the same
+    arguments as get_pages.
+    """
+    for page in get_pages(*args, **kwargs):
+        yield from page.articles
@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import List
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# A local copy of the trakt list, so that update_list doesn't have to
+# download the whole thing on every run. /tmp survives between warm lambda
+# invocations, locally the path can be changed with GOODFILMS_LIST_SNAPSHOT.
+DEFAULT_PATH = "/tmp/good-films/list-snapshot.json"
+
+
+def snapshot_path() -> str:
+    return os.environ.get("GOODFILMS_LIST_SNAPSHOT", DEFAULT_PATH)
+
+
+def compact(item: dict) -> dict:
+    """
+    Keeps only the parts of a list item that we use.
+    """
+    ids = item.get("movie", {}).get("ids", {})
+    return {
+        "imdb": ids.get("imdb"),
+        "trakt": ids.get("trakt"),
+        "listed_at": item.get("listed_at"),
+        "rank": item.get("rank"),
+    }
+
+
+def now() -> str:
+    # Same format as trakt's timestamps, eg 2024-02-29T00:00:00.000Z
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+class ListSnapshot:
+    def __init__(
+        self,
+        items: List[dict] | None = None,
+        updated_at: str | None = None,
+        item_count: int | None = None,
+        etag: str | None = None,
+        path: str | None = None,
+    ):
+        self.items = items or []
+        # imdb ids on the list, for quick membership checks.
+        self.index = {item["imdb"] for item in self.items if item["imdb"]}
+        self.updated_at = updated_at
+        self.item_count = item_count
+        self.etag = etag
+        self.path = path or snapshot_path()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, imdb_id: str):
+        return imdb_id in self.index
+
+    @classmethod
+    def load(cls, path: str | None = None) -> "ListSnapshot | None":
+        path = path or snapshot_path()
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable list snapshot {path}: {e}")
+            return None
+        return cls(path=path, **data)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        data = dict(
+            items=self.items,
+            updated_at=self.updated_at,
+            item_count=self.item_count,
+            etag=self.etag,
+        )
+        # Write then rename so that a concurrent reader never sees half a file.
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+    def matches(self, summary: dict) -> bool:
+        """
+        True if the list hasn't changed since the snapshot was taken.
+        """
+        return (
+            self.updated_at is not None
+            and self.updated_at == summary.get("updated_at")
+            and self.item_count == summary.get("item_count")
+            and self.item_count == len(self.items)
+        )
+
+    def oldest(self, n: int, keep: set | frozenset = frozenset()) -> List[dict]:
+        """
+        The n items that have been on the list longest, ignoring those in keep.
+        """
+        items = [
+            item for item in self.items if item["imdb"] and item["imdb"] not in keep
+        ]
+        items.sort(key=lambda item: item["listed_at"] or "")
+        return items[:n]
+
+    def _update_summary(self, result: dict):
+        summary = result.get("list") or {}
+        self.updated_at = summary.get("updated_at")
+        self.item_count = summary.get("item_count")
+        # Whatever etag we had no longer describes the list.
+        self.etag = None
+        if self.item_count != len(self.items):
+            # We've lost track somewhere, make the next sync download it all.
+            self.updated_at = None
+
+    def apply_added(self, imdb_ids: List[str], result: dict):
+        """
+        Patches the snapshot with the response from ListRoute.add.
+        """
+        not_found = {
+            movie.get("ids", {}).get("imdb")
+            for movie in result.get("not_found", {}).get("movies", [])
+        }
+        rank = max((item["rank"] or 0 for item in self.items), default=0)
+        listed_at = now()
+        for imdb_id in imdb_ids:
+            if imdb_id in not_found or imdb_id in self.index:
+                continue
+            rank += 1
+            self.index.add(imdb_id)
+            self.items.append(
+                {"imdb": imdb_id, "trakt": None, "listed_at": listed_at, "rank": rank}
+            )
+        self._update_summary(result)
+
+    def apply_deleted(self, imdb_ids: List[str], result: dict):
+        """
+        Patches the snapshot with the response from ListRoute.delete.
+        """
+        deleted = set(imdb_ids)
+        self.items = [item for item in self.items if item["imdb"] not in deleted]
+        self.index -= deleted
+        self._update_summary(result)
+
+
+def sync(api_list, path: str | None = None) -> ListSnapshot:
+    """
+    Returns an up to date snapshot of the list, only downloading the items
+    if the list has changed since we last looked.
+    """
+    snapshot = ListSnapshot.load(path)
+    summary = api_list.summary()
+    if snapshot and snapshot.matches(summary):
+        logger.info("List unchanged since last run, using snapshot.")
+        return snapshot
+
+    response = api_list.fetch(etag=snapshot.etag if snapshot else None)
+    if snapshot and response.status_code == 304:
+        logger.info("List not modified, using snapshot.")
+    else:
+        snapshot = ListSnapshot(
+            items=[compact(item) for item in response.json()],
+            etag=response.headers.get("ETag"),
+            path=path,
+        )
+    snapshot.updated_at = summary.get("updated_at")
+    snapshot.item_count = summary.get("item_count")
+    snapshot.save()
+    return snapshot
@@ -0,0 +1,15 @@
+import logging
+import sys
+
+import app
+import trakt_writer
+
+# Runs both stages in one process, for running locally: the ids the ingest
+# stage finds are handed straight to the trakt writer rather than going
+# through the resolved ids queue.
+#
+#     MANUAL_PROCESSING_QUEUE_URL=... python src/local.py
+
+if __name__ == "__main__":
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+    app.run({}, None, write_ids=trakt_writer.write)
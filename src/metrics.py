@@ -0,0 +1,195 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+# Request and stage metrics, written out as CloudWatch Embedded Metric Format
+# log lines (https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/
+# CloudWatch_Embedded_Metric_Format_Specification.html) so CloudWatch turns
+# them into metrics without any extra API calls.
+NAMESPACE = "GoodFilms"
+# Upper bounds (ms) of the latency histogram buckets.
+LATENCY_BUCKETS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+# EMF allows at most this many values for a metric in one log line.
+MAX_VALUES = 100
+
+_local = threading.local()
+
+
+class EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes = 0
+        self.statuses = Counter()
+        self.latencies: List[float] = []
+
+    def histogram(self) -> Dict[str, int]:
+        counts = Counter()
+        for latency in self.latencies:
+            i = bisect_left(LATENCY_BUCKETS, latency)
+            if i < len(LATENCY_BUCKETS):
+                counts[f"<={LATENCY_BUCKETS[i]}ms"] += 1
+            else:
+                counts[f">{LATENCY_BUCKETS[-1]}ms"] += 1
+        return dict(counts)
+
+
+class Metrics:
+    """
+    Collects metrics from any thread until flush() writes them out.
+    """
+
+    def __init__(self, namespace: str = NAMESPACE):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._endpoints: Dict[tuple, EndpointStats] = defaultdict(EndpointStats)
+        self._stages: Dict[str, List[float]] = defaultdict(list)
+
+    def record_request(
+        self,
+        service: str,
+        endpoint: str,
+        status: int | None,
+        seconds: float,
+        size: int = 0,
+    ):
+        """
+        A request (or attempt) and how it went. A status of None means it
+        didn't get a response at all.
+        """
+        with self._lock:
+            stats = self._endpoints[(service, endpoint)]
+            stats.requests += 1
+            stats.statuses[str(status or "error")] += 1
+            if status is None or status >= 400:
+                stats.errors += 1
+            stats.bytes += size
+            stats.latencies.append(round(seconds * 1000, 3))
+
+    def record_retry(self, service: str, endpoint: str, count: int = 1):
+        with self._lock:
+            self._endpoints[(service, endpoint)].retries += count
+
+    def record_stage(self, stage: str, seconds: float):
+        with self._lock:
+            self._stages[stage].append(round(seconds * 1000, 3))
+
+    @contextmanager
+    def timer(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(stage, time.perf_counter() - start)
+
+    def _line(self, dimensions: dict, metrics: dict, units: dict, **properties):
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": self.namespace,
+                        "Dimensions": [list(dimensions)],
+                        "Metrics": [
+                            {"Name": name, "Unit": units[name]} for name in metrics
+                        ],
+                    }
+                ],
+            },
+            **dimensions,
+            **metrics,
+            **properties,
+        }
+
+    def lines(self) -> List[dict]:
+        """
+        The EMF documents for everything recorded so far.
+        """
+        with self._lock:
+            endpoints = dict(self._endpoints)
+            stages = dict(self._stages)
+        lines = []
+        units = {
+            "Requests": "Count",
+            "Errors": "Count",
+            "Retries": "Count",
+            "ResponseBytes": "Bytes",
+            "Latency": "Milliseconds",
+            "Duration": "Milliseconds",
+            "Calls": "Count",
+        }
+        for (service, endpoint), stats in sorted(endpoints.items()):
+            dimensions = {"Service": service, "Endpoint": endpoint}
+            # Latencies are sent as raw values, split over as many lines as
+            # EMF needs. The counts go on the first line only.
+            chunks = [
+                stats.latencies[i:i + MAX_VALUES]
+                for i in range(0, len(stats.latencies), MAX_VALUES)
+            ] or [[]]
+            for n, chunk in enumerate(chunks):
+                metrics = {"Latency": chunk} if chunk else {}
+                properties = {}
+                if n == 0:
+                    metrics.update(
+                        {
+                            "Requests": stats.requests,
+                            "Errors": stats.errors,
+                            "Retries": stats.retries,
+                            "ResponseBytes": stats.bytes,
+                        }
+                    )
+                    properties = {
+                        "StatusCodes": dict(stats.statuses),
+                        "LatencyHistogram": stats.histogram(),
+                    }
+                lines.append(self._line(dimensions, metrics, units, **properties))
+        for stage, durations in sorted(stages.items()):
+            lines.append(
+                self._line(
+                    {"Stage": stage},
+                    {"Duration": sum(durations), "Calls": len(durations)},
+                    units,
+                )
+            )
+        return lines
+
+    def flush(self, write: Callable[[str], object] = print):
+        """
+        Writes out (and forgets) everything recorded so far.
+        """
+        lines = self.lines()
+        self.reset()
+        for line in lines:
+            write(json.dumps(line, separators=(",", ":")))
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+            self._stages.clear()
+
+
+# Shared by the whole process, flushed at the end of each invocation.
+METRICS = Metrics()
+
+
+@contextmanager
+def endpoint(name: str):
+    """
+    Names the endpoint for requests made (on this thread) inside the block,
+    so they're grouped by what they do rather than by URL.
+    """
+    previous = getattr(_local, "endpoint", None)
+    _local.endpoint = name
+    try:
+        yield
+    finally:
+        _local.endpoint = previous
+
+
+def current_endpoint(default: str) -> str:
+    return getattr(_local, "endpoint", None) or default
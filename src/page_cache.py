@@ -0,0 +1,138 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import date
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Guardian search pages are cached on disk so that a retry (or a local run,
+# or a benchmark) doesn't spend API quota on pages we've already fetched.
+# Each page is a gzipped JSON file named after a hash of its request params.
+DEFAULT_PATH = "/tmp/good-films/guardian-pages"
+# Pages for a date range that has finished won't change.
+TTL = 7 * 24 * 60 * 60
+# Pages for a range that includes today will, as reviews get published and
+# push the older results along.
+TODAY_TTL = 15 * 60
+MAX_BYTES = 20 * 1024 * 1024
+
+# Params that don't affect the results, and shouldn't end up on disk.
+IGNORED_PARAMS = {"api-key"}
+
+
+def cache_path() -> str:
+    return os.environ.get("GOODFILMS_PAGE_CACHE", DEFAULT_PATH)
+
+
+def normalize(params: dict) -> str:
+    """
+    A stable string for a set of request params, eg lists and strings that
+    requests would send the same way give the same result.
+    """
+    normalized = {}
+    for key, value in params.items():
+        if key in IGNORED_PARAMS:
+            continue
+        if isinstance(value, (list, tuple)):
+            value = ",".join(str(v) for v in value)
+        normalized[key] = str(value)
+    return json.dumps(normalized, sort_keys=True, separators=(",", ":"))
+
+
+def cache_key(params: dict) -> str:
+    return hashlib.sha256(normalize(params).encode()).hexdigest()
+
+
+def covers_today(params: dict) -> bool:
+    to_date = params.get("to-date")
+    return not to_date or str(to_date) >= date.today().isoformat()
+
+
+class PageCache:
+    def __init__(
+        self,
+        path: str | None = None,
+        ttl: int = TTL,
+        today_ttl: int = TODAY_TTL,
+        max_bytes: int = MAX_BYTES,
+    ):
+        self.path = path or cache_path()
+        self.ttl = ttl
+        self.today_ttl = today_ttl
+        self.max_bytes = max_bytes
+
+    def _file(self, params: dict) -> str:
+        return os.path.join(self.path, cache_key(params) + ".json.gz")
+
+    def ttl_for(self, params: dict) -> int:
+        return self.today_ttl if covers_today(params) else self.ttl
+
+    def get(self, params: dict) -> dict | None:
+        path = self._file(params)
+        try:
+            with gzip.open(path, "rt") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable cached page {path}: {e}")
+            return None
+        if entry["expires"] < time.time():
+            self._remove(path)
+            return None
+        # The modification time doubles as "last used" for eviction.
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return entry["data"]
+
+    def put(self, params: dict, data: dict):
+        os.makedirs(self.path, exist_ok=True)
+        path = self._file(params)
+        entry = {"expires": time.time() + self.ttl_for(params), "data": data}
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(tmp_path, "wt") as f:
+            json.dump(entry, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used pages until we're under max_bytes.
+        """
+        entries = []
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if not entry.name.endswith(".json.gz"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        if not os.path.isdir(self.path):
+            return
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if entry.name.endswith(".json.gz"):
+                    self._remove(entry.path)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,179 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from queue import Empty, Full, Queue
+from typing import Callable, Iterable, List
+
+from guardian_api import Article
+from metrics import METRICS
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Ids are written to trakt once there are this many waiting...
+BATCH_SIZE = 100
+# ...or once the oldest has been waiting this many seconds.
+FLUSH_INTERVAL = 5.0
+# How many items can be waiting between stages before the stage feeding
+# them has to wait. Keeps memory flat however big the backfill.
+QUEUE_SIZE = 200
+# Resolving an article takes several trakt requests, so only this many are
+# let through to wait for the resolver. Otherwise there could be minutes of
+# resolving still to do when the source runs out (or out of time).
+RESOLVE_QUEUE_SIZE = 5
+
+# Put on a queue to tell the stage reading it there's nothing more to come.
+_DONE = object()
+
+
+@dataclass
+class PipelineStats:
+    articles: int = 0
+    imdb_ids: int = 0
+    resolved: int = 0
+    unresolved: int = 0
+    batches: int = 0
+
+
+class Pipeline:
+    """
+    Streams articles through to trakt and the manual processing queue.
+
+    The caller's iterable of articles is read (and routed) on the calling
+    thread. Articles with an imdb id go to a writer thread that batches them
+    up for write_ids. Those without go to a thread that tries to resolve
+    them (if given a resolve function), passing any it can on to the writer
+    and calling enqueue for the rest. The stages are joined by bounded
+    queues so the network waits overlap.
+
+    Once should_stop returns True articles are no longer resolved, they go
+    straight to enqueue, so a deadline isn't overrun.
+    """
+
+    def __init__(
+        self,
+        write_ids: Callable[[List[str]], object],
+        enqueue: Callable[[Article], object],
+        resolve: Callable[[Article], str | None] | None = None,
+        batch_size: int = BATCH_SIZE,
+        flush_interval: float = FLUSH_INTERVAL,
+        queue_size: int = QUEUE_SIZE,
+        resolve_queue_size: int = RESOLVE_QUEUE_SIZE,
+        should_stop: Callable[[], bool] | None = None,
+    ):
+        self.write_ids = write_ids
+        self.enqueue = enqueue
+        self.resolve = resolve
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.resolve_queue_size = resolve_queue_size
+        self.should_stop = should_stop
+        self.stats = PipelineStats()
+        self._error: BaseException | None = None
+        self._failed = threading.Event()
+
+    def run(self, articles: Iterable[Article]) -> PipelineStats:
+        ids_queue = Queue(maxsize=self.queue_size)
+        unresolved_queue = Queue(maxsize=self.resolve_queue_size)
+        writer = threading.Thread(target=self._guard, args=(self._write, ids_queue))
+        resolver = threading.Thread(
+            target=self._guard,
+            args=(lambda queue: self._resolve(queue, ids_queue), unresolved_queue),
+        )
+        writer.start()
+        resolver.start()
+        try:
+            for article in articles:
+                if self._failed.is_set():
+                    break
+                self.stats.articles += 1
+                if article.imdb_id:
+                    queued = self._put(ids_queue, article.imdb_id)
+                else:
+                    queued = self._put(unresolved_queue, article)
+                if not queued:
+                    break
+        finally:
+            # The resolver feeds the writer, so it has to finish first.
+            self._put(unresolved_queue, _DONE, force=True)
+            resolver.join()
+            self._put(ids_queue, _DONE, force=True)
+            writer.join()
+        if self._error:
+            raise self._error
+        return self.stats
+
+    def _put(self, queue: Queue, item, force=False) -> bool:
+        # Don't block forever on a queue whose reader has died.
+        while True:
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                if self._failed.is_set() and not force:
+                    return False
+
+    def _guard(self, stage, queue: Queue):
+        try:
+            stage(queue)
+        except BaseException as e:
+            self._error = self._error or e
+            self._failed.set()
+            # Keep reading so that nothing upstream blocks on us.
+            while queue.get() is not _DONE:
+                pass
+
+    def _write(self, queue: Queue):
+        batch: List[str] = []
+        deadline = 0.0
+        while True:
+            timeout = max(deadline - time.monotonic(), 0) if batch else None
+            try:
+                item = queue.get(timeout=timeout)
+            except Empty:
+                self._flush(batch)
+                continue
+            if item is _DONE:
+                self._flush(batch)
+                return
+            if not batch:
+                deadline = time.monotonic() + self.flush_interval
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+
+    def _flush(self, batch: List[str]):
+        if not batch:
+            return
+        # Handing the batch on, eg to the resolved ids queue. Writes to the
+        # list itself are timed as list_write.
+        with METRICS.timer("publish"):
+            self.write_ids(list(batch))
+        self.stats.imdb_ids += len(batch)
+        self.stats.batches += 1
+        batch.clear()
+
+    def _resolve(self, queue: Queue, ids_queue: Queue):
+        while True:
+            article = queue.get()
+            if article is _DONE:
+                return
+            imdb_id = None
+            if self.resolve and not (self.should_stop and self.should_stop()):
+                try:
+                    with METRICS.timer("resolve"):
+                        imdb_id = self.resolve(article)
+                except Exception as e:
+                    # Not being able to resolve it isn't fatal, a human can.
+                    logger.warning(f'Failed to resolve "{article.title}": {e}')
+            if imdb_id:
+                article.imdb_id = imdb_id
+                self.stats.resolved += 1
+                if not self._put(ids_queue, imdb_id):
+                    return
+            else:
+                with METRICS.timer("enqueue"):
+                    self.enqueue(article)
+                self.stats.unresolved += 1
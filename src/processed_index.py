@@ -0,0 +1,91 @@
+import base64
+import hashlib
+import json
+import logging
+from datetime import date
+from typing import Dict
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# The guardian articles already processed. Searches only go down to the day,
+# so each run reads the last day of the run before again. Anything in here
+# is skipped rather than sent to trakt (or the manual queue) a second time.
+#
+# Kept small enough for an SSM parameter: each article is a short hash of
+# its id and the day it was processed, and entries expire after a few days.
+PARAMETER = "GoodFilms_Processed"
+# Long enough to cover a few missed daily runs.
+MAX_AGE_DAYS = 7
+# The most a standard SSM parameter can hold.
+MAX_BYTES = 4096
+# Bytes of the hash kept, enough that different articles a week apart
+# won't collide.
+HASH_BYTES = 6
+
+
+def article_key(article_id: str) -> str:
+    digest = hashlib.sha256(article_id.encode()).digest()[:HASH_BYTES]
+    return base64.urlsafe_b64encode(digest).decode()
+
+
+class ProcessedIndex:
+    def __init__(
+        self,
+        entries: Dict[str, int] | None = None,
+        today: date | None = None,
+        max_age_days: int = MAX_AGE_DAYS,
+    ):
+        # Article key -> the day (as an ordinal) it was processed.
+        self.entries = entries or {}
+        self.today = (today or date.today()).toordinal()
+        self.max_age_days = max_age_days
+        self.changed = False
+        self.expire()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, article_id: str):
+        return article_key(article_id) in self.entries
+
+    @classmethod
+    def loads(cls, value: str | None, **kwargs) -> "ProcessedIndex":
+        entries = None
+        if value:
+            try:
+                entries = json.loads(value)
+            except ValueError as e:
+                # Worst case the last day's articles are processed again.
+                logger.warning(f"Ignoring unreadable processed index: {e}")
+        return cls(entries, **kwargs)
+
+    def dumps(self, max_bytes: int = MAX_BYTES) -> str:
+        """
+        The index as compact JSON. If it won't fit in max_bytes the oldest
+        entries are dropped.
+        """
+        # Newest day first. Within a day entries stay in the order they were
+        # added, which is newest article first as that's how search results
+        # come, so trimming from the end drops the oldest articles. The
+        # newest are the ones the next run reads again.
+        entries = sorted(self.entries.items(), key=lambda entry: -entry[1])
+        while True:
+            value = json.dumps(dict(entries), separators=(",", ":"))
+            if len(value) <= max_bytes:
+                return value
+            # Each entry takes about 18 bytes.
+            excess = len(value) - max_bytes
+            entries = entries[:-max(excess // 18, 1)]
+
+    def add(self, article_id: str):
+        self.entries[article_key(article_id)] = self.today
+        self.changed = True
+
+    def expire(self):
+        oldest = self.today - self.max_age_days
+        expired = [key for key, day in self.entries.items() if day < oldest]
+        for key in expired:
+            del self.entries[key]
+        if expired:
+            self.changed = True
@@ -0,0 +1,192 @@
+import json
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+from metrics import METRICS, current_endpoint
+from transport import TransportAdapter
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Upper bound on the random delay added to every back off, so that threads
+# that were told to wait the same amount of time don't all retry at once.
+MAX_JITTER = 1.0
+# The longest we'll wait before retrying (or after the server says we've
+# used up the current window), so a 30 second lambda isn't put to sleep past
+# its deadline. Asked to wait any longer, the 429 goes back to the caller.
+MAX_RETRY_DELAY = 10
+
+
+class TokenBucket:
+    """
+    Client side rate limiter allowing `rate` calls per second, with bursts
+    of up to `capacity` calls.
+
+    Callers reserve a token before they wait for it, so threads are served
+    in the order they asked and the bucket can go into debt.
+    """
+
+    def __init__(self, rate: float, capacity: float, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            elapsed = now - self.updated
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def reserve(self) -> float:
+        """
+        Takes a token and returns how long the caller must wait before using it.
+        """
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            self.tokens -= 1
+            return max(self.updated - now, 0) + max(-self.tokens, 0) / self.rate
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """
+        Stops handing out tokens for the given number of seconds.
+        """
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            self.tokens = min(self.tokens, 1)
+            self.updated = max(self.updated, now + seconds)
+
+    def limit_remaining(self, remaining: int):
+        """
+        Brings the bucket in line with what the server says we have left.
+        """
+        with self._lock:
+            self.tokens = min(self.tokens, remaining)
+
+
+def retry_after(response) -> float | None:
+    """
+    Seconds to wait according to a Retry-After header, which is either a
+    number of seconds or an HTTP date.
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        until = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((until - datetime.now(timezone.utc)).total_seconds(), 0)
+
+
+def rate_limit_header(response) -> dict | None:
+    """
+    Parses the JSON in an X-Ratelimit header, eg:
+    {"name": "AUTHED_API_GET_LIMIT", "period": 300, "limit": 1000,
+     "remaining": 0, "until": "2024-02-29T00:24:00Z"}
+    """
+    value = response.headers.get("X-Ratelimit")
+    if not value:
+        return None
+    try:
+        return json.loads(value)
+    except ValueError:
+        return None
+
+
+class RateLimitAdapter(TransportAdapter):
+    """
+    Adapter that waits for a token before every request and backs off when
+    the server responds with 429 (Too Many Requests).
+
+    Reads (GET, HEAD, OPTIONS) and writes (everything else) are limited by
+    separate buckets.
+    """
+
+    READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+    def __init__(
+        self,
+        read_bucket: TokenBucket,
+        write_bucket: TokenBucket,
+        rate_limit_retries: int = 5,
+        **kwargs,
+    ):
+        self.read_bucket = read_bucket
+        self.write_bucket = write_bucket
+        self.rate_limit_retries = rate_limit_retries
+        super().__init__(**kwargs)
+
+    def bucket_for(self, request) -> TokenBucket:
+        if request.method in self.READ_METHODS:
+            return self.read_bucket
+        return self.write_bucket
+
+    def send(self, request, **kwargs):
+        bucket = self.bucket_for(request)
+        attempt = 0
+        while True:
+            bucket.acquire()
+            response = super().send(request, **kwargs)
+            self.observe(bucket, response)
+            if response.status_code != 429 or attempt >= self.rate_limit_retries:
+                return response
+            delay = retry_after(response)
+            if delay is not None and delay > MAX_RETRY_DELAY:
+                logger.warning(
+                    "Rate limited by %s for %.0fs, longer than we'll wait."
+                    % (request.url, delay)
+                )
+                return response
+            attempt += 1
+            METRICS.record_retry(
+                self.service, current_endpoint(urlsplit(request.url).path)
+            )
+            if delay is None:
+                delay = min(2**attempt, MAX_RETRY_DELAY)
+            delay += random.uniform(0, MAX_JITTER)
+            logger.warning(
+                "Rate limited by %s, retrying in %.1fs (attempt %d of %d)."
+                % (request.url, delay, attempt, self.rate_limit_retries)
+            )
+            # Let the pool have the connection back while we wait.
+            response.close()
+            bucket.pause(delay)
+
+    def observe(self, bucket: TokenBucket, response):
+        limit = rate_limit_header(response)
+        if not limit or "remaining" not in limit:
+            return
+        try:
+            remaining = int(limit["remaining"])
+        except (TypeError, ValueError):
+            return
+        bucket.limit_remaining(remaining)
+        if remaining <= 0 and limit.get("until"):
+            try:
+                until = datetime.fromisoformat(limit["until"].replace("Z", "+00:00"))
+            except ValueError:
+                return
+            seconds = (until - datetime.now(timezone.utc)).total_seconds()
+            if seconds > 0:
+                # Any later requests that are still too early get a 429, and
+                # are retried or returned as usual.
+                bucket.pause(min(seconds, MAX_RETRY_DELAY))
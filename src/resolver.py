@@ -0,0 +1,164 @@
+import logging
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Dict, List
+
+import trakt_api
+from guardian_api import Article
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Works out the imdb id for reviews the guardian didn't tag with one, by
+# searching trakt and comparing the titles it finds (and their aliases) to
+# the title in the review. Only confident matches are used, anything else
+# still goes to a human.
+
+# Best match must score at least this (out of 1)...
+THRESHOLD = 0.85
+# ...and be this far ahead of the next best film.
+MARGIN = 0.1
+# Aliases are looked up for at most this many of the best search results.
+MAX_CANDIDATES = 5
+
+# How much a match is trusted given the film's release year relative to the
+# year of the review. Films are usually reviewed on release, or after a
+# festival run the year before.
+YEAR_WEIGHTS = {0: 1.0, 1: 1.0, 2: 0.9}
+OTHER_YEAR_WEIGHT = 0.7
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+
+def normalize_title(title: str) -> str:
+    title = unicodedata.normalize("NFKD", title)
+    title = "".join(c for c in title if not unicodedata.combining(c))
+    title = title.casefold().replace("&", " and ")
+    title = _PUNCTUATION.sub(" ", title)
+    return " ".join(title.split())
+
+
+def trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def year_weight(film_year: int | None, review_year: int | None) -> float:
+    if not film_year or not review_year:
+        return 1.0
+    return YEAR_WEIGHTS.get(review_year - film_year, OTHER_YEAR_WEIGHT)
+
+
+class TitleIndex:
+    """
+    An in memory trigram index of film titles, for fuzzy matching.
+    """
+
+    def __init__(self):
+        # (key, token set, trigram set) for every title added.
+        self._titles: List[tuple] = []
+        # trigram -> positions in self._titles
+        self._postings: Dict[str, set] = defaultdict(set)
+
+    def add(self, key: str, title: str):
+        normalized = normalize_title(title)
+        grams = trigrams(normalized)
+        position = len(self._titles)
+        self._titles.append((key, set(normalized.split()), grams))
+        for gram in grams:
+            self._postings[gram].add(position)
+
+    def search(self, title: str) -> Dict[str, float]:
+        """
+        Scores (0 to 1) for each key with a title like the one given.
+        """
+        normalized = normalize_title(title)
+        grams = trigrams(normalized)
+        words = set(normalized.split())
+        positions = set()
+        for gram in grams:
+            positions |= self._postings.get(gram, set())
+        scores = {}
+        for position in positions:
+            key, title_words, title_grams = self._titles[position]
+            dice = 2 * len(grams & title_grams) / (len(grams) + len(title_grams))
+            jaccard = len(words & title_words) / len(words | title_words)
+            score = 0.7 * dice + 0.3 * jaccard
+            scores[key] = max(score, scores.get(key, 0))
+        return scores
+
+
+class Resolver:
+    def __init__(
+        self,
+        trakt: "trakt_api.TraktAPI | None" = None,
+        threshold: float = THRESHOLD,
+        margin: float = MARGIN,
+        max_candidates: int = MAX_CANDIDATES,
+    ):
+        self._trakt = trakt
+        self.threshold = threshold
+        self.margin = margin
+        self.max_candidates = max_candidates
+
+    @property
+    def trakt(self) -> trakt_api.TraktAPI:
+        # Only go looking for credentials if there's something to resolve.
+        if self._trakt is None:
+            self._trakt = trakt_api.get_api()
+        return self._trakt
+
+    def _best(self, scores: Dict[str, float]) -> str | None:
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        if not ranked:
+            return None
+        imdb_id, best = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0
+        if best >= self.threshold and best - runner_up >= self.margin:
+            return imdb_id
+        return None
+
+    def resolve(self, article: Article) -> str | None:
+        """
+        Returns the imdb id for the film the article reviews, if we can be
+        confident of it.
+        """
+        review_year = int(article.date[:4]) if article.date else None
+        movies = {}
+        for result in self.trakt.search.by_text(article.title):
+            movie = result.get("movie") or {}
+            imdb_id = movie.get("ids", {}).get("imdb")
+            if imdb_id and imdb_id not in movies:
+                movies[imdb_id] = movie
+        if not movies:
+            return None
+
+        index = TitleIndex()
+        for imdb_id, movie in movies.items():
+            index.add(imdb_id, movie["title"])
+
+        def weighted(scores):
+            return {
+                imdb_id: score * year_weight(movies[imdb_id].get("year"), review_year)
+                for imdb_id, score in scores.items()
+            }
+
+        scores = weighted(index.search(article.title))
+        imdb_id = self._best(scores)
+        if not imdb_id:
+            # Not conclusive on the main titles, try the best few films'
+            # other titles (eg the original language title).
+            # Other titles can look nothing like the main one, so films that
+            # didn't score at all follow in the order trakt ranked them.
+            ranked = sorted(movies, key=lambda key: scores.get(key, 0), reverse=True)
+            for candidate in ranked[:self.max_candidates]:
+                ids = movies[candidate]["ids"]
+                movie_id = ids.get("slug") or ids.get("trakt") or candidate
+                for alias in self.trakt.movie(str(movie_id)).aliases():
+                    index.add(candidate, alias["title"])
+            scores = weighted(index.search(article.title))
+            imdb_id = self._best(scores)
+        if imdb_id:
+            logger.info(f'Resolved "{article.title}" to {imdb_id}')
+        return imdb_id
@@ -0,0 +1,116 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Trakt search results change rarely, so they're cached in a local SQLite
+# file (with the most recent ones also kept in memory). Opt in by setting
+# GOODFILMS_SEARCH_CACHE to the path of the file, eg
+# /tmp/good-films/search-cache.sqlite3 on lambda.
+TTL = 7 * 24 * 60 * 60
+MAX_ENTRIES = 5000
+MEMORY_ENTRIES = 256
+
+
+def normalize_query(text: str) -> str:
+    """
+    Case and whitespace don't change what trakt finds.
+    """
+    return " ".join(text.casefold().split())
+
+
+def from_env() -> "SearchCache | None":
+    path = os.environ.get("GOODFILMS_SEARCH_CACHE")
+    return SearchCache(path) if path else None
+
+
+class SearchCache:
+    def __init__(
+        self,
+        path: str,
+        ttl: int = TTL,
+        max_entries: int = MAX_ENTRIES,
+        memory_entries: int = MEMORY_ENTRIES,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        # The connection is shared between threads (eg prefetching), so
+        # access to it is serialised with a lock.
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS searches ("
+                "key TEXT PRIMARY KEY, value TEXT, expires REAL, used REAL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS searches_used ON searches (used)"
+            )
+
+    def _remember(self, key: str, expires: float, value):
+        self._memory[key] = (expires, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            if key in self._memory:
+                expires, value = self._memory[key]
+                if expires > now:
+                    self._memory.move_to_end(key)
+                    return value
+                del self._memory[key]
+            row = self._db.execute(
+                "SELECT value, expires FROM searches WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires = row
+            if expires <= now:
+                with self._db:
+                    self._db.execute("DELETE FROM searches WHERE key = ?", (key,))
+                return None
+            with self._db:
+                self._db.execute(
+                    "UPDATE searches SET used = ? WHERE key = ?", (now, key)
+                )
+            value = json.loads(value)
+            self._remember(key, expires, value)
+            return value
+
+    def set(self, key: str, value):
+        now = time.time()
+        expires = now + self.ttl
+        with self._lock:
+            self._remember(key, expires, value)
+            with self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value, separators=(",", ":")), expires, now),
+                )
+                self._evict(now)
+
+    def _evict(self, now: float):
+        self._db.execute("DELETE FROM searches WHERE expires <= ?", (now,))
+        (count,) = self._db.execute("SELECT COUNT(*) FROM searches").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            # Least recently used first.
+            self._db.execute(
+                "DELETE FROM searches WHERE key IN "
+                "(SELECT key FROM searches ORDER BY used LIMIT ?)",
+                (excess,),
+            )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,255 @@
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# SQS won't take more than 10 messages in one batch call.
+BATCH_SIZE = 10
+# Number of batch calls made at once when flushing.
+MAX_WORKERS = 4
+# Entries that SQS fails (on its side) are retried this many times.
+MAX_ATTEMPTS = 3
+# Long poll for up to this many seconds (the most SQS allows) before
+# deciding the queue is empty.
+WAIT_TIME = 20
+# Received messages are hidden from other consumers for this long, and the
+# consumer keeps pushing that back (every HEARTBEAT_INTERVAL seconds) until
+# they've been dealt with.
+VISIBILITY_TIMEOUT = 120
+HEARTBEAT_INTERVAL = 60
+
+
+def content_hash(body: str) -> str:
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+class BatchProducer:
+    """
+    Buffers messages for a queue and sends them with send_message_batch.
+
+    Messages are identified by a hash of their body. The same body is only
+    sent once per producer, and on FIFO queues the hash is also used as the
+    deduplication id so SQS drops repeats sent within its dedupe window.
+    """
+
+    def __init__(
+        self,
+        client,
+        queue_url: str,
+        buffer_size: int = BATCH_SIZE * MAX_WORKERS,
+        max_workers: int = MAX_WORKERS,
+    ):
+        self.client = client
+        self.queue_url = queue_url
+        self.buffer_size = buffer_size
+        self.max_workers = max_workers
+        self.fifo = queue_url.endswith(".fifo")
+        self.sent = 0
+        self.failed: List[dict] = []
+        self._buffer: List[dict] = []
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def send(self, body: str):
+        digest = content_hash(body)
+        with self._lock:
+            if digest in self._seen:
+                logger.info("Skipping duplicate message %s" % digest)
+                return
+            self._seen.add(digest)
+            entry = {
+                # Ids only need to be unique within a batch.
+                "Id": digest[:80],
+                "MessageBody": body,
+                "MessageAttributes": {
+                    "ContentHash": {"DataType": "String", "StringValue": digest}
+                },
+            }
+            if self.fifo:
+                entry["MessageDeduplicationId"] = digest
+                entry["MessageGroupId"] = "good-films"
+            self._buffer.append(entry)
+            full = len(self._buffer) >= self.buffer_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            entries, self._buffer = self._buffer, []
+        if not entries:
+            return
+        batches = [
+            entries[i:i + BATCH_SIZE] for i in range(0, len(entries), BATCH_SIZE)
+        ]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # list() so that any exception gets raised here.
+            list(executor.map(self._send_batch, batches))
+
+    def _send_batch(self, entries: List[dict]):
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            response = self.client.send_message_batch(
+                QueueUrl=self.queue_url, Entries=entries
+            )
+            with self._lock:
+                self.sent += len(response.get("Successful", []))
+            failures = response.get("Failed", [])
+            if not failures:
+                return
+            retry_ids = set()
+            for failure in failures:
+                if failure.get("SenderFault") or attempt == MAX_ATTEMPTS:
+                    # Our fault (or out of attempts), retrying won't help.
+                    logger.error(
+                        "Failed to send message %s to %s: %s %s"
+                        % (
+                            failure["Id"],
+                            self.queue_url,
+                            failure.get("Code"),
+                            failure.get("Message"),
+                        )
+                    )
+                    with self._lock:
+                        self.failed.append(failure)
+                else:
+                    retry_ids.add(failure["Id"])
+            entries = [entry for entry in entries if entry["Id"] in retry_ids]
+            if not entries:
+                return
+            time.sleep(0.1 * 2**attempt)
+
+
+class BatchConsumer:
+    """
+    Receives messages from a queue ten at a time using long polling, and
+    deletes them in batches once they've been acknowledged.
+
+    While messages are waiting to be acknowledged (eg a human is deciding
+    what to do with them) a background thread keeps extending their
+    visibility timeout so they don't reappear on the queue.
+    """
+
+    def __init__(
+        self,
+        client,
+        queue_url: str,
+        wait_time: int = WAIT_TIME,
+        visibility_timeout: int = VISIBILITY_TIMEOUT,
+        heartbeat_interval: float = HEARTBEAT_INTERVAL,
+    ):
+        self.client = client
+        self.queue_url = queue_url
+        self.wait_time = wait_time
+        self.visibility_timeout = visibility_timeout
+        self.heartbeat_interval = heartbeat_interval
+        # Messages received but not yet acknowledged, by receipt handle.
+        self._in_flight = {}
+        self._acked: List[dict] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def __enter__(self):
+        self._heartbeat = threading.Thread(target=self._extend_visibility, daemon=True)
+        self._heartbeat.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._stop.set()
+        if self._heartbeat:
+            self._heartbeat.join()
+        self.flush()
+
+    def messages(self) -> Iterator[dict]:
+        while True:
+            response = self.client.receive_message(
+                QueueUrl=self.queue_url,
+                MaxNumberOfMessages=BATCH_SIZE,
+                WaitTimeSeconds=self.wait_time,
+                VisibilityTimeout=self.visibility_timeout,
+            )
+            messages = response.get("Messages")
+            if not messages:
+                logger.info("No more messages on %s" % self.queue_url)
+                return
+            with self._lock:
+                for message in messages:
+                    self._in_flight[message["ReceiptHandle"]] = message
+            yield from messages
+
+    def ack(self, message: dict):
+        """
+        Marks a message as dealt with, it'll be deleted with the next batch.
+        """
+        with self._lock:
+            self._in_flight.pop(message["ReceiptHandle"], None)
+            self._acked.append(message)
+            full = len(self._acked) >= BATCH_SIZE
+        if full:
+            self.flush()
+
+    def release(self, message: dict, delay: int = 0):
+        """
+        Puts a message back on the queue without dealing with it, for
+        another consumer to receive after `delay` seconds.
+        """
+        with self._lock:
+            self._in_flight.pop(message["ReceiptHandle"], None)
+        self.client.change_message_visibility(
+            QueueUrl=self.queue_url,
+            ReceiptHandle=message["ReceiptHandle"],
+            VisibilityTimeout=delay,
+        )
+
+    def flush(self):
+        with self._lock:
+            acked, self._acked = self._acked, []
+        for i in range(0, len(acked), BATCH_SIZE):
+            entries = [
+                {"Id": str(n), "ReceiptHandle": message["ReceiptHandle"]}
+                for n, message in enumerate(acked[i:i + BATCH_SIZE])
+            ]
+            response = self.client.delete_message_batch(
+                QueueUrl=self.queue_url, Entries=entries
+            )
+            for failure in response.get("Failed", []):
+                logger.warning(
+                    "Failed to delete message from %s: %s"
+                    % (self.queue_url, failure.get("Message"))
+                )
+
+    def _extend_visibility(self):
+        while not self._stop.wait(self.heartbeat_interval):
+            with self._lock:
+                # Acked messages aren't deleted straight away, so keep
+                # those hidden too.
+                handles = list(self._in_flight)
+                handles += [message["ReceiptHandle"] for message in self._acked]
+            for i in range(0, len(handles), BATCH_SIZE):
+                entries = [
+                    {
+                        "Id": str(n),
+                        "ReceiptHandle": handle,
+                        "VisibilityTimeout": self.visibility_timeout,
+                    }
+                    for n, handle in enumerate(handles[i:i + BATCH_SIZE])
+                ]
+                try:
+                    self.client.change_message_visibility_batch(
+                        QueueUrl=self.queue_url, Entries=entries
+                    )
+                except Exception as e:
+                    logger.warning(f"Couldn't extend message visibility: {e}")
@@ -1,14 +1,74 @@
 import json
 import logging
-from typing import List
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import cache
+from typing import Callable, List
 
 import requests
 
-from aws_utils import get_secret
+import list_snapshot
+from metrics import METRICS, current_endpoint, endpoint
+from aws_utils import get_secret, invalidate_secret
+import search_cache
+from rate_limit import RateLimitAdapter, TokenBucket
+from search_cache import SearchCache, normalize_query
+from transport import new_session
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+BASE_URL = "https://api.trakt.tv"
+
+# Trakt's published limits for authenticated apps:
+# https://trakt.docs.apiary.io/#introduction/rate-limiting
+# GET: 1000 calls every 5 minutes. POST, PUT, DELETE: 1 call per second.
+# The buckets are shared by every TraktAPI in the process since the limits
+# apply to the app, not the session.
+GET_BUCKET = TokenBucket(rate=1000 / 300, capacity=1000)
+POST_BUCKET = TokenBucket(rate=1, capacity=1)
+
+# Bulk list writes are split into chunks of this many ids, and at most
+# MAX_WORKERS chunks are posted at once.
+CHUNK_SIZE = 100
+MAX_WORKERS = 2
+# A chunk that fails (connection error, 5xx etc) is retried on its own.
+CHUNK_ATTEMPTS = 3
+# Films picked in the CLI are written to the list this many at a time.
+FLUSH_EVERY = 10
+
+
+def merge_results(results: List[dict]) -> dict:
+    """
+    Combines the responses of several list add/remove calls into one, eg:
+    {"added": {"movies": 2}, "not_found": {"movies": [...]}, "list": {...}}
+    Counts are summed and not_found lists are joined. The "list" summary is
+    taken from the last result, which should be the last to have completed.
+    """
+    merged = {}
+    for result in results:
+        for key, value in result.items():
+            if key == "list" or not isinstance(value, dict):
+                merged[key] = value
+                continue
+            section = merged.setdefault(key, {})
+            for media_type, count in value.items():
+                if isinstance(count, list):
+                    section[media_type] = section.get(media_type, []) + count
+                elif isinstance(count, int):
+                    section[media_type] = section.get(media_type, 0) + count
+                else:
+                    section[media_type] = count
+    return merged
+
+
+def is_retryable(error: requests.exceptions.RequestException) -> bool:
+    # Client errors (bad data, auth) will fail the same way every time.
+    response = getattr(error, "response", None)
+    if response is not None and 400 <= response.status_code < 500:
+        return False
+    return True
+
 
 class ListRoute:
     def __init__(
@@ -19,51 +79,172 @@ class ListRoute:
         self.user_id = user_id
         # list_id is the name of the list.
         self.list_id = list_id
-        self.base_url = base_url + f"/users/{user_id}/lists/{list_id}/items"
+        self.list_url = base_url + f"/users/{user_id}/lists/{list_id}"
+        self.base_url = self.list_url + "/items"
 
-    def get(self, category="movies", sort_by="added", sort_order="desc"):
+    def summary(self) -> dict:
+        """
+        Gets the list's details (item_count, updated_at etc) but not its items.
+        """
+        with endpoint("list"):
+            response = self.session.get(self.list_url)
+        response.raise_for_status()
+        return response.json()
+
+    def fetch(
+        self, category="movies", sort_by="added", sort_order="desc", etag=None
+    ) -> requests.Response:
+        """
+        Gets the list items, returning the response itself. When an etag is
+        given the request is conditional and the status may be 304.
+        """
         url = self.base_url + f"/{category}/{sort_by}/{sort_order}"
-        response = self.session.get(url)
+        with endpoint("list_items"):
+            if etag:
+                response = self.session.get(url, headers={"If-None-Match": etag})
+            else:
+                response = self.session.get(url)
         # Raise exception if no bueno.
         response.raise_for_status()
-        return response.json()
+        return response
+
+    def get(self, category="movies", sort_by="added", sort_order="desc"):
+        return self.fetch(category, sort_by, sort_order).json()
 
-    def add(self, imdb_ids: List[str]) -> dict:
+    def _post(self, url: str, imdb_ids: List[str]) -> dict:
         data = {"movies": [{"ids": {"imdb": imdb_id}} for imdb_id in imdb_ids]}
+        name = "list_remove" if url.endswith("/remove") else "list_add"
+        for attempt in range(1, CHUNK_ATTEMPTS + 1):
+            try:
+                with endpoint(name):
+                    response = self.session.post(url, data=json.dumps(data))
+                response.raise_for_status()
+                return response.json()
+            except requests.exceptions.RequestException as e:
+                if attempt == CHUNK_ATTEMPTS or not is_retryable(e):
+                    raise
+                METRICS.record_retry("trakt", name)
+                logger.warning(
+                    "Posting %d ids to %s failed (%s), retrying."
+                    % (len(imdb_ids), url, e)
+                )
+                time.sleep(2**attempt)
 
-        # TODO: We need to handle situation where we're trying to post continuously.
-        # response will contain a "retry-after" in the header. Maybe use that.
-        response = self.session.post(self.base_url, data=json.dumps(data))
-        response.raise_for_status()
-        return response.json()
+    def _post_chunks(
+        self, url: str, imdb_ids: List[str], chunk_size: int, max_workers: int
+    ) -> dict:
+        chunks = [
+            imdb_ids[i:i + chunk_size] for i in range(0, len(imdb_ids), chunk_size)
+        ]
+        if len(chunks) <= 1:
+            return merge_results([self._post(url, chunk) for chunk in chunks])
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(self._post, url, chunk) for chunk in chunks]
+            return merge_results([future.result() for future in as_completed(futures)])
 
-    def delete(self, imdb_ids: List[str]) -> dict:
+    def add(
+        self,
+        imdb_ids: List[str],
+        chunk_size: int = CHUNK_SIZE,
+        max_workers: int = MAX_WORKERS,
+    ) -> dict:
+        return self._post_chunks(self.base_url, imdb_ids, chunk_size, max_workers)
+
+    def delete(
+        self,
+        imdb_ids: List[str],
+        chunk_size: int = CHUNK_SIZE,
+        max_workers: int = MAX_WORKERS,
+    ) -> dict:
         url = self.base_url + "/remove"
-        data = {"movies": [{"ids": {"imdb": imdb_id}} for imdb_id in imdb_ids]}
-        response = self.session.post(url, data=json.dumps(data))
-        response.raise_for_status()
-        return response.json()
+        return self._post_chunks(url, imdb_ids, chunk_size, max_workers)
+
+
+class ListBuffer:
+    """
+    Collects imdb ids and adds them to a list in bulk, every flush_every ids
+    and when the context exits (including on Ctrl+C).
+
+    Each id can be given a callback that's run once the id has been written,
+    eg to acknowledge the message it came from.
+    """
+
+    def __init__(self, api_list: ListRoute, flush_every: int = FLUSH_EVERY):
+        self.api_list = api_list
+        self.flush_every = flush_every
+        self.results: List[dict] = []
+        self._pending = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def add(self, imdb_id: str, on_written: Callable[[], object] | None = None):
+        callbacks = self._pending.setdefault(imdb_id, [])
+        if on_written:
+            callbacks.append(on_written)
+        if len(self._pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        pending = self._pending
+        self.results.append(self.api_list.add(list(pending)))
+        self._pending = {}
+        for callbacks in pending.values():
+            for callback in callbacks:
+                callback()
+
+    @property
+    def result(self) -> dict:
+        return merge_results(self.results)
 
 
 class SearchRoute:
-    def __init__(self, session: requests.Session, base_url: str):
+    def __init__(
+        self,
+        session: requests.Session,
+        base_url: str,
+        cache: SearchCache | None = None,
+    ):
         self.session = session
         self.base_url = base_url + "/search"
+        self.cache = cache
+
+    def _cached(self, key: str, search):
+        if self.cache is None:
+            return search()
+        results = self.cache.get(key)
+        if results is None:
+            results = search()
+            self.cache.set(key, results)
+        return results
 
     def by_text(self, text: str, fields="title"):
-        url = self.base_url + "/movie"
-        # NB double quotes doesnt seem to do anything.
-        # We think it does exact match, but it doesn't. Eg Tron -> Tron Legacy etc.
-        params = {"query": '"%s"' % text, "fields": fields}
-        response = self.session.get(url, params=params)
-        response.raise_for_status()
-        return response.json()
+        def search():
+            url = self.base_url + "/movie"
+            # NB double quotes doesnt seem to do anything.
+            # We think it does exact match, but it doesn't. Eg Tron -> Tron Legacy.
+            params = {"query": '"%s"' % text, "fields": fields}
+            with endpoint("search_text"):
+                response = self.session.get(url, params=params)
+            response.raise_for_status()
+            return response.json()
+
+        return self._cached(f"text:{fields}:{normalize_query(text)}", search)
 
     def by_id(self, id: str, id_type="imdb", type="movie"):
-        url = self.base_url + f"/{id_type}/{id}?type={type}"
-        response = self.session.get(url)
-        response.raise_for_status()
-        return response.json()
+        def search():
+            url = self.base_url + f"/{id_type}/{id}?type={type}"
+            with endpoint("search_id"):
+                response = self.session.get(url)
+            response.raise_for_status()
+            return response.json()
+
+        return self._cached(f"id:{id_type}:{type}:{id.strip().lower()}", search)
 
 
 class MovieRoute:
@@ -73,16 +254,32 @@ class MovieRoute:
 
     def aliases(self):
         url = self.base_url + "/aliases"
-        response = self.session.get(url)
+        with endpoint("movie_aliases"):
+            response = self.session.get(url)
         response.raise_for_status()
         return response.json()
 
 
 class TraktAPI:
     def __init__(
-        self, client_id: str, access_token: str, base_url="https://api.trakt.tv"
+        self,
+        client_id: str,
+        access_token: str,
+        base_url: str | None = None,
+        session: requests.Session | None = None,
+        search_cache: SearchCache | None = None,
+        reauthorize: Callable[[], str] | None = None,
     ):
-        session = requests.Session()
+        """
+        reauthorize is called when trakt says we're unauthorised (eg the
+        token has been rotated) and should return the current access token.
+        If it's a new one the request is retried, once, with it.
+        """
+        session = session or new_session(
+            RateLimitAdapter(
+                read_bucket=GET_BUCKET, write_bucket=POST_BUCKET, service="trakt"
+            )
+        )
         session.headers.update(
             {
                 "Content-Type": "application/json",
@@ -92,19 +289,69 @@ class TraktAPI:
             }
         )
         self.session = session
-        self.base_url = base_url
+        self.base_url = base_url or BASE_URL
+        self.search_cache = search_cache
+        self.reauthorize = reauthorize
+        if reauthorize:
+            session.hooks["response"].append(self._retry_unauthorized)
+
+    def _retry_unauthorized(self, response: requests.Response, **kwargs):
+        if response.status_code != 401 or getattr(
+            response.request, "reauthorized", False
+        ):
+            return response
+        authorization = f"Bearer {self.reauthorize()}"
+        if authorization == response.request.headers.get("Authorization"):
+            # Same token, so trying again won't help.
+            return response
+        logger.warning("Trakt access token was rejected, retrying with a new one.")
+        METRICS.record_retry("trakt", current_endpoint(response.request.path_url))
+        self.session.headers["Authorization"] = authorization
+        request = response.request.copy()
+        request.headers["Authorization"] = authorization
+        request.reauthorized = True
+        response.close()
+        return self.session.send(request, **kwargs)
 
     def list(self, user_id: str, list_id: str):
         return ListRoute(self.session, self.base_url, user_id, list_id)
 
     @property
     def search(self):
-        return SearchRoute(self.session, self.base_url)
+        return SearchRoute(self.session, self.base_url, self.search_cache)
 
     def movie(self, movie_id: str):
         return MovieRoute(self.session, self.base_url, movie_id)
 
 
+def _reauthorize() -> str:
+    invalidate_secret("TraktAPI")
+    return get_secret("TraktAPI")["ACCESS_TOKEN"]
+
+
+@cache
+def _get_api(client_id: str, access_token: str) -> TraktAPI:
+    return TraktAPI(
+        client_id,
+        access_token,
+        search_cache=search_cache.from_env(),
+        reauthorize=_reauthorize,
+    )
+
+
+def get_api() -> TraktAPI:
+    """
+    Returns a TraktAPI for the credentials in the TraktAPI secret.
+
+    Instances are shared across the process, so the underlying session (and
+    its open connections) survive between calls and warm lambda invocations.
+    A rotated access token gets a fresh instance (once the cached secret
+    expires, or trakt rejects the old token).
+    """
+    secrets = get_secret("TraktAPI")
+    return _get_api(secrets["CLIENT_ID"], secrets["ACCESS_TOKEN"])
+
+
 def update_list(imdb_ids: List[str]):
     """
     Takes a set of ids that can be recognised by IMDB (eg tt0076759)
@@ -117,22 +364,35 @@ def update_list(imdb_ids: List[str]):
     user_id = secrets["USER_ID"]
     list_id = secrets["LIST_ID"]
     max_list_size = int(secrets["MAX_LIST_SIZE"])
-    api = TraktAPI(secrets["CLIENT_ID"], secrets["ACCESS_TOKEN"])
+    api = get_api()
     api_list = api.list(user_id, list_id)
-    list_items = api_list.get()
-    excess = max(len(list_items) + len(imdb_ids) - max_list_size, 0)
-    if excess:
+    snapshot = list_snapshot.sync(api_list)
+
+    # Drop duplicates (keeping the order) and anything already on the list,
+    # so that only genuinely new films count towards the list size.
+    imdb_ids = list(dict.fromkeys(imdb_ids))
+    new_imdb_ids = [imdb_id for imdb_id in imdb_ids if imdb_id not in snapshot]
+    if len(new_imdb_ids) < len(imdb_ids):
+        logger.info(
+            "%d films are already in the list." % (len(imdb_ids) - len(new_imdb_ids))
+        )
+    if not new_imdb_ids:
+        logger.info("No films to add to trakt list.")
+        return
+
+    excess = max(len(snapshot) + len(new_imdb_ids) - max_list_size, 0)
+    # Don't throw out films we've just been asked to add.
+    items_to_delete = snapshot.oldest(excess, keep=set(imdb_ids)) if excess else []
+    if items_to_delete:
         logger.warning(
             "Too many items in the list. List will be truncated to make room."
         )
-        items_to_delete = list_items[:excess]
-        imdb_ids_to_delete = [item["movie"]["ids"]["imdb"] for item in items_to_delete]
-        response = api_list.delete(imdb_ids_to_delete)
-        logger.info("Deleted %s from list." % response["deleted"]["movies"])
-        logger.info("List now contains %s items." % response["list"]["item_count"])
+        _delete_items(api_list, snapshot, items_to_delete)
 
     try:
-        result = api_list.add(imdb_ids)
+        result = api_list.add(new_imdb_ids)
+        snapshot.apply_added(new_imdb_ids, result)
+        snapshot.save()
         logger.info(
             "Successfully added %d films to trakt list." % result["added"]["movies"]
         )
@@ -140,3 +400,28 @@ def update_list(imdb_ids: List[str]):
         # We probably want to handle this better.
         # Ie catch when the request fails and (re)raise something appropriate.
         logger.error("Failed to add films to trakt list.")
+        return
+
+    # Another writer can add to the list at the same time as us, each having
+    # made room for only its own films. If the list ends up too long, look
+    # again and drop the oldest. Writers doing this at once mostly pick the
+    # same films, and deleting one that's already gone does nothing.
+    if (snapshot.item_count or 0) > max_list_size:
+        logger.warning("List grew past its maximum size while adding, truncating.")
+        snapshot = list_snapshot.sync(api_list)
+        excess = len(snapshot) - max_list_size
+        if excess > 0:
+            _delete_items(
+                api_list, snapshot, snapshot.oldest(excess, keep=set(imdb_ids))
+            )
+
+
+def _delete_items(
+    api_list: ListRoute, snapshot: list_snapshot.ListSnapshot, items: List[dict]
+):
+    imdb_ids = [item["imdb"] for item in items]
+    response = api_list.delete(imdb_ids)
+    snapshot.apply_deleted(imdb_ids, response)
+    snapshot.save()
+    logger.info("Deleted %s from list." % response["deleted"]["movies"])
+    logger.info("List now contains %s items." % response["list"]["item_count"])
@@ -0,0 +1,44 @@
+import json
+import logging
+from typing import List
+
+import trakt_api
+from metrics import METRICS
+
+# The lambda entry point for the trakt writer stage: takes the imdb ids the
+# ingest stage (app.py) published to the resolved ids queue, a batch at a
+# time, and adds them to the list.
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def parse_records(records: List[dict]) -> List[str]:
+    imdb_ids = []
+    for record in records:
+        try:
+            imdb_ids.append(json.loads(record["body"])["imdb_id"])
+        except (KeyError, TypeError, ValueError):
+            # Retrying won't make it any more readable.
+            logger.warning(f"Couldn't get an imdb id from {record.get('body')}")
+    return imdb_ids
+
+
+def write(imdb_ids: List[str]):
+    with METRICS.timer("list_write"):
+        trakt_api.update_list(imdb_ids)
+
+
+def lambda_handler(event, context):
+    """
+    Writes a batch of ids from the resolved ids queue. If it fails the whole
+    batch goes back on the queue, which is fine as films already on the list
+    are skipped.
+    """
+    try:
+        imdb_ids = parse_records(event["Records"])
+        logger.info(f"Writing {len(imdb_ids)} films to the list.")
+        if imdb_ids:
+            write(imdb_ids)
+    finally:
+        METRICS.flush()
@@ -0,0 +1,95 @@
+import time
+from functools import cache
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import METRICS, current_endpoint
+
+# Shared HTTP plumbing for the API clients. Sessions keep connections
+# alive between requests (and between warm lambda invocations, since they
+# live at module level) so we only pay for the TLS handshake once per host.
+
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10
+DEFAULT_TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+# Connections kept open per host. Should be at least as large as the number
+# of threads making requests through a session, otherwise connections get
+# thrown away and re-established.
+POOL_MAXSIZE = 10
+
+
+class TransportAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that applies a default timeout to every request, and records
+    metrics for each one under the given service name.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, service: str = "http", **kwargs):
+        self.timeout = timeout
+        self.service = service
+        kwargs.setdefault("pool_maxsize", POOL_MAXSIZE)
+        super().__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
+        endpoint = current_endpoint(urlsplit(request.url).path)
+        start = time.perf_counter()
+        try:
+            response = super().send(request, timeout=timeout, **kwargs)
+        except requests.exceptions.RequestException:
+            METRICS.record_request(
+                self.service, endpoint, None, time.perf_counter() - start
+            )
+            raise
+        size = 0
+        if not kwargs.get("stream"):
+            # The session would read the body straight after anyway, doing
+            # it here means the latency includes the download.
+            response.content
+            size = _bytes_read(response)
+        METRICS.record_request(
+            self.service,
+            endpoint,
+            response.status_code,
+            time.perf_counter() - start,
+            size,
+        )
+        return response
+
+
+def _bytes_read(response: requests.Response) -> int:
+    # What came over the wire (ie before decompression), if we can tell.
+    try:
+        return int(response.raw.tell())
+    except (AttributeError, TypeError, ValueError):
+        return len(response.content or b"")
+
+
+def new_session(
+    adapter: HTTPAdapter | None = None, service: str = "http"
+) -> requests.Session:
+    """
+    Creates a session with pooled, keep-alive connections, gzip and timeouts.
+    """
+    session = requests.Session()
+    adapter = adapter or TransportAdapter(service=service)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(
+        {"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"}
+    )
+    return session
+
+
+@cache
+def get_session(name: str = "default") -> requests.Session:
+    """
+    Returns a process wide session. Use a different name for clients that
+    set their own headers on the session. The name is also what the
+    session's requests are recorded under in the metrics.
+    """
+    return new_session(service=name)
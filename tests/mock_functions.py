@@ -1,6 +1,8 @@
 import json
 from unittest import mock
 
+import metrics
+
 
 def mock_get(*args, **kwargs):
     """
@@ -27,6 +29,30 @@ def mock_get(*args, **kwargs):
                 "pages": 1,
             }
         }
+    elif "trakt" in url and url.endswith("/lists/alist"):
+        data = {
+            "name": "alist",
+            "item_count": 1,
+            "updated_at": "2024-02-29T00:00:00.000Z",
+        }
+    elif "trakt" in url and "/items/" in url:
+        data = [
+            {
+                "rank": 1,
+                "listed_at": "2024-02-28T00:00:00.000Z",
+                "type": "movie",
+                "movie": {
+                    "title": "Another Film",
+                    "year": 1985,
+                    "ids": {
+                        "trakt": 8,
+                        "slug": "another-film-1985",
+                        "imdb": "tt654321",
+                        "tmdb": 13,
+                    },
+                },
+            }
+        ]
     elif "trakt" in url:
         data = [
             {
@@ -47,6 +73,26 @@ def mock_get(*args, **kwargs):
     else:
         raise AttributeError("Unknown URL. Cannot generate mock response.")
     mock_response = mock.MagicMock()
+    mock_response.status_code = 200
+    mock_response.headers = {}
+    mock_response.json.return_value = data
+    mock_response.content = json.dumps(data).encode()
+    return mock_response
+
+
+def mock_list_post(*args, **kwargs):
+    """
+    Returns a response like those from posting to a trakt list.
+    """
+    url = args[0]
+    movies = json.loads(kwargs["data"])["movies"]
+    key = "deleted" if url.endswith("/remove") else "added"
+    data = {
+        key: {"movies": len(movies)},
+        "not_found": {"movies": []},
+        "list": {"updated_at": "2024-02-29T00:00:00.000Z", "item_count": 1},
+    }
+    mock_response = mock.MagicMock()
     mock_response.json.return_value = data
     return mock_response
 
@@ -65,3 +111,28 @@ def mock_get_secret_value(*args, **kwargs):
             }
         )
     }
+
+
+def capture_metrics(test_case) -> list:
+    """
+    For the rest of the test, the handlers' metrics are flushed into the
+    returned list (as parsed EMF documents) rather than printed.
+    """
+    lines = []
+    flush = metrics.METRICS.flush
+    metrics.METRICS.reset()
+    patcher = mock.patch.object(
+        metrics.METRICS,
+        "flush",
+        lambda: flush(write=lambda line: lines.append(json.loads(line))),
+    )
+    patcher.start()
+    test_case.addCleanup(patcher.stop)
+    return lines
+
+
+def stages(lines: list) -> list:
+    """
+    The stages timed in some captured metrics.
+    """
+    return [line["Stage"] for line in lines if "Stage" in line]
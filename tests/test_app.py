@@ -1,18 +1,65 @@
 from datetime import datetime
 import json
+import os
+import tempfile
 from unittest import TestCase, mock
 
-from guardian_api import Article
-from mock_functions import mock_get
+from guardian_api import Article, Page
+from mock_functions import capture_metrics, mock_get, mock_list_post, stages
+from processed_index import ProcessedIndex
 
 with mock.patch.dict(
-    "os.environ", {"MANUAL_PROCESSING_QUEUE_URL": "https://atestqueue"}
+    "os.environ",
+    {
+        "MANUAL_PROCESSING_QUEUE_URL": "https://atestqueue",
+        "RESOLVED_IDS_QUEUE_URL": "https://resolvedqueue",
+    },
 ):
     import app
+import trakt_writer
+
+
+def mock_get_parameters(names, ttl=0):
+    return {"GoodFilms_LastSuccess": "2024-2-29"}
+
+
+def mock_sqs_client():
+    sqs = mock.MagicMock()
+    sqs.send_message_batch.side_effect = lambda QueueUrl, Entries: {
+        "Successful": [{"Id": entry["Id"]} for entry in Entries]
+    }
+    return sqs
+
+
+def published(sqs, queue_url="https://resolvedqueue") -> list:
+    return [
+        entry["MessageBody"]
+        for call in sqs.send_message_batch.call_args_list
+        if call.kwargs["QueueUrl"] == queue_url
+        for entry in call.kwargs["Entries"]
+    ]
+
+
+def published_ids(sqs) -> list:
+    return [json.loads(body)["imdb_id"] for body in published(sqs)]
 
 
 @mock.patch.dict("os.environ", {"AWS_LAMBDA_FUNCTION_NAME": "LambdaFunctionName"})
 class TestLambdaHandler(TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        snapshot_path = os.path.join(tmp_dir.name, "snapshot.json")
+        patcher = mock.patch.dict(
+            "os.environ",
+            {
+                "GOODFILMS_LIST_SNAPSHOT": snapshot_path,
+                "GOODFILMS_PAGE_CACHE": os.path.join(tmp_dir.name, "pages"),
+            },
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.metrics = capture_metrics(self)
 
     @mock.patch("guardian_api.get_secret", lambda _: {"API_KEY": "123"})
     @mock.patch(
@@ -25,23 +72,39 @@ class TestLambdaHandler(TestCase):
             "MAX_LIST_SIZE": "5",
         },
     )
-    @mock.patch("app.get_parameter", lambda _: "2024-2-29")
+    @mock.patch("app.get_parameters", mock_get_parameters)
     @mock.patch("app.put_parameter", mock.MagicMock)
-    @mock.patch("requests.get", mock.MagicMock(side_effect=mock_get))
-    @mock.patch("trakt_api.requests.Session")
-    def test_film_posted_to_trakt(self, mock_session):
+    @mock.patch("app.get_client")
+    @mock.patch("transport.requests.Session")
+    def test_film_posted_to_trakt(self, mock_session, mock_get_client):
+        trakt_writer.trakt_api._get_api.cache_clear()
+        app.guardian_api.get_session.cache_clear()
         mock_session.return_value.get = mock.MagicMock(side_effect=mock_get)
+        mock_session.return_value.post = mock.MagicMock(side_effect=mock_list_post)
         mock_post = mock_session.return_value.post
+        mock_get_client.return_value = mock_sqs_client()
         app.lambda_handler(None, None)
+        # Nothing goes to trakt until the writer gets the ids off the queue.
+        mock_post.assert_not_called()
+        records = [
+            {"messageId": str(n), "body": body}
+            for n, body in enumerate(published(mock_get_client.return_value))
+        ]
+        trakt_writer.lambda_handler({"Records": records}, None)
         self.assertTrue(mock_post.called)
         mock_post.assert_called_once_with(
             "https://api.trakt.tv/users/auser/lists/alist/items",
             data='{"movies": [{"ids": {"imdb": "tt123456"}}]}',
         )
+        # Each handler flushed the stages it timed.
+        self.assertIn("fetch", stages(self.metrics))
+        self.assertIn("list_write", stages(self.metrics))
 
-    @mock.patch("app.trakt_api.update_list", mock.MagicMock)
-    @mock.patch("app.guardian_api.get_articles", mock.MagicMock(return_value=[]))
-    @mock.patch("app.get_parameter", lambda _: "2024-2-29")
+    @mock.patch("app.get_client", mock.MagicMock())
+    @mock.patch(
+        "app.guardian_api.get_pages", mock.MagicMock(return_value=[Page(1, 1, [])])
+    )
+    @mock.patch("app.get_parameters", mock_get_parameters)
     @mock.patch("app.datetime")
     @mock.patch("app.put_parameter")
     def test_parameter_updated(self, mock_put_parameter, mock_datetime):
@@ -52,18 +115,233 @@ class TestLambdaHandler(TestCase):
             "GoodFilms_LastSuccess", "2024-03-02"
         )
 
-    @mock.patch("app.get_parameter", lambda _: "2024-2-29")
-    @mock.patch("app.trakt_api.update_list", mock.MagicMock)
+    @mock.patch("app.get_parameters", mock_get_parameters)
     @mock.patch("app.put_parameter", mock.MagicMock)
-    @mock.patch("app.sqs")
-    @mock.patch("app.guardian_api.get_articles")
-    def test_send_to_queue(self, mock_get_articles, mock_sqs):
-        # An article with no imdb reference
+    @mock.patch("app.Resolver")
+    @mock.patch("app.get_client")
+    @mock.patch("app.guardian_api.get_pages")
+    def test_send_to_queue(self, mock_get_pages, mock_get_client, mock_resolver):
+        # An article with no imdb reference, that can't be resolved
         mock_article = Article(title="a film", url="www.aurl.com", imdb_id=None)
-        mock_get_articles.return_value = [mock_article]
+        mock_get_pages.return_value = [Page(1, 1, [mock_article])]
+        mock_resolver.return_value.resolve.return_value = None
+        mock_sqs = mock_get_client.return_value
         app.lambda_handler(None, None)
 
         # The film details are sent to an SQS queue.
-        mock_sqs.send_message.assert_called_once()
-        message_body = mock_sqs.send_message.call_args.kwargs["MessageBody"]
-        self.assertEqual(mock_article.to_dict(), json.loads(message_body))
+        mock_get_client.assert_called_with("sqs")
+        mock_sqs.send_message_batch.assert_called_once()
+        (entry,) = mock_sqs.send_message_batch.call_args.kwargs["Entries"]
+        self.assertEqual(mock_article.to_dict(), json.loads(entry["MessageBody"]))
+
+    @mock.patch("app.get_parameters", mock_get_parameters)
+    @mock.patch("app.get_client")
+    @mock.patch("app.put_parameter")
+    @mock.patch("app.guardian_api.get_pages")
+    def test_stops_before_deadline(
+        self, mock_get_pages, mock_put_parameter, mock_get_client
+    ):
+        mock_get_client.return_value = mock_sqs_client()
+        mock_get_pages.return_value = [
+            Page(1, 3, [Article("film 1", "url1", "tt1", id="film/1")]),
+            Page(2, 3, [Article("film 2", "url2", "tt2", id="film/2")]),
+        ]
+        context = mock.MagicMock()
+        context.get_remaining_time_in_millis.return_value = 5000
+        app.lambda_handler(None, context)
+
+        # What we had was sent to the writer, and we'll pick up from page 2.
+        self.assertEqual(["tt1"], published_ids(mock_get_client.return_value))
+        mock_put_parameter.assert_any_call(
+            "GoodFilms_Cursor",
+            json.dumps(
+                {"date": "2024-02-29", "page_size": 200, "page": 2, "last_id": "film/1"}
+            ),
+        )
+        # Not finished, so the last success date stays where it was.
+        self.assertNotIn(
+            "GoodFilms_LastSuccess",
+            [call.args[0] for call in mock_put_parameter.call_args_list],
+        )
+
+    @mock.patch("app.get_parameters", mock_get_parameters)
+    @mock.patch("app.get_client")
+    @mock.patch("app.put_parameter")
+    @mock.patch("app.guardian_api.get_pages")
+    def test_pages_stopped_before_deadline(
+        self, mock_get_pages, mock_put_parameter, mock_get_client
+    ):
+        mock_get_client.return_value = mock_sqs_client()
+        context = mock.MagicMock()
+        context.get_remaining_time_in_millis.return_value = 60000
+
+        def get_pages(*args, should_stop, **kwargs):
+            yield Page(1, 3, [Article("film 1", "url1", "tt1", id="film/1")])
+            # The deadline passes after the app has looked, but before the
+            # next page is asked for.
+            context.get_remaining_time_in_millis.return_value = 5000
+            if not should_stop():
+                yield Page(2, 3, [Article("film 2", "url2", "tt2", id="film/2")])
+
+        mock_get_pages.side_effect = get_pages
+        app.lambda_handler(None, context)
+
+        mock_put_parameter.assert_any_call(
+            "GoodFilms_Cursor",
+            json.dumps(
+                {"date": "2024-02-29", "page_size": 200, "page": 2, "last_id": "film/1"}
+            ),
+        )
+        self.assertNotIn(
+            "GoodFilms_LastSuccess",
+            [call.args[0] for call in mock_put_parameter.call_args_list],
+        )
+
+    @mock.patch("app.get_parameters", mock_get_parameters)
+    @mock.patch("app.get_client")
+    @mock.patch("app.put_parameter", mock.MagicMock)
+    @mock.patch("app.Resolver")
+    @mock.patch("app.guardian_api.get_pages")
+    def test_no_resolving_near_deadline(
+        self, mock_get_pages, mock_resolver, mock_get_client
+    ):
+        mock_get_pages.return_value = [Page(1, 1, [Article("a film", "url1")])]
+        mock_get_client.return_value = mock_sqs_client()
+        context = mock.MagicMock()
+        context.get_remaining_time_in_millis.return_value = 5000
+        app.lambda_handler(None, context)
+        # Too close to the deadline to search trakt, so it's left to a human.
+        mock_resolver.return_value.resolve.assert_not_called()
+        manual = published(mock_get_client.return_value, "https://atestqueue")
+        self.assertEqual(1, len(manual))
+
+    @mock.patch("app.get_client")
+    @mock.patch("app.put_parameter")
+    @mock.patch("app.guardian_api.get_pages")
+    def test_resumes_from_cursor(
+        self, mock_get_pages, mock_put_parameter, mock_get_client
+    ):
+        mock_get_client.return_value = mock_sqs_client()
+        cursor = {"date": "2024-02-29", "page_size": 2, "page": 2, "last_id": "film/2"}
+        # A new review has pushed film 2 onto page 2 since the last run.
+        mock_get_pages.return_value = [
+            Page(
+                2,
+                2,
+                [
+                    Article("film 2", "url2", "tt2", id="film/2"),
+                    Article("film 3", "url3", "tt3", id="film/3"),
+                ],
+            ),
+        ]
+        with mock.patch(
+            "app.get_parameters",
+            lambda names, ttl=0: {
+                "GoodFilms_Cursor": json.dumps(cursor),
+                "GoodFilms_LastSuccess": "2024-03-01",
+            },
+        ):
+            app.lambda_handler(None, None)
+
+        self.assertEqual(2, mock_get_pages.call_args.kwargs["start_page"])
+        self.assertEqual(2, mock_get_pages.call_args.kwargs["page_size"])
+        self.assertEqual(["tt3"], published_ids(mock_get_client.return_value))
+        # Finished, so the cursor is cleared.
+        mock_put_parameter.assert_any_call("GoodFilms_Cursor", "{}")
+
+    @mock.patch("app.get_parameters", mock_get_parameters)
+    @mock.patch("app.get_client")
+    @mock.patch("app.put_parameter", mock.MagicMock)
+    @mock.patch("app.guardian_api.get_pages")
+    def test_write_ids(self, mock_get_pages, mock_get_client):
+        mock_get_pages.return_value = [
+            Page(1, 1, [Article("film 1", "url1", "tt1", id="film/1")]),
+        ]
+        mock_get_client.return_value = mock_sqs_client()
+        write_ids = mock.MagicMock()
+        app.run(None, None, write_ids=write_ids)
+        # Both stages in one process, nothing goes through the queue.
+        write_ids.assert_called_once_with(["tt1"])
+        self.assertEqual([], published_ids(mock_get_client.return_value))
+
+    @mock.patch("app.get_parameters", mock_get_parameters)
+    @mock.patch("app.get_client")
+    @mock.patch("app.put_parameter")
+    @mock.patch("app.guardian_api.get_pages")
+    def test_publish_failed(self, mock_get_pages, mock_put_parameter, mock_get_client):
+        mock_get_pages.return_value = [
+            Page(1, 1, [Article("film 1", "url1", "tt1", id="film/1")]),
+        ]
+        mock_get_client.return_value.send_message_batch.side_effect = (
+            lambda QueueUrl, Entries: {
+                "Failed": [
+                    {"Id": entry["Id"], "SenderFault": True} for entry in Entries
+                ]
+            }
+        )
+        with self.assertRaises(RuntimeError):
+            app.lambda_handler(None, None)
+        # So the next run goes over the same reviews.
+        mock_put_parameter.assert_not_called()
+
+    @mock.patch("app.get_client")
+    @mock.patch("app.put_parameter")
+    @mock.patch("app.guardian_api.get_pages")
+    def test_skips_processed(self, mock_get_pages, mock_put_parameter, mock_get_client):
+        # The last run already got film 1, from the same day.
+        processed = ProcessedIndex()
+        processed.add("film/1")
+        mock_get_pages.return_value = [
+            Page(
+                1,
+                1,
+                [
+                    Article("film 1", "url1", "tt1", id="film/1"),
+                    Article("film 2", "url2", "tt2", id="film/2"),
+                ],
+            ),
+        ]
+        mock_get_client.return_value = mock_sqs_client()
+        with mock.patch(
+            "app.get_parameters",
+            lambda names, ttl=0: {
+                "GoodFilms_LastSuccess": "2024-03-01",
+                "GoodFilms_Processed": processed.dumps(),
+            },
+        ):
+            app.lambda_handler(None, None)
+
+        self.assertEqual(["tt2"], published_ids(mock_get_client.return_value))
+        # Both are in the index for next time.
+        (value,) = [
+            call.args[1]
+            for call in mock_put_parameter.call_args_list
+            if call.args[0] == "GoodFilms_Processed"
+        ]
+        saved = ProcessedIndex.loads(value)
+        self.assertIn("film/1", saved)
+        self.assertIn("film/2", saved)
+
+    @mock.patch("app.get_parameters", mock_get_parameters)
+    @mock.patch("app.get_client")
+    @mock.patch("app.put_parameter")
+    @mock.patch("app.Resolver")
+    @mock.patch("app.guardian_api.get_pages")
+    def test_manual_queue_failed(
+        self, mock_get_pages, mock_resolver, mock_put_parameter, mock_get_client
+    ):
+        mock_get_pages.return_value = [
+            Page(1, 1, [Article("a film", "url1", id="film/1")]),
+        ]
+        mock_resolver.return_value.resolve.return_value = None
+        mock_get_client.return_value.send_message_batch.side_effect = (
+            lambda QueueUrl, Entries: {
+                "Failed": [
+                    {"Id": entry["Id"], "SenderFault": True} for entry in Entries
+                ]
+            }
+        )
+        with self.assertRaises(RuntimeError):
+            app.lambda_handler(None, None)
+        # Not marked as processed, and the next run covers the same day.
+        mock_put_parameter.assert_not_called()
@@ -0,0 +1,123 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import IsolatedAsyncioTestCase, mock
+
+from async_trakt_api import AsyncTraktAPI
+from trakt_api import TraktAPI
+
+
+def response(data) -> mock.MagicMock:
+    response = mock.MagicMock()
+    response.json.return_value = data
+    return response
+
+
+class TestAsyncTraktAPI(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.session = mock.MagicMock()
+        self.api = AsyncTraktAPI(
+            TraktAPI("client", "token", session=self.session), concurrency=3
+        )
+        self.addCleanup(self.api.close)
+
+    async def test_search_many_in_order(self):
+        def get(url, params=None):
+            title = params["query"].strip('"')
+            # Later titles come back first.
+            time.sleep(0.01 * (3 - int(title[-1])))
+            return response([{"movie": {"title": title}}])
+
+        self.session.get.side_effect = get
+        results = await self.api.search_many(["film 1", "film 2", "film 3"])
+        self.assertEqual(
+            ["film 1", "film 2", "film 3"],
+            [result[0]["movie"]["title"] for result in results],
+        )
+
+    def concurrency(self) -> list:
+        """
+        Makes session.get track the most calls running at once.
+        """
+        running = 0
+        most = [0]
+        lock = threading.Lock()
+
+        def get(url, params=None):
+            nonlocal running
+            with lock:
+                running += 1
+                most[0] = max(most[0], running)
+            time.sleep(0.05)
+            with lock:
+                running -= 1
+            return response([])
+
+        self.session.get.side_effect = get
+        return most
+
+    async def test_concurrency_limit(self):
+        most = self.concurrency()
+        await self.api.search_many([f"film {n}" for n in range(10)])
+        self.assertEqual(10, self.session.get.call_count)
+        self.assertEqual(3, most[0])
+
+    async def test_own_threads(self):
+        # Not limited by the loop's default executor.
+        default = ThreadPoolExecutor(max_workers=2)
+        asyncio.get_running_loop().set_default_executor(default)
+        most = self.concurrency()
+        async with AsyncTraktAPI(
+            TraktAPI("client", "token", session=self.session), concurrency=5
+        ) as api:
+            await api.search_many([f"film {n}" for n in range(10)])
+        self.assertEqual(5, most[0])
+
+    async def test_exceptions(self):
+        def get(url, params=None):
+            if "2" in params["query"]:
+                raise ValueError("trakt is down")
+            return response([])
+
+        self.session.get.side_effect = get
+        with self.assertRaises(ValueError):
+            await self.api.search_many(["film 1", "film 2"])
+        results = await self.api.search_many(
+            ["film 1", "film 2"], return_exceptions=True
+        )
+        self.assertEqual([], results[0])
+        self.assertIsInstance(results[1], ValueError)
+
+    async def test_routes(self):
+        self.session.get.return_value = response([{"title": "Un film"}])
+        aliases = await self.api.aliases_many(["a-film", "another-film"])
+        self.assertEqual([[{"title": "Un film"}]] * 2, aliases)
+        self.assertEqual(
+            [
+                "https://api.trakt.tv/movies/a-film/aliases",
+                "https://api.trakt.tv/movies/another-film/aliases",
+            ],
+            sorted(call.args[0] for call in self.session.get.call_args_list),
+        )
+        results = await self.api.search.by_id("tt1")
+        self.assertEqual([{"title": "Un film"}], results)
+
+    async def test_doesnt_block_loop(self):
+        def get(url, params=None):
+            time.sleep(0.05)
+            return response([])
+
+        self.session.get.side_effect = get
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        ticker = asyncio.create_task(tick())
+        await self.api.search.by_text("a film")
+        ticker.cancel()
+        self.assertGreater(ticks, 2)
@@ -0,0 +1,128 @@
+import json
+from unittest import TestCase, mock
+
+import aws_utils
+
+
+class TestGetClient(TestCase):
+    def setUp(self):
+        aws_utils._get_client.cache_clear()
+        self.addCleanup(aws_utils._get_client.cache_clear)
+
+    @mock.patch("boto3.Session")
+    def test_reused(self, mock_session):
+        mock_session.return_value.client.side_effect = lambda **kwargs: mock.MagicMock()
+        ssm = aws_utils.get_client("ssm")
+        self.assertIs(ssm, aws_utils.get_client("ssm"))
+        self.assertIsNot(ssm, aws_utils.get_client("sqs"))
+        self.assertIsNot(ssm, aws_utils.get_client("ssm", "us-east-1"))
+        mock_session.return_value.client.assert_any_call(
+            service_name="ssm", region_name="eu-west-2"
+        )
+
+    @mock.patch("aws_utils.get_client")
+    def test_get_parameter_not_found(self, mock_get_client):
+        client = mock_get_client.return_value
+        client.exceptions.ParameterNotFound = KeyError
+        client.get_parameter.side_effect = KeyError
+        self.assertEqual("default", aws_utils.get_parameter("missing", "default"))
+
+
+class TestTTLCache(TestCase):
+    def test_expires(self):
+        now = [0.0]
+        cache = aws_utils.TTLCache(clock=lambda: now[0])
+        cache.set("a", 1, ttl=10, version="v1")
+        cache.set("b", 2, ttl=60)
+        now[0] = 30
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(2, cache.get("b").value)
+        # The old version is still known.
+        self.assertEqual("v1", cache.previous("a").version)
+
+    def test_invalidate(self):
+        cache = aws_utils.TTLCache()
+        cache.set("a", 1, ttl=60)
+        cache.invalidate("a")
+        self.assertIsNone(cache.get("a"))
+
+
+@mock.patch("aws_utils.get_client")
+class TestSecrets(TestCase):
+    def setUp(self):
+        aws_utils._secrets.clear()
+        self.addCleanup(aws_utils._secrets.clear)
+
+    def test_cached(self, mock_get_client):
+        client = mock_get_client.return_value
+        client.get_secret_value.return_value = {
+            "SecretString": json.dumps({"ACCESS_TOKEN": "old"}),
+            "VersionId": "v1",
+        }
+        self.assertEqual({"ACCESS_TOKEN": "old"}, aws_utils.get_secret("TraktAPI"))
+        aws_utils.get_secret("TraktAPI")
+        client.get_secret_value.assert_called_once_with(SecretId="TraktAPI")
+
+    def test_invalidate(self, mock_get_client):
+        client = mock_get_client.return_value
+        client.get_secret_value.side_effect = [
+            {"SecretString": json.dumps({"ACCESS_TOKEN": "old"}), "VersionId": "v1"},
+            {"SecretString": json.dumps({"ACCESS_TOKEN": "new"}), "VersionId": "v2"},
+        ]
+        aws_utils.get_secret("TraktAPI")
+        aws_utils.invalidate_secret("TraktAPI")
+        self.assertEqual({"ACCESS_TOKEN": "new"}, aws_utils.get_secret("TraktAPI"))
+        self.assertEqual("v2", aws_utils._secrets.get("TraktAPI").version)
+
+
+@mock.patch("aws_utils.get_client")
+class TestParameters(TestCase):
+    def setUp(self):
+        aws_utils._parameters.clear()
+        self.addCleanup(aws_utils._parameters.clear)
+
+    def test_batched(self, mock_get_client):
+        client = mock_get_client.return_value
+        client.get_parameters.side_effect = lambda Names: {
+            "Parameters": [
+                {"Name": name, "Value": name.lower()}
+                for name in Names
+                if name != "Missing"
+            ]
+        }
+        names = [f"P{n}" for n in range(12)] + ["Missing"]
+        values = aws_utils.get_parameters(names)
+        self.assertEqual({f"P{n}": f"p{n}" for n in range(12)}, values)
+        self.assertEqual(2, client.get_parameters.call_count)
+
+    def test_ttl(self, mock_get_client):
+        client = mock_get_client.return_value
+        client.get_parameters.return_value = {
+            "Parameters": [{"Name": "Config", "Value": "1"}]
+        }
+        aws_utils.get_parameters(["Config"], ttl=60)
+        self.assertEqual({"Config": "1"}, aws_utils.get_parameters(["Config"]))
+        client.get_parameters.assert_called_once()
+        # Writing it means it has to be read again.
+        aws_utils.put_parameter("Config", "2")
+        aws_utils.get_parameters(["Config"])
+        self.assertEqual(2, client.get_parameters.call_count)
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        aws_utils._get_client.cache_clear()
+        self.addCleanup(aws_utils._get_client.cache_clear)
+
+    @mock.patch("aws_utils.METRICS")
+    def test_calls_recorded(self, mock_metrics):
+        from botocore.stub import Stubber
+
+        client = aws_utils.get_client("ssm")
+        with Stubber(client) as stubber:
+            stubber.add_response(
+                "get_parameter", {"Parameter": {"Name": "Name", "Value": "value"}}
+            )
+            client.get_parameter(Name="Name")
+        service, operation, status, *_ = mock_metrics.record_request.call_args.args
+        self.assertEqual(("ssm", "GetParameter", 200), (service, operation, status))
@@ -0,0 +1,268 @@
+import json
+import os
+import tempfile
+from datetime import date
+from unittest import TestCase, mock
+
+import backfill
+from backfill import Progress, Shard, ShardResult
+from guardian_api import Article
+from metrics import METRICS
+from mock_functions import capture_metrics, stages
+
+
+class TestShardRange(TestCase):
+    def test_shards(self):
+        shards = backfill.shard_range(date(2024, 1, 1), date(2024, 3, 5), days=30)
+        self.assertEqual(
+            [
+                Shard("2024-03-01", "2024-03-05"),
+                Shard("2024-01-31", "2024-02-29"),
+                Shard("2024-01-01", "2024-01-30"),
+            ],
+            shards,
+        )
+
+    def test_single_day(self):
+        shards = backfill.shard_range(date(2024, 1, 1), date(2024, 1, 1))
+        self.assertEqual([Shard("2024-01-01", "2024-01-01")], shards)
+
+    def test_backwards(self):
+        with self.assertRaises(ValueError):
+            backfill.shard_range(date(2024, 1, 2), date(2024, 1, 1))
+
+
+class ProgressTestCase(TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.progress = Progress(date(2024, 1, 1), date(2024, 3, 5), tmp_dir.name)
+        self.shards = backfill.shard_range(date(2024, 1, 1), date(2024, 3, 5))
+
+
+class TestProgress(ProgressTestCase):
+    def test_save_and_get(self):
+        shard = self.shards[0]
+        self.assertIsNone(self.progress.get(shard))
+        result = ShardResult(shard.from_date, shard.to_date, ["tt1"], 3, 1)
+        self.progress.save(result)
+        self.assertEqual(result, self.progress.get(shard))
+
+    def test_unreadable(self):
+        shard = self.shards[0]
+        os.makedirs(self.progress.path)
+        with open(os.path.join(self.progress.path, f"{shard.key}.json"), "w") as f:
+            f.write("{not json")
+        self.assertIsNone(self.progress.get(shard))
+
+    def test_clear(self):
+        shard = self.shards[0]
+        self.progress.save(ShardResult(shard.from_date, shard.to_date))
+        self.progress.clear()
+        self.assertFalse(os.path.exists(self.progress.path))
+
+
+class TestProcessShard(TestCase):
+    @mock.patch("backfill.PageCache", mock.MagicMock())
+    @mock.patch("backfill.guardian_api.get_articles")
+    def test_process_shard(self, mock_get_articles):
+        mock_get_articles.return_value = [
+            Article("film a", "url/a", "tt1"),
+            Article("film b", "url/b"),
+            Article("film c", "url/c"),
+            Article("film a again", "url/a2", "tt1"),
+        ]
+        enqueued = []
+        result = backfill.process_shard(
+            Shard("2024-01-01", "2024-01-30"),
+            enqueued.append,
+            lambda article: "tt2" if article.title == "film b" else None,
+        )
+        self.assertEqual(["tt1", "tt2"], sorted(result.imdb_ids))
+        self.assertEqual(4, result.articles)
+        self.assertEqual(1, result.unresolved)
+        self.assertEqual(["film c"], [article.title for article in enqueued])
+        kwargs = mock_get_articles.call_args.kwargs
+        self.assertEqual("2024-01-30", kwargs["to_date"].strftime("%Y-%m-%d"))
+
+
+class TestRunLocal(ProgressTestCase):
+    def result(self, shard, *imdb_ids):
+        return ShardResult(shard.from_date, shard.to_date, list(imdb_ids))
+
+    @mock.patch("backfill.process_shard")
+    def test_resumes(self, mock_process_shard):
+        done, *todo = self.shards
+        self.progress.save(self.result(done, "tt1"))
+        mock_process_shard.side_effect = lambda shard, *args: self.result(shard, "tt2")
+        backfill.run_local(self.shards, self.progress, enqueue=print)
+        self.assertEqual(
+            sorted(shard.key for shard in todo),
+            sorted(call.args[0].key for call in mock_process_shard.call_args_list),
+        )
+        for shard in self.shards:
+            self.assertIsNotNone(self.progress.get(shard))
+
+    @mock.patch("backfill.process_shard")
+    def test_failed_shard(self, mock_process_shard):
+        failing = self.shards[1]
+
+        def process_shard(shard, *args):
+            if shard == failing:
+                raise ValueError("guardian is down")
+            return self.result(shard)
+
+        mock_process_shard.side_effect = process_shard
+        with self.assertRaises(ValueError):
+            backfill.run_local(self.shards, self.progress, enqueue=print)
+        # The others are still saved, for next time.
+        self.assertIsNone(self.progress.get(failing))
+        self.assertEqual(
+            2, sum(self.progress.get(shard) is not None for shard in self.shards)
+        )
+
+    @mock.patch("backfill.trakt_api.update_list")
+    @mock.patch("backfill.get_secret", lambda _: {"MAX_LIST_SIZE": "3"})
+    def test_write(self, mock_update_list):
+        newest, middle, oldest = self.shards
+        self.progress.save(self.result(newest, "tt1", "tt2"))
+        self.progress.save(self.result(middle, "tt2", "tt3"))
+        self.progress.save(self.result(oldest, "tt4"))
+        imdb_ids = backfill.write(self.shards, self.progress)
+        # Deduped, and the oldest doesn't fit.
+        self.assertEqual(["tt1", "tt2", "tt3"], imdb_ids)
+        mock_update_list.assert_called_once_with(["tt1", "tt2", "tt3"])
+        self.assertFalse(os.path.exists(self.progress.path))
+
+    @mock.patch("backfill.trakt_api.update_list")
+    def test_write_unfinished(self, mock_update_list):
+        self.progress.save(self.result(self.shards[0], "tt1"))
+        with self.assertRaises(ValueError):
+            backfill.write(self.shards, self.progress)
+        mock_update_list.assert_not_called()
+
+
+class TestLambda(ProgressTestCase):
+    def setUp(self):
+        super().setUp()
+        self.metrics = capture_metrics(self)
+
+    @mock.patch("backfill.get_client")
+    def test_fan_out(self, mock_get_client):
+        sqs = mock_get_client.return_value
+        sqs.send_message_batch.side_effect = lambda QueueUrl, Entries: {
+            "Successful": [{"Id": entry["Id"]} for entry in Entries]
+        }
+        done = self.shards[0]
+        self.progress.save(ShardResult(done.from_date, done.to_date))
+        sent = backfill.fan_out(self.shards, self.progress, "https://shards")
+        self.assertEqual(self.shards[1:], sent)
+        entries = sqs.send_message_batch.call_args.kwargs["Entries"]
+        self.assertEqual(
+            self.shards[1:], [Shard(**json.loads(e["MessageBody"])) for e in entries]
+        )
+
+    @mock.patch("backfill.get_client")
+    def test_collect(self, mock_get_client):
+        sqs = mock_get_client.return_value
+        messages = [
+            {
+                "ReceiptHandle": str(n),
+                "Body": json.dumps(
+                    {"from_date": shard.from_date, "to_date": shard.to_date}
+                ),
+            }
+            for n, shard in enumerate(self.shards)
+        ]
+        # Another backfill's result, on the same queue.
+        messages.insert(
+            1,
+            {
+                "ReceiptHandle": "other",
+                "Body": json.dumps(
+                    {"from_date": "2020-01-01", "to_date": "2020-01-30"}
+                ),
+            },
+        )
+        sqs.receive_message.side_effect = [{"Messages": messages}]
+        sqs.delete_message_batch.return_value = {}
+        backfill.collect(self.shards, self.progress, "https://results")
+        for shard in self.shards:
+            self.assertIsNotNone(self.progress.get(shard))
+        entries = sqs.delete_message_batch.call_args.kwargs["Entries"]
+        self.assertEqual(
+            ["0", "1", "2"], [entry["ReceiptHandle"] for entry in entries]
+        )
+        self.assertEqual(
+            "other", sqs.change_message_visibility.call_args.kwargs["ReceiptHandle"]
+        )
+
+    @mock.patch("backfill.get_client")
+    def test_collect_timeout(self, mock_get_client):
+        mock_get_client.return_value.receive_message.return_value = {}
+        with self.assertRaises(TimeoutError):
+            backfill.collect(self.shards, self.progress, "https://results", timeout=0)
+
+    @mock.patch.dict(
+        "os.environ",
+        {
+            "MANUAL_PROCESSING_QUEUE_URL": "https://manual",
+            "BACKFILL_RESULT_QUEUE_URL": "https://results",
+        },
+    )
+    @mock.patch("backfill.Resolver", mock.MagicMock())
+    @mock.patch("backfill.process_shard")
+    @mock.patch("backfill.get_client")
+    def test_shard_handler(self, mock_get_client, mock_process_shard):
+        sqs = mock_get_client.return_value
+        sqs.send_message_batch.side_effect = lambda QueueUrl, Entries: {
+            "Successful": [{"Id": entry["Id"]} for entry in Entries]
+        }
+        shard = self.shards[0]
+
+        def process_shard(shard, enqueue, resolve):
+            METRICS.record_stage("fetch", 0.1)
+            return ShardResult(shard.from_date, shard.to_date, ["tt1"], 1, 0)
+
+        mock_process_shard.side_effect = process_shard
+        event = {"Records": [{"body": json.dumps(vars(shard))}]}
+        backfill.shard_handler(event, None)
+        self.assertEqual(["fetch"], stages(self.metrics))
+        self.assertEqual(shard, mock_process_shard.call_args.args[0])
+        call = sqs.send_message_batch.call_args
+        self.assertEqual("https://results", call.kwargs["QueueUrl"])
+        (entry,) = call.kwargs["Entries"]
+        self.assertEqual(["tt1"], json.loads(entry["MessageBody"])["imdb_ids"])
+
+    @mock.patch.dict(
+        "os.environ",
+        {
+            "MANUAL_PROCESSING_QUEUE_URL": "https://manual",
+            "BACKFILL_RESULT_QUEUE_URL": "https://results",
+        },
+    )
+    @mock.patch("backfill.Resolver", mock.MagicMock())
+    @mock.patch("backfill.process_shard")
+    @mock.patch("backfill.get_client")
+    def test_shard_handler_manual_failed(self, mock_get_client, mock_process_shard):
+        sqs = mock_get_client.return_value
+        sqs.send_message_batch.side_effect = lambda QueueUrl, Entries: {
+            "Failed": [
+                {"Id": entry["Id"], "SenderFault": True} for entry in Entries
+            ]
+        }
+        shard = self.shards[0]
+
+        def process_shard(shard, enqueue, resolve):
+            enqueue(Article("film c", "url/c"))
+            return ShardResult(shard.from_date, shard.to_date, [], 1, 1)
+
+        mock_process_shard.side_effect = process_shard
+        event = {"Records": [{"body": json.dumps(vars(shard))}]}
+        with self.assertRaises(RuntimeError):
+            backfill.shard_handler(event, None)
+        # The shard isn't reported done, so it's tried again.
+        self.assertEqual(
+            ["https://manual"],
+            [call.kwargs["QueueUrl"] for call in sqs.send_message_batch.call_args_list],
+        )
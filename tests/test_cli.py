@@ -0,0 +1,88 @@
+import json
+import threading
+import time
+from unittest import TestCase, mock
+
+import cli
+
+
+class TestPrefetch(TestCase):
+    def test_fetches_ahead(self):
+        read = []
+
+        def items():
+            for n in range(5):
+                read.append(n)
+                yield n
+
+        reviews = cli.prefetch(items(), lambda n: n * 10, depth=2)
+        item, future = next(reviews)
+        self.assertEqual((0, 0), (item, future.result()))
+        # While item 0 is being dealt with the next two are read and fetched.
+        for _ in range(50):
+            if len(read) >= 3:
+                break
+            time.sleep(0.01)
+        self.assertGreaterEqual(len(read), 3)
+        self.assertEqual(
+            [(1, 10), (2, 20), (3, 30), (4, 40)],
+            [(item, future.result()) for item, future in reviews],
+        )
+
+    def test_stops_when_closed(self):
+        read = []
+
+        def items():
+            for n in range(100):
+                read.append(n)
+                yield n
+
+        reviews = cli.prefetch(items(), lambda n: n, depth=2)
+        next(reviews)
+        reviews.close()
+        time.sleep(0.3)
+        # Didn't carry on reading everything after the caller went away.
+        self.assertLess(len(read), 10)
+
+    def test_error_raised(self):
+        def items():
+            yield 1
+            raise ValueError("no more")
+
+        reviews = cli.prefetch(items(), lambda n: n, depth=2)
+        next(reviews)
+        with self.assertRaises(ValueError):
+            next(reviews)
+
+
+class TestReviewMessages(TestCase):
+    @mock.patch("cli.prompt_best_match")
+    def test_interrupted(self, mock_prompt):
+        stopped = threading.Event()
+
+        def messages():
+            try:
+                for n in range(100):
+                    yield {
+                        "ReceiptHandle": str(n),
+                        "Body": json.dumps({"title": f"film {n}", "url": f"url{n}"}),
+                    }
+            finally:
+                stopped.set()
+
+        consumer = mock.MagicMock()
+        consumer.messages.side_effect = messages
+        buffer = mock.MagicMock()
+        mock_prompt.side_effect = ["tt1", KeyboardInterrupt]
+        try:
+            cli.review_messages(consumer, buffer, lambda title: [], depth=2)
+        except KeyboardInterrupt as e:
+            # Keeps the frames (and so the generators) alive, as happens when
+            # the CLI is interrupted at the top level.
+            traceback = e.__traceback__
+        else:
+            self.fail("KeyboardInterrupt not raised")
+        buffer.add.assert_called_once()
+        # The read ahead stopped with us, rather than waiting to receive more.
+        self.assertTrue(stopped.wait(1))
+        del traceback
@@ -1,36 +1,188 @@
+import json
+import tempfile
 import unittest
 from datetime import datetime
 from unittest import mock
 
+from requests import HTTPError
+
 import guardian_api
+from page_cache import PageCache
+
+
+def json_bytes(data) -> bytes:
+    return json.dumps(data).encode()
 
 
 @mock.patch("guardian_api.get_secret", lambda _: {"API_KEY": "123"})
-@mock.patch("guardian_api.requests.get")
+@mock.patch("guardian_api.get_session")
 class TestGuardianAPI(unittest.TestCase):
-    def test_get_articles(self, mock_get):
+    def test_get_articles(self, mock_get_session):
+        mock_get = mock_get_session.return_value.get
         article_data = {
             "webTitle": "a film review",
             "webUrl": "www.aurl.com",
             "references": [{"type": "imdb", "id": "imdb/tt123456"}],
         }
-        mock_get.return_value.json.return_value = {
-            "response": {
-                "results": [article_data],
-                "pages": 1,
+        mock_get.return_value.content = json_bytes(
+            {
+                "response": {
+                    "results": [article_data],
+                    "pages": 1,
+                }
             }
-        }
+        )
         expected_article = guardian_api.Article(
             title="a film",
             url="www.aurl.com",
-            imdb_id="imdb/tt123456"
+            imdb_id="tt123456"
         )
         yesterday = datetime(2024, 2, 29)
         articles = list(guardian_api.get_articles(yesterday))
-        self.assertEqual(1, len(list(articles)))
-        article = articles[0]
+        self.assertEqual([expected_article], articles)
+
+    def test_get_articles_multiple_pages(self, mock_get_session):
+        mock_get = mock_get_session.return_value.get
+
+        def page_response(url, params):
+            page = params["page"]
+            response = mock.MagicMock()
+            response.content = json_bytes(
+                {
+                    "response": {
+                        "results": [
+                            {
+                                "webTitle": f"film {page}{n} review",
+                                "webUrl": f"www.aurl.com/{page}/{n}",
+                            }
+                            for n in "ab"
+                        ],
+                        "pages": 3,
+                    }
+                }
+            )
+            return response
+
+        mock_get.side_effect = page_response
+        articles = list(
+            guardian_api.get_articles(datetime(2024, 2, 29), page_size=2)
+        )
+        self.assertEqual(3, mock_get.call_count)
+        self.assertEqual(
+            ["film 1a", "film 1b", "film 2a", "film 2b", "film 3a", "film 3b"],
+            [article.title for article in articles],
+        )
+        for call in mock_get.call_args_list:
+            self.assertEqual(2, call.kwargs["params"]["page-size"])
+
+    def test_get_pages_should_stop(self, mock_get_session):
+        mock_get = mock_get_session.return_value.get
+        mock_get.return_value.content = json_bytes(
+            {
+                "response": {
+                    "results": [
+                        {"webTitle": "a film review", "webUrl": "www.aurl.com"}
+                    ],
+                    "pages": 10,
+                }
+            }
+        )
+        pages = guardian_api.get_pages(
+            datetime(2024, 2, 29), start_page=3, should_stop=lambda: True
+        )
+        self.assertEqual([3], [page.number for page in pages])
+        self.assertEqual(1, mock_get.call_count)
+        self.assertEqual(3, mock_get.call_args.kwargs["params"]["page"])
 
-        # TODO: Switch to dataclass and do x in y.
-        self.assertEqual(article.title, "a film")
-        self.assertEqual(article.url, "www.aurl.com")
-        self.assertEqual(article.imdb_id, "tt123456")
+    def test_get_articles_cached(self, mock_get_session):
+        mock_get = mock_get_session.return_value.get
+        mock_get.return_value.content = json_bytes(
+            {
+                "response": {
+                    "results": [
+                        {"webTitle": "a film review", "webUrl": "www.aurl.com"}
+                    ],
+                    "pages": 1,
+                }
+            }
+        )
+        with tempfile.TemporaryDirectory() as path:
+            cache = PageCache(path)
+            first = list(guardian_api.get_articles(datetime(2024, 2, 29), cache=cache))
+            second = list(guardian_api.get_articles(datetime(2024, 2, 29), cache=cache))
+        self.assertEqual(1, mock_get.call_count)
+        self.assertEqual(
+            [a.to_dict() for a in first], [a.to_dict() for a in second]
+        )
+
+    def test_error_not_cached(self, mock_get_session):
+        mock_get = mock_get_session.return_value.get
+        mock_get.return_value.content = json_bytes(
+            {"response": {"status": "error", "message": "Invalid authentication"}}
+        )
+        mock_get.return_value.raise_for_status.side_effect = HTTPError("401")
+        with tempfile.TemporaryDirectory() as path:
+            cache = PageCache(path)
+            with self.assertRaises(HTTPError):
+                list(guardian_api.get_articles(datetime(2024, 2, 29), cache=cache))
+            with self.assertRaises(HTTPError):
+                list(guardian_api.get_articles(datetime(2024, 2, 29), cache=cache))
+        # Asked again the second time, rather than served the error.
+        self.assertEqual(2, mock_get.call_count)
+
+    def test_get_pages_to_date(self, mock_get_session):
+        mock_get = mock_get_session.return_value.get
+        mock_get.return_value.content = json_bytes(
+            {"response": {"results": [], "pages": 1}}
+        )
+        pages = guardian_api.get_pages(
+            datetime(2024, 1, 1), to_date=datetime(2024, 1, 31)
+        )
+        list(pages)
+        params = mock_get.call_args.kwargs["params"]
+        self.assertEqual("2024-01-01", params["from-date"])
+        self.assertEqual("2024-01-31", params["to-date"])
+        # Only the references are asked for, they're all we read.
+        self.assertEqual("imdb", params["show-references"])
+        self.assertNotIn("show-fields", params)
+
+    def test_get_articles_page_size_limit(self, mock_get_session):
+        with self.assertRaises(ValueError):
+            list(guardian_api.get_articles(datetime(2024, 2, 29), page_size=500))
+
+
+class TestParse(unittest.TestCase):
+    def test_parse_page(self):
+        data = {
+            "pages": 2,
+            "results": [
+                {
+                    "id": "film/2024/feb/29/dune-part-two-review",
+                    "webTitle": "Dune: Part Two review – a triumph",
+                    "webUrl": "www.aurl.com/dune",
+                    "webPublicationDate": "2024-02-29T12:00:00Z",
+                    "references": [
+                        {"type": "isbn", "id": "isbn/123"},
+                        {"type": "imdb", "id": "imdb/tt15239678"},
+                    ],
+                },
+                # No title we can use, so skipped.
+                {"webTitle": "Interview with a director", "webUrl": "x"},
+            ],
+        }
+        page = guardian_api.parse_page(1, data)
+        self.assertEqual(2, page.pages)
+        (article,) = page.articles
+        self.assertEqual(
+            guardian_api.Article(
+                "Dune: Part Two",
+                "www.aurl.com/dune",
+                "tt15239678",
+                "film/2024/feb/29/dune-part-two-review",
+                "2024-02-29T12:00:00Z",
+            ),
+            article,
+        )
+        # Round trips for SQS.
+        self.assertEqual(article, guardian_api.Article(**article.to_dict()))
+        self.assertFalse(hasattr(article, "__dict__"))
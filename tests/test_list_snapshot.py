@@ -0,0 +1,96 @@
+import os
+import tempfile
+from unittest import TestCase, mock
+
+import list_snapshot
+from list_snapshot import ListSnapshot
+
+
+def list_item(imdb_id, listed_at, rank):
+    return {
+        "rank": rank,
+        "listed_at": listed_at,
+        "type": "movie",
+        "movie": {"title": "A Film", "ids": {"trakt": rank, "imdb": imdb_id}},
+    }
+
+
+SUMMARY = {"item_count": 2, "updated_at": "2024-02-29T00:00:00.000Z"}
+ITEMS = [
+    list_item("tt2", "2024-02-28T00:00:00.000Z", 2),
+    list_item("tt1", "2024-02-27T00:00:00.000Z", 1),
+]
+
+
+class TestSync(TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = os.path.join(tmp_dir.name, "snapshot.json")
+        self.api_list = mock.MagicMock()
+        self.api_list.summary.return_value = dict(SUMMARY)
+        self.api_list.fetch.return_value.status_code = 200
+        self.api_list.fetch.return_value.headers = {"ETag": '"abc"'}
+        self.api_list.fetch.return_value.json.return_value = ITEMS
+
+    def test_first_sync_downloads_list(self):
+        snapshot = list_snapshot.sync(self.api_list, self.path)
+        self.api_list.fetch.assert_called_once_with(etag=None)
+        self.assertEqual(2, len(snapshot))
+        self.assertEqual(
+            {"imdb": "tt1", "trakt": 1, "listed_at": ITEMS[1]["listed_at"], "rank": 1},
+            snapshot.items[1],
+        )
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_unchanged_list_not_downloaded(self):
+        list_snapshot.sync(self.api_list, self.path)
+        self.api_list.fetch.reset_mock()
+        snapshot = list_snapshot.sync(self.api_list, self.path)
+        self.assertFalse(self.api_list.fetch.called)
+        self.assertEqual(2, len(snapshot))
+
+    def test_changed_list_uses_etag(self):
+        list_snapshot.sync(self.api_list, self.path)
+        self.api_list.summary.return_value["updated_at"] = "2024-03-01T00:00:00.000Z"
+        self.api_list.fetch.return_value.status_code = 304
+        snapshot = list_snapshot.sync(self.api_list, self.path)
+        self.api_list.fetch.assert_called_with(etag='"abc"')
+        self.assertEqual("2024-03-01T00:00:00.000Z", snapshot.updated_at)
+        self.assertEqual(2, len(snapshot))
+
+
+class TestListSnapshot(TestCase):
+    def setUp(self):
+        items = [list_snapshot.compact(item) for item in ITEMS]
+        self.snapshot = ListSnapshot(items, path="unused", **SUMMARY)
+
+    def test_oldest(self):
+        self.assertEqual(["tt1"], [item["imdb"] for item in self.snapshot.oldest(1)])
+
+    def test_apply_added(self):
+        result = {
+            "added": {"movies": 1},
+            "not_found": {"movies": [{"ids": {"imdb": "tt4"}}]},
+            "list": {"item_count": 3, "updated_at": "2024-03-01T00:00:00.000Z"},
+        }
+        self.snapshot.apply_added(["tt3", "tt4"], result)
+        imdb_ids = [item["imdb"] for item in self.snapshot.items]
+        self.assertEqual(["tt2", "tt1", "tt3"], imdb_ids)
+        self.assertEqual(3, self.snapshot.items[-1]["rank"])
+        self.assertTrue(self.snapshot.matches(result["list"]))
+
+    def test_apply_deleted(self):
+        result = {
+            "deleted": {"movies": 1},
+            "list": {"item_count": 1, "updated_at": "2024-03-01T00:00:00.000Z"},
+        }
+        self.snapshot.apply_deleted(["tt1"], result)
+        self.assertEqual(["tt2"], [i["imdb"] for i in self.snapshot.items])
+        self.assertTrue(self.snapshot.matches(result["list"]))
+
+    def test_out_of_step_snapshot_is_refetched(self):
+        # Trakt says the list has more in it than we think.
+        result = {"list": {"item_count": 5, "updated_at": "2024-03-01T00:00:00.000Z"}}
+        self.snapshot.apply_deleted(["tt1"], result)
+        self.assertFalse(self.snapshot.matches(result["list"]))
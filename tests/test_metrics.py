@@ -0,0 +1,60 @@
+import json
+from unittest import TestCase
+
+from metrics import MAX_VALUES, Metrics, current_endpoint, endpoint
+
+
+class TestMetrics(TestCase):
+    def test_requests(self):
+        metrics = Metrics()
+        metrics.record_request("trakt", "search_text", 200, 0.02, size=100)
+        metrics.record_request("trakt", "search_text", 429, 0.3)
+        metrics.record_retry("trakt", "search_text")
+        (line,) = metrics.lines()
+        (directive,) = line["_aws"]["CloudWatchMetrics"]
+        self.assertEqual("GoodFilms", directive["Namespace"])
+        self.assertEqual([["Service", "Endpoint"]], directive["Dimensions"])
+        self.assertIn({"Name": "Latency", "Unit": "Milliseconds"}, directive["Metrics"])
+        self.assertEqual("search_text", line["Endpoint"])
+        self.assertEqual([20.0, 300.0], line["Latency"])
+        self.assertEqual(2, line["Requests"])
+        self.assertEqual(1, line["Errors"])
+        self.assertEqual(1, line["Retries"])
+        self.assertEqual(100, line["ResponseBytes"])
+        self.assertEqual({"200": 1, "429": 1}, line["StatusCodes"])
+        self.assertEqual({"<=25ms": 1, "<=500ms": 1}, line["LatencyHistogram"])
+
+    def test_latencies_split(self):
+        metrics = Metrics()
+        for _ in range(MAX_VALUES + 1):
+            metrics.record_request("guardian", "search", 200, 0.01)
+        first, second = metrics.lines()
+        self.assertEqual(MAX_VALUES, len(first["Latency"]))
+        self.assertEqual(MAX_VALUES + 1, first["Requests"])
+        self.assertEqual(1, len(second["Latency"]))
+        self.assertNotIn("Requests", second)
+
+    def test_stages(self):
+        metrics = Metrics()
+        with metrics.timer("resolve"):
+            pass
+        with metrics.timer("resolve"):
+            pass
+        (line,) = metrics.lines()
+        self.assertEqual("resolve", line["Stage"])
+        self.assertEqual(2, line["Calls"])
+
+    def test_flush(self):
+        metrics = Metrics()
+        metrics.record_stage("fetch", 1)
+        written = []
+        metrics.flush(written.append)
+        self.assertEqual(1000, json.loads(written[0])["Duration"])
+        # Everything is forgotten once it's been written.
+        self.assertEqual([], metrics.lines())
+
+    def test_endpoint(self):
+        self.assertEqual("/path", current_endpoint("/path"))
+        with endpoint("list"):
+            self.assertEqual("list", current_endpoint("/path"))
+        self.assertEqual("/path", current_endpoint("/path"))
@@ -0,0 +1,62 @@
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from page_cache import PageCache, cache_key
+
+PARAMS = {
+    "api-key": "123",
+    "section": "film",
+    "show-fields": ["byline", "starRating"],
+    "from-date": "2024-02-29",
+    "to-date": "2024-03-01",
+    "page": 1,
+}
+
+
+class TestPageCache(TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = tmp_dir.name
+        self.cache = PageCache(self.path)
+
+    def test_key_ignores_api_key(self):
+        self.assertEqual(cache_key(PARAMS), cache_key({**PARAMS, "api-key": "456"}))
+        self.assertEqual(
+            cache_key(PARAMS), cache_key({**PARAMS, "show-fields": "byline,starRating"})
+        )
+        self.assertNotEqual(cache_key(PARAMS), cache_key({**PARAMS, "page": 2}))
+
+    def test_get_put(self):
+        self.assertIsNone(self.cache.get(PARAMS))
+        self.cache.put(PARAMS, {"pages": 1, "results": []})
+        self.assertEqual({"pages": 1, "results": []}, self.cache.get(PARAMS))
+        # The api key isn't written to disk.
+        (name,) = os.listdir(self.path)
+        self.assertNotIn("123", name)
+
+    def test_expiry(self):
+        self.cache.put(PARAMS, {"pages": 1, "results": []})
+        with mock.patch("page_cache.time.time", return_value=10**12):
+            self.assertIsNone(self.cache.get(PARAMS))
+        self.assertEqual([], os.listdir(self.path))
+
+    def test_today_ttl(self):
+        self.assertEqual(self.cache.ttl, self.cache.ttl_for(PARAMS))
+        open_ended = {k: v for k, v in PARAMS.items() if k != "to-date"}
+        self.assertEqual(self.cache.today_ttl, self.cache.ttl_for(open_ended))
+
+    def test_eviction(self):
+        self.cache.put({**PARAMS, "page": 1}, {"results": ["x" * 1000]})
+        self.cache.put({**PARAMS, "page": 2}, {"results": ["y" * 1000]})
+        size = sum(
+            os.path.getsize(os.path.join(self.path, f)) for f in os.listdir(self.path)
+        )
+        # Use page 1 so page 2 is the least recently used.
+        os.utime(self.cache._file({**PARAMS, "page": 2}), (0, 0))
+        self.cache.get({**PARAMS, "page": 1})
+        self.cache.max_bytes = size - 1
+        self.cache.evict()
+        self.assertIsNotNone(self.cache.get({**PARAMS, "page": 1}))
+        self.assertIsNone(self.cache.get({**PARAMS, "page": 2}))
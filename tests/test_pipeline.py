@@ -0,0 +1,122 @@
+import time
+from unittest import TestCase, mock
+
+from guardian_api import Article
+from metrics import Metrics
+from pipeline import Pipeline
+
+
+def articles(n, with_ids=True):
+    for i in range(n):
+        yield Article(f"film {i}", f"url{i}", f"tt{i}" if with_ids else None)
+
+
+class TestPipeline(TestCase):
+    def test_batches(self):
+        write_ids = mock.MagicMock()
+        enqueue = mock.MagicMock()
+        pipeline = Pipeline(write_ids, enqueue, batch_size=2)
+        stats = pipeline.run(articles(5))
+        self.assertEqual(
+            [mock.call(["tt0", "tt1"]), mock.call(["tt2", "tt3"]), mock.call(["tt4"])],
+            write_ids.call_args_list,
+        )
+        self.assertFalse(enqueue.called)
+        self.assertEqual(5, stats.imdb_ids)
+        self.assertEqual(3, stats.batches)
+
+    def test_unresolved(self):
+        write_ids = mock.MagicMock()
+        enqueue = mock.MagicMock()
+        stats = Pipeline(write_ids, enqueue).run(articles(3, with_ids=False))
+        self.assertEqual(3, enqueue.call_count)
+        self.assertFalse(write_ids.called)
+        self.assertEqual(3, stats.unresolved)
+
+    def test_resolved(self):
+        write_ids = mock.MagicMock()
+        enqueue = mock.MagicMock()
+
+        def resolve(article):
+            if article.title == "film 1":
+                raise ValueError("trakt is down")
+            return "tt100" if article.title == "film 0" else None
+
+        pipeline = Pipeline(write_ids, enqueue, resolve=resolve)
+        stats = pipeline.run(articles(3, with_ids=False))
+        # Resolved ids are written, the rest go to a human.
+        write_ids.assert_called_once_with(["tt100"])
+        self.assertEqual(2, enqueue.call_count)
+        self.assertEqual(1, stats.resolved)
+        self.assertEqual(2, stats.unresolved)
+
+    def test_should_stop(self):
+        enqueue = mock.MagicMock()
+        resolved = []
+
+        def resolve(article):
+            resolved.append(article.title)
+            return None
+
+        pipeline = Pipeline(
+            mock.MagicMock(),
+            enqueue,
+            resolve=resolve,
+            should_stop=lambda: len(resolved) >= 2,
+        )
+        stats = pipeline.run(articles(5, with_ids=False))
+        # Out of time after two, the rest skip straight to the queue.
+        self.assertEqual(["film 0", "film 1"], resolved)
+        self.assertEqual(5, enqueue.call_count)
+        self.assertEqual(5, stats.unresolved)
+
+    def test_resolve_read_ahead(self):
+        read = []
+        read_while_busy = []
+
+        def source():
+            for article in articles(20, with_ids=False):
+                read.append(article)
+                yield article
+
+        def resolve(article):
+            if article.title == "film 0":
+                time.sleep(0.2)
+                read_while_busy.append(len(read))
+            return None
+
+        Pipeline(
+            mock.MagicMock(), mock.MagicMock(), resolve=resolve, resolve_queue_size=3
+        ).run(source())
+        # Reading was held up while the resolver was busy: the one being
+        # resolved, three waiting and one waiting to get on the queue.
+        self.assertLessEqual(read_while_busy[0], 5)
+        self.assertEqual(20, len(read))
+
+    def test_stage_metrics(self):
+        metrics = Metrics()
+        with mock.patch("pipeline.METRICS", metrics):
+            Pipeline(mock.MagicMock(), mock.MagicMock()).run(articles(2))
+        stages = {line.get("Stage") for line in metrics.lines()}
+        # Only the trakt writer's own writes count as list writes.
+        self.assertIn("publish", stages)
+        self.assertNotIn("list_write", stages)
+
+    def test_flush_interval(self):
+        write_ids = mock.MagicMock()
+
+        def slow_articles():
+            yield from articles(1)
+            time.sleep(0.2)
+            # The first id has been written before the source is finished.
+            write_ids.assert_called_once_with(["tt0"])
+
+        Pipeline(write_ids, mock.MagicMock(), flush_interval=0.05).run(slow_articles())
+
+    def test_stage_error(self):
+        write_ids = mock.MagicMock(side_effect=ValueError("trakt is down"))
+        pipeline = Pipeline(write_ids, mock.MagicMock(), batch_size=1, queue_size=1)
+        with self.assertRaises(ValueError):
+            pipeline.run(articles(100))
+        # We stopped reading articles soon after the writer failed.
+        self.assertLess(pipeline.stats.articles, 100)
@@ -0,0 +1,61 @@
+from datetime import date
+from unittest import TestCase
+
+from processed_index import MAX_BYTES, ProcessedIndex
+
+
+class TestProcessedIndex(TestCase):
+    def test_add(self):
+        index = ProcessedIndex()
+        self.assertNotIn("film/1", index)
+        self.assertFalse(index.changed)
+        index.add("film/1")
+        self.assertIn("film/1", index)
+        self.assertNotIn("film/2", index)
+        self.assertTrue(index.changed)
+
+    def test_round_trip(self):
+        index = ProcessedIndex()
+        index.add("film/1")
+        loaded = ProcessedIndex.loads(index.dumps())
+        self.assertIn("film/1", loaded)
+        self.assertFalse(loaded.changed)
+
+    def test_expiry(self):
+        index = ProcessedIndex(today=date(2024, 3, 1))
+        index.add("film/1")
+        value = index.dumps()
+        self.assertIn("film/1", ProcessedIndex.loads(value, today=date(2024, 3, 8)))
+        later = ProcessedIndex.loads(value, today=date(2024, 3, 9))
+        self.assertNotIn("film/1", later)
+        self.assertTrue(later.changed)
+
+    def test_unreadable(self):
+        self.assertEqual(0, len(ProcessedIndex.loads("{not json")))
+
+    def test_size_limit(self):
+        index = ProcessedIndex(today=date(2024, 3, 1))
+        index.add("film/old")
+        index.today += 1
+        for n in range(1000):
+            index.add(f"film/{n}")
+        value = index.dumps(max_bytes=1000)
+        self.assertLessEqual(len(value), 1000)
+        loaded = ProcessedIndex.loads(value, today=date(2024, 3, 2))
+        # The oldest day goes first, then the last added (the oldest
+        # articles) from the day after.
+        self.assertNotIn("film/old", loaded)
+        self.assertIn("film/0", loaded)
+        self.assertNotIn("film/999", loaded)
+
+    def test_size_limit_one_day(self):
+        index = ProcessedIndex(today=date(2024, 3, 1))
+        for n in range(500):
+            index.add(f"film/{n}")
+        value = index.dumps()
+        self.assertLessEqual(len(value), MAX_BYTES)
+        loaded = ProcessedIndex.loads(value, today=date(2024, 3, 2))
+        self.assertNotIn("film/499", loaded)
+        # Articles come newest first, so the first added are kept.
+        kept = [n for n in range(500) if f"film/{n}" in loaded]
+        self.assertEqual(list(range(len(loaded))), kept)
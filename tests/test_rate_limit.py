@@ -0,0 +1,88 @@
+from unittest import TestCase, mock
+
+from rate_limit import MAX_RETRY_DELAY, RateLimitAdapter, TokenBucket
+
+URL = "https://api.trakt.tv/users/auser/lists/alist"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucket(TestCase):
+    def test_reserve(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=1, capacity=2, clock=clock)
+        # The first two calls are a burst, after that it's one a second.
+        self.assertEqual(0, bucket.reserve())
+        self.assertEqual(0, bucket.reserve())
+        self.assertEqual(1, bucket.reserve())
+        self.assertEqual(2, bucket.reserve())
+        clock.now = 10
+        self.assertEqual(0, bucket.reserve())
+
+    def test_pause(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=1, capacity=5, clock=clock)
+        bucket.pause(30)
+        self.assertEqual(30, bucket.reserve())
+        self.assertEqual(31, bucket.reserve())
+
+
+def make_response(status_code, headers=None):
+    response = mock.MagicMock()
+    response.status_code = status_code
+    response.headers = headers or {}
+    return response
+
+
+@mock.patch("rate_limit.time.sleep")
+@mock.patch("transport.TransportAdapter.send")
+class TestRateLimitAdapter(TestCase):
+    def setUp(self):
+        self.read_bucket = TokenBucket(rate=100, capacity=100)
+        self.write_bucket = TokenBucket(rate=100, capacity=100)
+        self.adapter = RateLimitAdapter(self.read_bucket, self.write_bucket)
+
+    def test_retry_after(self, mock_send, mock_sleep):
+        mock_send.side_effect = [
+            make_response(429, {"Retry-After": "5"}),
+            make_response(201),
+        ]
+        request = mock.MagicMock(method="POST", url=URL)
+        response = self.adapter.send(request)
+        self.assertEqual(201, response.status_code)
+        self.assertEqual(2, mock_send.call_count)
+        # Waited at least as long as we were asked to, plus some jitter.
+        delay = mock_sleep.call_args.args[0]
+        self.assertTrue(5 <= delay <= 6.1)
+
+    def test_gives_up(self, mock_send, mock_sleep):
+        self.adapter.rate_limit_retries = 2
+        mock_send.return_value = make_response(429, {"Retry-After": "1"})
+        response = self.adapter.send(mock.MagicMock(method="GET", url=URL))
+        self.assertEqual(429, response.status_code)
+        self.assertEqual(3, mock_send.call_count)
+
+    def test_retry_after_too_long(self, mock_send, mock_sleep):
+        mock_send.return_value = make_response(
+            429, {"Retry-After": "Fri, 01 Jan 2999 00:00:00 GMT"}
+        )
+        response = self.adapter.send(mock.MagicMock(method="GET", url=URL))
+        self.assertEqual(429, response.status_code)
+        self.assertEqual(1, mock_send.call_count)
+        mock_sleep.assert_not_called()
+
+    def test_remaining_header(self, mock_send, mock_sleep):
+        mock_send.return_value = make_response(
+            200, {"X-Ratelimit": '{"remaining": 0, "until": "2999-01-01T00:00:00Z"}'}
+        )
+        self.adapter.send(mock.MagicMock(method="GET", url=URL))
+        # The read bucket is now empty, writes are unaffected.
+        # Only for as long as we're prepared to wait though.
+        self.assertTrue(0 < self.read_bucket.reserve() < MAX_RETRY_DELAY + 1)
+        self.assertEqual(0, self.write_bucket.reserve())
@@ -0,0 +1,89 @@
+from unittest import TestCase, mock
+
+from guardian_api import Article
+from resolver import Resolver, TitleIndex, normalize_title
+
+
+def movie(title, year, imdb_id, slug=None):
+    return {
+        "type": "movie",
+        "movie": {
+            "title": title,
+            "year": year,
+            "ids": {"imdb": imdb_id, "slug": slug or imdb_id, "trakt": 1},
+        },
+    }
+
+
+class TestNormalizeTitle(TestCase):
+    def test_normalize(self):
+        self.assertEqual("amelie", normalize_title("Amélie"))
+        self.assertEqual("fast and furious", normalize_title("Fast & Furious!"))
+        self.assertEqual("spider man", normalize_title("  Spider-Man "))
+
+
+class TestTitleIndex(TestCase):
+    def test_search(self):
+        index = TitleIndex()
+        index.add("tt1", "The Zone of Interest")
+        index.add("tt2", "Interstellar")
+        scores = index.search("the zone of interest")
+        self.assertAlmostEqual(1.0, scores["tt1"])
+        self.assertLess(scores.get("tt2", 0), 0.5)
+
+    def test_best_title_per_key(self):
+        index = TitleIndex()
+        index.add("tt1", "Something Else")
+        index.add("tt1", "Les Misérables")
+        self.assertAlmostEqual(1.0, index.search("Les Miserables")["tt1"])
+
+
+class TestResolver(TestCase):
+    def setUp(self):
+        self.trakt = mock.MagicMock()
+        self.resolver = Resolver(self.trakt)
+
+    def test_exact_match(self):
+        self.trakt.search.by_text.return_value = [
+            movie("Past Lives", 2023, "tt13238346"),
+            movie("Past Lives of the Hero", 1990, "tt999"),
+        ]
+        article = Article("Past Lives", "url", date="2023-09-07T10:00:00Z")
+        self.assertEqual("tt13238346", self.resolver.resolve(article))
+        self.assertFalse(self.trakt.movie.called)
+
+    def test_year_disambiguates(self):
+        self.trakt.search.by_text.return_value = [
+            movie("Dune", 1984, "tt0087182"),
+            movie("Dune", 2021, "tt1160419"),
+        ]
+        article = Article("Dune", "url", date="2021-10-21T10:00:00Z")
+        self.assertEqual("tt1160419", self.resolver.resolve(article))
+
+    def test_ambiguous(self):
+        self.trakt.search.by_text.return_value = [
+            movie("Dune", 1984, "tt0087182"),
+            movie("Dune", 2021, "tt1160419"),
+        ]
+        # Without a date there's nothing to pick between them.
+        self.assertIsNone(self.resolver.resolve(Article("Dune", "url")))
+
+    def test_aliases(self):
+        self.trakt.search.by_text.return_value = [
+            movie("The Taste of Things", 2023, "tt19760052", slug="taste"),
+            movie("Taste", 2015, "tt111"),
+        ]
+        aliases = {
+            "taste": [{"title": "La Passion de Dodin Bouffant", "country": "fr"}],
+            "tt111": [],
+        }
+        self.trakt.movie.side_effect = lambda movie_id: mock.MagicMock(
+            aliases=mock.MagicMock(return_value=aliases[movie_id])
+        )
+        article = Article("La Passion de Dodin Bouffant", "url")
+        self.assertEqual("tt19760052", self.resolver.resolve(article))
+        self.trakt.movie.assert_any_call("taste")
+
+    def test_no_results(self):
+        self.trakt.search.by_text.return_value = []
+        self.assertIsNone(self.resolver.resolve(Article("Unknown", "url")))
@@ -0,0 +1,66 @@
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from search_cache import SearchCache, normalize_query
+from trakt_api import TraktAPI
+
+
+class TestSearchCache(TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = os.path.join(tmp_dir.name, "cache.sqlite3")
+        self.cache = SearchCache(self.path)
+        self.addCleanup(self.cache.close)
+
+    def test_normalize_query(self):
+        self.assertEqual("the godfather", normalize_query("  The   GODFATHER "))
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get("text:title:a film"))
+        self.cache.set("text:title:a film", [{"score": 1000}])
+        self.assertEqual([{"score": 1000}], self.cache.get("text:title:a film"))
+
+    def test_persisted(self):
+        self.cache.set("text:title:a film", [{"score": 1000}])
+        other = SearchCache(self.path)
+        self.addCleanup(other.close)
+        self.assertEqual([{"score": 1000}], other.get("text:title:a film"))
+
+    def test_expiry(self):
+        self.cache.set("text:title:a film", [])
+        with mock.patch("search_cache.time.time", return_value=10**12):
+            self.assertIsNone(self.cache.get("text:title:a film"))
+
+    def test_lru_eviction(self):
+        cache = SearchCache(self.path, max_entries=2, memory_entries=0)
+        self.addCleanup(cache.close)
+        with mock.patch("search_cache.time.time") as mock_time:
+            for now, key in enumerate(["a", "b"]):
+                mock_time.return_value = 1000 + now
+                cache.set(key, key)
+            # Using "a" makes "b" the least recently used.
+            mock_time.return_value = 1010
+            cache.get("a")
+            mock_time.return_value = 1020
+            cache.set("c", "c")
+            self.assertEqual("a", cache.get("a"))
+            self.assertIsNone(cache.get("b"))
+            self.assertEqual("c", cache.get("c"))
+
+
+@mock.patch("transport.requests.Session")
+class TestCachedSearchRoute(TestCase):
+    def test_repeat_search_cached(self, mock_session):
+        mock_get = mock_session.return_value.get
+        mock_get.return_value.json.return_value = [{"score": 1000}]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = SearchCache(os.path.join(tmp_dir, "cache.sqlite3"))
+            api = TraktAPI("fake_clientid", "fake_accesstoken", search_cache=cache)
+            self.assertEqual([{"score": 1000}], api.search.by_text("A Film"))
+            self.assertEqual([{"score": 1000}], api.search.by_text(" a  film"))
+            api.search.by_id("tt123")
+            api.search.by_id("TT123")
+            cache.close()
+        self.assertEqual(2, mock_get.call_count)
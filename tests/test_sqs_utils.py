@@ -0,0 +1,138 @@
+import json
+import time
+from unittest import TestCase, mock
+
+from sqs_utils import BatchConsumer, BatchProducer
+
+
+def body(n):
+    return json.dumps({"title": f"film {n}", "url": f"url{n}"})
+
+
+class TestBatchProducer(TestCase):
+    def setUp(self):
+        self.client = mock.MagicMock()
+        self.client.send_message_batch.side_effect = lambda QueueUrl, Entries: {
+            "Successful": [{"Id": entry["Id"]} for entry in Entries]
+        }
+
+    def test_batches_of_ten(self):
+        with BatchProducer(self.client, "https://aqueue") as producer:
+            for n in range(25):
+                producer.send(body(n))
+        sizes = sorted(
+            len(call.kwargs["Entries"])
+            for call in self.client.send_message_batch.call_args_list
+        )
+        self.assertEqual([5, 10, 10], sizes)
+        self.assertEqual(25, producer.sent)
+
+    def test_duplicates_sent_once(self):
+        with BatchProducer(self.client, "https://aqueue") as producer:
+            producer.send(body(1))
+            producer.send(body(1))
+        (entry,) = self.client.send_message_batch.call_args.kwargs["Entries"]
+        self.assertNotIn("MessageDeduplicationId", entry)
+
+    def test_fifo_dedupe_id(self):
+        with BatchProducer(self.client, "https://aqueue.fifo") as producer:
+            producer.send(body(1))
+        (entry,) = self.client.send_message_batch.call_args.kwargs["Entries"]
+        self.assertEqual(entry["Id"], entry["MessageDeduplicationId"][:80])
+
+    @mock.patch("sqs_utils.time.sleep")
+    def test_retries_only_failed(self, mock_sleep):
+        responses = iter([None, {"Successful": []}])
+
+        def send_message_batch(QueueUrl, Entries):
+            if next(responses) is None:
+                return {
+                    "Successful": [{"Id": e["Id"]} for e in Entries[1:]],
+                    "Failed": [{"Id": Entries[0]["Id"], "SenderFault": False}],
+                }
+            return {"Successful": [{"Id": e["Id"]} for e in Entries]}
+
+        self.client.send_message_batch.side_effect = send_message_batch
+        with BatchProducer(self.client, "https://aqueue") as producer:
+            for n in range(3):
+                producer.send(body(n))
+        retry = self.client.send_message_batch.call_args_list[1]
+        self.assertEqual(1, len(retry.kwargs["Entries"]))
+        self.assertEqual(3, producer.sent)
+        self.assertEqual([], producer.failed)
+
+    def test_sender_fault_not_retried(self):
+        self.client.send_message_batch.side_effect = lambda QueueUrl, Entries: {
+            "Successful": [],
+            "Failed": [{"Id": e["Id"], "SenderFault": True} for e in Entries],
+        }
+        with BatchProducer(self.client, "https://aqueue") as producer:
+            producer.send(body(1))
+        self.assertEqual(1, self.client.send_message_batch.call_count)
+        self.assertEqual(1, len(producer.failed))
+
+
+def message(n):
+    return {"MessageId": str(n), "ReceiptHandle": f"handle{n}", "Body": body(n)}
+
+
+class TestBatchConsumer(TestCase):
+    def setUp(self):
+        self.client = mock.MagicMock()
+        self.client.receive_message.side_effect = [
+            {"Messages": [message(n) for n in range(10)]},
+            {"Messages": [message(n) for n in range(10, 15)]},
+            {},
+        ]
+        self.client.delete_message_batch.return_value = {}
+
+    def test_receive_and_delete_in_batches(self):
+        with BatchConsumer(self.client, "https://aqueue") as consumer:
+            for msg in consumer.messages():
+                consumer.ack(msg)
+        self.assertEqual(3, self.client.receive_message.call_count)
+        kwargs = self.client.receive_message.call_args.kwargs
+        self.assertEqual(10, kwargs["MaxNumberOfMessages"])
+        self.assertEqual(20, kwargs["WaitTimeSeconds"])
+        deleted = [
+            entry["ReceiptHandle"]
+            for call in self.client.delete_message_batch.call_args_list
+            for entry in call.kwargs["Entries"]
+        ]
+        self.assertEqual(2, self.client.delete_message_batch.call_count)
+        self.assertEqual([f"handle{n}" for n in range(15)], deleted)
+
+    def test_unacked_not_deleted(self):
+        with BatchConsumer(self.client, "https://aqueue") as consumer:
+            for msg in consumer.messages():
+                if msg["MessageId"] != "3":
+                    consumer.ack(msg)
+        deleted = {
+            entry["ReceiptHandle"]
+            for call in self.client.delete_message_batch.call_args_list
+            for entry in call.kwargs["Entries"]
+        }
+        self.assertNotIn("handle3", deleted)
+
+    def test_release(self):
+        with BatchConsumer(self.client, "https://aqueue") as consumer:
+            for msg in consumer.messages():
+                consumer.release(msg, delay=5)
+        self.assertFalse(self.client.delete_message_batch.called)
+        change_visibility = self.client.change_message_visibility
+        self.assertEqual(15, change_visibility.call_count)
+        self.assertEqual(5, change_visibility.call_args.kwargs["VisibilityTimeout"])
+
+    def test_extends_visibility(self):
+        consumer = BatchConsumer(
+            self.client, "https://aqueue", heartbeat_interval=0.01
+        )
+        with consumer:
+            messages = consumer.messages()
+            next(messages)
+            time.sleep(0.1)
+        self.assertTrue(self.client.change_message_visibility_batch.called)
+        call = self.client.change_message_visibility_batch.call_args
+        entries = call.kwargs["Entries"]
+        self.assertEqual(10, len(entries))
+        self.assertEqual(120, entries[0]["VisibilityTimeout"])
@@ -1,8 +1,15 @@
+import io
 import json
+import os
+import tempfile
 from unittest import TestCase, mock
 
-from mock_functions import mock_get
+import requests
 
+from mock_functions import mock_get, mock_list_post
+
+import list_snapshot
+import trakt_api
 from trakt_api import TraktAPI, update_list
 
 mock_secret = mock.MagicMock(
@@ -19,11 +26,23 @@ mock_secret = mock.MagicMock(
 # Testing the high level function that corral concierge collate like a museum.
 @mock.patch.dict("os.environ", {"AWS_LAMBDA_FUNCTION_NAME": "LambdaFunctionName"})
 class TestUpdateList(TestCase):
+    def setUp(self):
+        trakt_api._get_api.cache_clear()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        snapshot_path = os.path.join(tmp_dir.name, "snapshot.json")
+        patcher = mock.patch.dict(
+            "os.environ", {"GOODFILMS_LIST_SNAPSHOT": snapshot_path}
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     @mock.patch("boto3.Session", mock.MagicMock)
-    @mock.patch("trakt_api.requests.Session")
+    @mock.patch("transport.requests.Session")
     @mock.patch("trakt_api.get_secret", mock_secret)
     def test_simple(self, mock_session):
         mock_session.return_value.get = mock.MagicMock(side_effect=mock_get)
+        mock_session.return_value.post = mock.MagicMock(side_effect=mock_list_post)
 
         update_list(["tt123"])
         mock_post = mock_session.return_value.post
@@ -33,13 +52,80 @@ class TestUpdateList(TestCase):
             data='{"movies": [{"ids": {"imdb": "tt123"}}]}',
         )
 
+    @mock.patch("transport.requests.Session")
+    @mock.patch("trakt_api.get_secret", mock_secret)
+    def test_skips_films_already_in_list(self, mock_session):
+        mock_session.return_value.get = mock.MagicMock(side_effect=mock_get)
+        mock_session.return_value.post = mock.MagicMock(side_effect=mock_list_post)
+
+        # tt654321 is already in the list, tt1 is asked for twice.
+        update_list(["tt654321", "tt1", "tt1"])
+        mock_post = mock_session.return_value.post
+        mock_post.assert_called_once_with(
+            "https://api.trakt.tv/users/auser/lists/alist/items",
+            data='{"movies": [{"ids": {"imdb": "tt1"}}]}',
+        )
+
+    @mock.patch("transport.requests.Session")
+    @mock.patch("trakt_api.get_secret", mock_secret)
+    def test_nothing_new(self, mock_session):
+        mock_session.return_value.get = mock.MagicMock(side_effect=mock_get)
+
+        update_list(["tt654321"])
+        self.assertFalse(mock_session.return_value.post.called)
+
+    @mock.patch("transport.requests.Session")
+    @mock.patch("trakt_api.get_secret", mock_secret)
+    def test_truncates_by_net_growth(self, mock_session):
+        mock_session.return_value.get = mock.MagicMock(side_effect=mock_get)
+        mock_session.return_value.post = mock.MagicMock(side_effect=mock_list_post)
+        mock_post = mock_session.return_value.post
+
+        # One film in a list of max 5, so 4 new ones fit.
+        update_list(["tt654321", "tt1", "tt2", "tt3", "tt4"])
+        self.assertEqual(1, mock_post.call_count)
+
+        # A fifth new one pushes the oldest out.
+        mock_post.reset_mock()
+        update_list(["tt1", "tt2", "tt3", "tt4", "tt5"])
+        remove_call = mock_post.call_args_list[0]
+        self.assertTrue(remove_call.args[0].endswith("/remove"))
+
+    @mock.patch("trakt_api.list_snapshot.sync")
+    @mock.patch("trakt_api.get_api")
+    @mock.patch("trakt_api.get_secret", mock_secret)
+    def test_truncates_after_concurrent_add(self, mock_get_api, mock_sync):
+        def snapshot(*imdb_ids):
+            items = [
+                {"imdb": imdb_id, "trakt": None, "listed_at": str(n), "rank": n}
+                for n, imdb_id in enumerate(imdb_ids)
+            ]
+            return list_snapshot.ListSnapshot(items, item_count=len(items))
+
+        # Room for tt1, but another writer adds tt8 and tt9 at the same time.
+        mock_sync.side_effect = [
+            snapshot("tt4", "tt5", "tt6", "tt7"),
+            snapshot("tt4", "tt5", "tt6", "tt7", "tt8", "tt1", "tt9"),
+        ]
+        api_list = mock_get_api.return_value.list.return_value
+        api_list.add.return_value = {
+            "added": {"movies": 1},
+            "list": {"item_count": 7},
+        }
+        api_list.delete.return_value = {
+            "deleted": {"movies": 2},
+            "list": {"item_count": 5},
+        }
+        update_list(["tt1"])
+        api_list.delete.assert_called_once_with(["tt4", "tt5"])
+
 
 # Testing the "routes" that we've put in trakt_api.py
 # These are really only testing that we've built the url correctly.
 # Could split out into just instantiating the route classes.
 @mock.patch.dict("os.environ", {"AWS_LAMBDA_FUNCTION_NAME": "LambdaFunctionName"})
 class TestSearch(TestCase):
-    @mock.patch("trakt_api.requests.Session")
+    @mock.patch("transport.requests.Session")
     def test_simple(self, mock_session):
 
         api = TraktAPI("fake_clientid", "fake_accesstoken")
@@ -51,7 +137,7 @@ class TestSearch(TestCase):
         )
 
 
-@mock.patch("trakt_api.requests.Session")
+@mock.patch("transport.requests.Session")
 @mock.patch.dict("os.environ", {"AWS_LAMBDA_FUNCTION_NAME": "LambdaFunctionName"})
 class TestList(TestCase):
     def test_get(self, mock_session):
@@ -97,3 +183,154 @@ class TestList(TestCase):
         data_kwarg = json.loads(call_kwargs["data"])
         self.assertTrue({"ids": {"imdb": "tt123"}} in data_kwarg["movies"])
         self.assertTrue({"ids": {"imdb": "tt123"}} in data_kwarg["movies"])
+
+    def test_add_chunked(self, mock_session):
+        mock_post = mock.MagicMock(side_effect=mock_list_post)
+        mock_session.return_value.post = mock_post
+        api = TraktAPI("fake_clientid", "fake_accesstoken")
+        imdb_ids = ["tt%d" % n for n in range(5)]
+        result = api.list("auser", "alist").add(imdb_ids, chunk_size=2)
+        self.assertEqual(3, mock_post.call_count)
+        posted = [
+            movie["ids"]["imdb"]
+            for call in mock_post.call_args_list
+            for movie in json.loads(call.kwargs["data"])["movies"]
+        ]
+        self.assertCountEqual(imdb_ids, posted)
+        self.assertEqual(5, result["added"]["movies"])
+
+    @mock.patch("trakt_api.time.sleep")
+    def test_add_retries_failed_chunk(self, mock_sleep, mock_session):
+        errors = iter([None, requests.exceptions.ConnectionError(), None])
+
+        def post(url, data):
+            error = next(errors)
+            if error:
+                raise error
+            return mock_list_post(url, data=data)
+
+        mock_post = mock.MagicMock(side_effect=post)
+        mock_session.return_value.post = mock_post
+        api = TraktAPI("fake_clientid", "fake_accesstoken")
+        api_list = api.list("auser", "alist")
+        result = api_list.add(["tt1", "tt2"], chunk_size=1, max_workers=1)
+        # The first chunk went through, the second was retried once.
+        self.assertEqual(3, mock_post.call_count)
+        self.assertEqual(2, result["added"]["movies"])
+
+
+class TestMergeResults(TestCase):
+    def test_merge(self):
+        results = [
+            {
+                "added": {"movies": 1, "shows": 0},
+                "existing": {"movies": 1},
+                "not_found": {"movies": [{"ids": {"imdb": "tt1"}}]},
+                "list": {"item_count": 3},
+            },
+            {
+                "added": {"movies": 2, "shows": 0},
+                "existing": {"movies": 0},
+                "not_found": {"movies": [{"ids": {"imdb": "tt2"}}]},
+                "list": {"item_count": 5},
+            },
+        ]
+        self.assertEqual(
+            {
+                "added": {"movies": 3, "shows": 0},
+                "existing": {"movies": 1},
+                "not_found": {
+                    "movies": [{"ids": {"imdb": "tt1"}}, {"ids": {"imdb": "tt2"}}]
+                },
+                "list": {"item_count": 5},
+            },
+            trakt_api.merge_results(results),
+        )
+
+
+class TestListBuffer(TestCase):
+    def test_flush_every(self):
+        api_list = mock.MagicMock()
+        api_list.add.return_value = {"added": {"movies": 2}}
+        with trakt_api.ListBuffer(api_list, flush_every=2) as buffer:
+            for imdb_id in ["tt1", "tt2", "tt3"]:
+                buffer.add(imdb_id)
+            api_list.add.assert_called_once_with(["tt1", "tt2"])
+        # The rest are written on exit.
+        api_list.add.assert_called_with(["tt3"])
+        self.assertEqual({"added": {"movies": 4}}, buffer.result)
+
+    def test_written_on_interrupt(self):
+        api_list = mock.MagicMock()
+        on_written = mock.MagicMock()
+        with self.assertRaises(KeyboardInterrupt):
+            with trakt_api.ListBuffer(api_list) as buffer:
+                buffer.add("tt1", on_written)
+                self.assertFalse(on_written.called)
+                raise KeyboardInterrupt
+        api_list.add.assert_called_once_with(["tt1"])
+        on_written.assert_called_once_with()
+
+    def test_not_written_on_failure(self):
+        api_list = mock.MagicMock()
+        api_list.add.side_effect = requests.exceptions.ConnectionError
+        on_written = mock.MagicMock()
+        buffer = trakt_api.ListBuffer(api_list)
+        buffer.add("tt1", on_written)
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            buffer.flush()
+        self.assertFalse(on_written.called)
+
+
+class StubAdapter(requests.adapters.HTTPAdapter):
+    """
+    Answers with 401 unless the request has the right token.
+    """
+
+    def __init__(self, token):
+        super().__init__()
+        self.token = token
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        authorized = request.headers["Authorization"] == f"Bearer {self.token}"
+        response.status_code = 200 if authorized else 401
+        response.raw = io.BytesIO(b"{}")
+        return response
+
+
+class TestReauthorize(TestCase):
+    def setUp(self):
+        self.adapter = StubAdapter("new")
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+
+    def test_retried_with_new_token(self):
+        reauthorize = mock.MagicMock(return_value="new")
+        api = TraktAPI("id", "old", session=self.session, reauthorize=reauthorize)
+        response = api.session.get("https://api.trakt.tv/users/auser/lists/alist")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, len(self.adapter.requests))
+        reauthorize.assert_called_once_with()
+        # Later requests use the new token straight away.
+        api.session.get("https://api.trakt.tv/users/auser/lists/alist")
+        self.assertEqual(3, len(self.adapter.requests))
+
+    def test_retried_once(self):
+        self.adapter.token = "newer"
+        reauthorize = mock.MagicMock(side_effect=["new", "newer"])
+        api = TraktAPI("id", "old", session=self.session, reauthorize=reauthorize)
+        response = api.session.get("https://api.trakt.tv/users/auser/lists/alist")
+        self.assertEqual(401, response.status_code)
+        self.assertEqual(2, len(self.adapter.requests))
+
+    def test_same_token(self):
+        reauthorize = mock.MagicMock(return_value="old")
+        api = TraktAPI("id", "old", session=self.session, reauthorize=reauthorize)
+        response = api.session.get("https://api.trakt.tv/users/auser/lists/alist")
+        self.assertEqual(401, response.status_code)
+        self.assertEqual(1, len(self.adapter.requests))
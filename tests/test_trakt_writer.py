@@ -0,0 +1,40 @@
+import json
+from unittest import TestCase, mock
+
+from mock_functions import capture_metrics, stages
+import trakt_writer
+
+
+def record(body) -> dict:
+    return {"messageId": "1", "body": body}
+
+
+class TestTraktWriter(TestCase):
+    def setUp(self):
+        self.metrics = capture_metrics(self)
+
+    @mock.patch("trakt_writer.trakt_api.update_list")
+    def test_batch_written(self, mock_update_list):
+        event = {
+            "Records": [
+                record(json.dumps({"imdb_id": "tt1"})),
+                record(json.dumps({"imdb_id": "tt2"})),
+            ]
+        }
+        trakt_writer.lambda_handler(event, None)
+        mock_update_list.assert_called_once_with(["tt1", "tt2"])
+        self.assertEqual(["list_write"], stages(self.metrics))
+
+    @mock.patch("trakt_writer.trakt_api.update_list")
+    def test_unreadable_skipped(self, mock_update_list):
+        event = {"Records": [record("not json"), record(json.dumps({}))]}
+        trakt_writer.lambda_handler(event, None)
+        mock_update_list.assert_not_called()
+
+    @mock.patch("trakt_writer.trakt_api.update_list")
+    def test_failure_raised(self, mock_update_list):
+        # So that SQS retries the batch.
+        mock_update_list.side_effect = ValueError("trakt is down")
+        event = {"Records": [record(json.dumps({"imdb_id": "tt1"}))]}
+        with self.assertRaises(ValueError):
+            trakt_writer.lambda_handler(event, None)
@@ -0,0 +1,34 @@
+from unittest import TestCase, mock
+
+import transport
+
+
+class TestTransport(TestCase):
+    def test_get_session_is_shared(self):
+        self.assertIs(transport.get_session("a"), transport.get_session("a"))
+        self.assertIsNot(transport.get_session("a"), transport.get_session("b"))
+
+    @mock.patch("requests.adapters.HTTPAdapter.send")
+    def test_default_timeout(self, mock_send):
+        mock_send.return_value.status_code = 200
+        adapter = transport.TransportAdapter()
+        request = mock.MagicMock(url="https://example.com/path")
+        adapter.send(request)
+        self.assertEqual(
+            transport.DEFAULT_TIMEOUT, mock_send.call_args.kwargs["timeout"]
+        )
+
+        adapter.send(request, timeout=1)
+        self.assertEqual(1, mock_send.call_args.kwargs["timeout"])
+
+    @mock.patch("transport.METRICS")
+    @mock.patch("requests.adapters.HTTPAdapter.send")
+    def test_metrics(self, mock_send, mock_metrics):
+        mock_send.return_value.status_code = 404
+        mock_send.return_value.raw.tell.return_value = 123
+        adapter = transport.TransportAdapter(service="guardian")
+        adapter.send(mock.MagicMock(url="https://example.com/search?q=1"))
+        service, endpoint, status, _, size = mock_metrics.record_request.call_args.args
+        self.assertEqual(
+            ("guardian", "/search", 404, 123), (service, endpoint, status, size)
+        )
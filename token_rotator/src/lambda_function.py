@@ -8,7 +8,11 @@ logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 client = boto3.client("secretsmanager")
-http = urllib3.PoolManager()
+# The rotator is packaged on its own so can't import src/transport.py, but
+# its pool is configured the same way: keep-alive, gzip and explicit
+# connect/read timeouts (the function itself only has 3 seconds).
+http = urllib3.PoolManager(timeout=urllib3.Timeout(connect=1.0, read=1.5))
+DEFAULT_HEADERS = urllib3.make_headers(keep_alive=True, accept_encoding=True)
 
 
 def lambda_handler(event, context):
@@ -62,7 +66,7 @@ def lambda_handler(event, context):
             "grant_type": "refresh_token",
         }
 
-        headers = {"Content-Type": "application/json"}
+        headers = {**DEFAULT_HEADERS, "Content-Type": "application/json"}
 
         response = http.request(
             "POST",
@@ -105,6 +109,7 @@ def lambda_handler(event, context):
             )["SecretString"]
         )
         headers = {
+            **DEFAULT_HEADERS,
             "Content-Type": "application/json",
             "Authorization": "Bearer %s" % secrets["ACCESS_TOKEN"],
             "trakt-api-version": "2",